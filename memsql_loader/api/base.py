@@ -1,4 +1,5 @@
 from memsql_loader.util import apsw_helpers, log
+from memsql_loader.loader_db import shards
 from memsql_loader.loader_db.storage import LoaderStorage
 
 class Api(object):
@@ -15,8 +16,10 @@ class Api(object):
     def _execute(self, params):
         raise NotImplemented()
 
-    def __db_caller(self, callback):
-        with self.storage.transaction() as cursor:
+    def __db_caller(self, callback, storage=None):
+        # API queries only read, so they use a read cursor and never wait
+        # behind writers for the write lock.
+        with (storage or self.storage).cursor() as cursor:
             return callback(cursor)
 
     def _db_query(self, *args, **kwargs):
@@ -27,3 +30,14 @@ class Api(object):
 
     def _db_get(self, *args, **kwargs):
         return self.__db_caller(lambda c: apsw_helpers.get(c, *args, **kwargs))
+
+    def _shard_db_query(self, shard, *args, **kwargs):
+        return self.__db_caller(lambda c: apsw_helpers.query(c, *args, **kwargs), LoaderStorage.shard(shard))
+
+    def _shard_db_get(self, shard, *args, **kwargs):
+        return self.__db_caller(lambda c: apsw_helpers.get(c, *args, **kwargs), LoaderStorage.shard(shard))
+
+    def _shard_schemas(self):
+        """ Attach the task shards to this thread's read connection, and
+        return their schema names for shared.job_tasks_subquery. """
+        return self.__db_caller(shards.attach_shards)
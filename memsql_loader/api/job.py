@@ -26,23 +26,15 @@ class Job(Api):
                 IFNULL(tasks_cancelled, 0)                                  AS tasks_cancelled,
                 IFNULL(tasks_succeeded, 0)                                  AS tasks_succeeded,
                 IFNULL(tasks_errored, 0)                                    AS tasks_errored,
-                %(state_projection)s                                        AS state
+                IFNULL(rows_loaded, 0)                                      AS rows_loaded,
+                download_start,
+                download_stop,
+                %(state_projection)s                                        AS state,
+                %(watch_columns)s
             FROM
                 jobs
-                LEFT JOIN(
-                    SELECT
-                        tasks.job_id,
-                        -- counts
-                        COUNT(tasks.id)                                     AS tasks_total,
-                        CAST(SUM(%(success_cond)s) AS SIGNED)               AS tasks_succeeded,
-                        CAST(SUM(%(error_cond)s) AS SIGNED)                 AS tasks_errored,
-                        CAST(SUM(%(cancelled_cond)s) AS SIGNED)             AS tasks_cancelled,
-                        CAST(SUM(%(finished_cond)s) AS SIGNED)              AS tasks_finished,
-                        CAST(SUM(%(queued_cond)s) AS SIGNED)                AS tasks_queued
-                    FROM tasks
-                    WHERE %(task_job_id_predicate)s
-                    GROUP BY tasks.job_id
-                ) AS job_tasks ON job_tasks.job_id = jobs.id
+                LEFT JOIN(%(job_tasks)s) AS job_tasks ON job_tasks.job_id = jobs.id
+                LEFT JOIN job_watches ON job_watches.job_id = jobs.id
             WHERE %(job_id_predicate)s
             LIMIT 2
         """ % generated_sql, **query_params)
@@ -59,20 +51,12 @@ class Job(Api):
     def _generate_sql(self, params):
         query_params = shared.TaskState.projection_params()
         return {
-            'success_cond': shared.TaskState.SUCCESS_CONDITION,
-            'error_cond': shared.TaskState.ERROR_CONDITION,
-            'cancelled_cond': shared.TaskState.CANCELLED_CONDITION,
-            'finished_cond': shared.TaskState.FINISHED_CONDITION,
-            'queued_cond': shared.TaskState.QUEUED_CONDITION,
+            'job_tasks': shared.job_tasks_subquery(self._shard_schemas()),
             'state_projection': shared.JobState.PROJECTION,
-            'task_job_id_predicate': self._task_job_id_predicate(params, query_params),
+            'watch_columns': shared.JOB_WATCH_COLUMNS,
             'job_id_predicate': self._job_id_predicate(params, query_params)
         }, query_params
 
-    def _task_job_id_predicate(self, params, query_params):
-        query_params['task_job_id_predicate'] = params['job_id'] + '%'
-        return 'tasks.job_id LIKE :task_job_id_predicate'
-
     def _job_id_predicate(self, params, query_params):
         query_params['job_id_predicate'] = params['job_id'] + '%'
         return 'jobs.id LIKE :job_id_predicate'
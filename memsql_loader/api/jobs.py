@@ -1,5 +1,3 @@
-import dateutil.parser
-
 from memsql_loader.api.base import Api
 from memsql_loader.api import shared
 from memsql_loader.api.validation import V, validate_enum, listor
@@ -38,46 +36,26 @@ class Jobs(Api):
                 bytes_total,
                 bytes_downloaded,
                 download_rate,
-                first_task_start
+                first_task_start,
+                %(watch_columns)s
             FROM
                 jobs
-                LEFT JOIN(
-                    SELECT
-                        tasks.job_id,
-
-                        MIN(tasks.started)                                      AS first_task_start,
-                        MAX(tasks.last_contact)                                 AS last_contact,
-
-                        -- counts
-                        -- These casts are necessary because MemSQL makes arbitrary choices
-                        COUNT(tasks.id)                                         AS tasks_total,
-                        CAST(SUM(%(cancelled_cond)s) AS SIGNED)                 AS tasks_cancelled,
-                        CAST(SUM(%(error_cond)s) AS SIGNED)                     AS tasks_errored,
-                        CAST(SUM(%(finished_cond)s) AS SIGNED)                  AS tasks_finished,
-                        CAST(SUM(%(queued_cond)s) AS SIGNED)                    AS tasks_queued,
-
-                        -- download information
-                        -- CAST because JSON number types are always floats
-                        CAST(SUM(tasks.bytes_total) AS SIGNED)        AS bytes_total,
-                        CAST(SUM(tasks.bytes_downloaded) AS SIGNED)   AS bytes_downloaded,
-                        CAST(SUM(tasks.download_rate) AS SIGNED)      AS download_rate
-                    FROM tasks
-                    GROUP BY tasks.job_id
-                ) AS job_tasks ON job_tasks.job_id = jobs.id
+                LEFT JOIN(%(job_tasks)s) AS job_tasks ON job_tasks.job_id = jobs.id
+                LEFT JOIN job_watches ON job_watches.job_id = jobs.id
             %(where_expr)s
             ORDER BY %(order_by)s %(order)s
             %(paging)s
         """ % generated_sql, **query_params)
 
+        shared.apply_live_job_progress(rows)
+
         # calculate time_left for each job
         for row in rows:
             time_left = -1
             no_nulls = None not in (row.last_contact, row.first_task_start, row.bytes_downloaded)
             if row.state == shared.JobState.RUNNING and no_nulls and row.bytes_downloaded != 0:
-                last_contact = dateutil.parser.parse(row.last_contact)
-                first_task_start = dateutil.parser.parse(row.first_task_start)
-                time_since_start = last_contact - first_task_start
-                overall_download_rate = row.bytes_downloaded / max(time_since_start.total_seconds(), 1)
+                time_since_start = row.last_contact - row.first_task_start
+                overall_download_rate = row.bytes_downloaded / float(max(time_since_start, 1))
                 bytes_remaining = row.bytes_total - row.bytes_downloaded
                 if overall_download_rate > 0:
                     time_left = bytes_remaining / overall_download_rate
@@ -89,11 +67,9 @@ class Jobs(Api):
     def _generate_sql(self, params):
         query_params = shared.TaskState.projection_params()
         return { k: v or '' for k, v in {
-            'cancelled_cond': shared.TaskState.CANCELLED_CONDITION,
-            'error_cond': shared.TaskState.ERROR_CONDITION,
-            'finished_cond': shared.TaskState.FINISHED_CONDITION,
-            'queued_cond': shared.TaskState.QUEUED_CONDITION,
+            'job_tasks': shared.job_tasks_subquery(self._shard_schemas()),
             'state_projection': shared.JobState.PROJECTION,
+            'watch_columns': shared.JOB_WATCH_COLUMNS,
             'order': params['order'],
             'order_by': params['order_by'],
             'where_expr': self._state_predicate(params, query_params),
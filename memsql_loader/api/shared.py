@@ -1,10 +1,12 @@
 import re
+from collections import defaultdict
 from datetime import datetime
 from dateutil import parser
 
 from clark.super_enum import SuperEnum
-from memsql_loader.util import super_json as json
-from memsql_loader.util.apsw_sql_step_queue.time_helpers import unix_timestamp
+from memsql_loader.util import super_json as json, progress_board
+from memsql_loader.util.attr_dict import AttrDict
+from memsql_loader.util.apsw_sql_step_queue.time_helpers import unix_timestamp, from_unix_timestamp
 
 TASKS_TTL = 120
 
@@ -20,7 +22,7 @@ class TaskState(SuperEnum):
     ERROR_CONDITION = 'tasks.result = \'error\''
     CANCELLED_CONDITION = 'tasks.result = \'cancelled\''
     FINISHED_CONDITION = 'tasks.finished IS NOT NULL'
-    QUEUED_CONDITION = 'tasks.finished IS NULL AND (tasks.execution_id IS NULL OR tasks.last_contact <= datetime(:now, "unixepoch", "-%s second"))' % TASKS_TTL
+    QUEUED_CONDITION = 'tasks.finished IS NULL AND (tasks.execution_id IS NULL OR tasks.last_contact <= :now - %s)' % TASKS_TTL
 
     # The cancelled condition is not necessary here since a cancelled
     # task also counts as finished, and UPPER(tasks.result) will return
@@ -44,9 +46,18 @@ class JobState(SuperEnum):
     RUNNING = SuperEnum.E
     FINISHED = SuperEnum.E
     CANCELLED = SuperEnum.E
+    # A watch job (see loader_db/watches.py) that has loaded every file it
+    # has found so far, and is waiting for more.
+    WATCHING = SuperEnum.E
 
+    # Expects job_watches to be left joined on job_watches.job_id = jobs.id
     PROJECTION = re.sub(r'\s+', ' ', '''
         (CASE
+            WHEN (
+                job_watches.job_id IS NOT NULL
+                AND job_watches.stopped IS NULL
+                AND (job_tasks.tasks_total IS NULL
+                    OR job_tasks.tasks_finished = job_tasks.tasks_total)) THEN 'WATCHING'
             WHEN (
                 (job_tasks.tasks_total - job_tasks.tasks_finished) = 0
                 AND job_tasks.tasks_cancelled > 0) THEN 'CANCELLED'
@@ -58,19 +69,87 @@ class JobState(SuperEnum):
         END)
     ''').strip()
 
+# Per-job task counts for JobState.PROJECTION, read from the job_stats table
+# (see loader_db/tasks.py) instead of aggregating the tasks table.  Claimed
+# tasks whose claim has expired count as queued again; only the (few)
+# claimed tasks are scanned for those, through tasks_claimed_idx.
+_JOB_STATS_COLUMNS = [
+    'job_id', 'tasks_total', 'tasks_finished', 'tasks_succeeded', 'tasks_errored',
+    'tasks_cancelled', 'tasks_claimed', 'bytes_total', 'bytes_downloaded',
+    'download_rate', 'first_task_start', 'last_contact', 'rows_loaded',
+    'download_start', 'download_stop'
+]
+
+_JOB_TASKS_SHARD_SUBQUERY = """
+    SELECT
+        %(columns)s,
+        job_stats.tasks_total - job_stats.tasks_finished - job_stats.tasks_claimed
+            + IFNULL(expired.tasks_expired, 0)                  AS tasks_queued
+    FROM
+        %(schema)sjob_stats AS job_stats
+        LEFT JOIN(
+            SELECT
+                tasks.job_id,
+                COUNT(*)                                        AS tasks_expired
+            FROM %(schema)stasks AS tasks
+            WHERE
+                tasks.finished IS NULL
+                AND tasks.execution_id IS NOT NULL
+                AND tasks.last_contact <= :now - %(ttl)s
+            GROUP BY tasks.job_id
+        ) AS expired ON expired.job_id = job_stats.job_id
+"""
+
+# The watch of each job, if it has one, for the jobs API
+JOB_WATCH_COLUMNS = re.sub(r'\s+', ' ', '''
+    job_watches.job_id IS NOT NULL AND job_watches.stopped IS NULL    AS watching,
+    job_watches.last_scan_start                                     AS watch_last_scan,
+    job_watches.next_scan                                           AS watch_next_scan,
+    job_watches.files_queued                                        AS watch_files_queued,
+    job_watches.last_error                                          AS watch_error
+''').strip()
+
+def job_tasks_subquery(schemas=(None,)):
+    """ Builds the job_tasks subquery over the job_stats of every task shard,
+    given the schema names returned by loader_db.shards.attach_shards.  Each
+    job is only ever in one shard. """
+    return '    UNION ALL'.join(_JOB_TASKS_SHARD_SUBQUERY % {
+        'columns': ', '.join('job_stats.%s' % column for column in _JOB_STATS_COLUMNS),
+        'schema': schema + '.' if schema is not None else '',
+        'ttl': TASKS_TTL
+    } for schema in schemas)
+
 class SortDirection(SuperEnum):
     DESC = SuperEnum.E
     ASC = SuperEnum.E
 
+# Timestamps are stored as unix timestamps in the loader DB; these are the
+# columns that get turned back into datetimes for API consumers.
+TIMESTAMP_COLUMNS = [ 'created', 'started', 'last_contact', 'finished', 'first_task_start' ]
+
+def _load_timestamps(row):
+    for column in TIMESTAMP_COLUMNS:
+        if column in row:
+            row[column] = from_unix_timestamp(row[column])
+
+def _load_step_time(value):
+    # Steps written before timestamps were stored as numbers hold ISO
+    # formatted strings.
+    if isinstance(value, basestring):
+        return parser.parse(value)
+    return from_unix_timestamp(value)
+
 def task_load_row(row):
     row['data'] = json.safe_loads(row.data or '', {})
 
     row['steps'] = json.safe_loads(row.steps or '', [])
     for step in row.steps:
         if 'start' in step:
-            step['start'] = parser.parse(step['start'])
+            step['start'] = _load_step_time(step['start'])
         if 'stop' in step:
-            step['stop'] = parser.parse(step['stop'])
+            step['stop'] = _load_step_time(step['stop'])
+
+    _load_timestamps(row)
 
     if 'state' in row and row.state in TaskState:
         row['state'] = TaskState[row.state]
@@ -80,7 +159,54 @@ def task_load_row(row):
 def job_load_row(row):
     row['spec'] = json.safe_loads(row.spec or '', {})
 
+    if 'watching' in row:
+        row['watching'] = bool(row.watching)
+        # How long ago the files that the watch has queued were listed; new
+        # files are only noticed by its next scan.
+        if row.watching and row.watch_last_scan is not None:
+            row['watch_lag'] = max(unix_timestamp(datetime.utcnow()) - row.watch_last_scan, 0)
+        else:
+            row['watch_lag'] = None
+        for column in ('watch_last_scan', 'watch_next_scan'):
+            row[column] = from_unix_timestamp(row[column])
+
+    _load_timestamps(row)
+
     if 'state' in row and row.state in JobState:
         row['state'] = JobState[row.state]
 
     return row
+
+def apply_live_task_progress(rows, live=None):
+    """ Overlay the live progress that workers publish on the progress board
+    onto task rows, since the loader DB only holds periodic checkpoints. """
+    if live is None:
+        live = progress_board.read_live_progress()
+    for row in rows:
+        progress = live.get(row.id)
+        if progress is not None:
+            row['bytes_downloaded'] = progress.bytes_downloaded
+            row['download_rate'] = progress.download_rate
+            row.data['time_left'] = progress.time_left
+    return rows
+
+def apply_live_job_progress(rows, live=None):
+    """ Correct the per-job sums of unloaded job rows with the live progress
+    of their running tasks. """
+    if live is None:
+        live = progress_board.read_live_progress()
+    deltas = defaultdict(lambda: AttrDict({ 'bytes_downloaded': 0, 'download_rate': 0, 'last_contact': 0 }))
+    for progress in live.itervalues():
+        delta = deltas[progress.job_id]
+        delta.bytes_downloaded += progress.bytes_downloaded - progress.checkpointed_bytes
+        delta.download_rate += progress.download_rate - progress.checkpointed_rate
+        delta.last_contact = max(delta.last_contact, int(progress.updated))
+
+    for row in rows:
+        if row.id not in deltas:
+            continue
+        delta = deltas[row.id]
+        row['bytes_downloaded'] = (row.bytes_downloaded or 0) + delta.bytes_downloaded
+        row['download_rate'] = (row.download_rate or 0) + delta.download_rate
+        row['last_contact'] = max(row.last_contact or 0, delta.last_contact)
+    return rows
@@ -1,4 +1,5 @@
 from memsql_loader.api.base import Api
+from memsql_loader.loader_db import shards
 from memsql_loader.api import exceptions
 from memsql_loader.api.validation import V
 from memsql_loader.api import shared
@@ -11,9 +12,13 @@ class Task(Api):
     def _execute(self, params):
         generated_sql, query_params = self._generate_sql(params)
 
-        task_row = self._db_get('''
+        shard = shards.shard_for_task(params['task_id'])
+        if not 0 <= shard < shards.num_shards():
+            raise exceptions.ApiException('No task found with id `%s`' % params['task_id'])
+
+        task_row = self._shard_db_get(shard, '''
             SELECT *, %(state_projection)s AS state
-            FROM tasks
+            FROM all_tasks AS tasks
             WHERE
                 %(task_id_predicate)s
             LIMIT 1
@@ -22,7 +27,8 @@ class Task(Api):
         if not task_row:
             raise exceptions.ApiException('No task found with id `%s`' % params['task_id'])
 
-        return shared.task_load_row(task_row)
+        task_row = shared.task_load_row(task_row)
+        return shared.apply_live_task_progress([ task_row ])[0]
 
     def _generate_sql(self, params):
         query_params = shared.TaskState.projection_params()
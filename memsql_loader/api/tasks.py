@@ -1,4 +1,5 @@
 from memsql_loader.api.base import Api
+from memsql_loader.loader_db import shards
 from memsql_loader.api.validation import V, validate_enum, listor
 from memsql_loader.api import shared, exceptions
 import sys
@@ -18,24 +19,30 @@ class Tasks(Api):
     def _execute(self, params):
         generated_sql, query_params = self._generate_sql(params)
 
-        job_count = self._db_get('''
-            SELECT COUNT(*) AS count
+        jobs = self._db_query('''
+            SELECT id
             FROM jobs
             WHERE %(job_id_predicate)s
-        ''' % generated_sql, **query_params).count
+            LIMIT 2
+        ''' % generated_sql, **query_params)
 
-        if job_count == 0:
+        if len(jobs) == 0:
             raise exceptions.ApiException('No job found with id `%s`' % params['job_id'])
-        elif job_count > 1:
+        elif len(jobs) > 1:
             raise exceptions.ApiException('More than one job matches id `%s`, try using a more specific prefix' % params['job_id'])
 
-        rows = self._db_query('''
+        # Filter all_tasks on the job id rather than joining it against
+        # jobs, so that SQLite can use the job_id indexes on both tables.
+        # All of the job's tasks are in the same shard.
+        query_params['job_id'] = jobs[0].id
+        shard = shards.shard_for_job(jobs[0].id, shards.num_shards())
+        rows = self._shard_db_query(shard, '''
             SELECT
                 tasks.*,
                 %(state_projection)s AS state
-            FROM tasks INNER JOIN jobs ON jobs.id = tasks.job_id
+            FROM all_tasks AS tasks
             WHERE
-                %(job_id_predicate)s
+                tasks.job_id = :job_id
                 %(state_predicate)s
             ORDER BY %(order_by)s %(order)s
             %(paging)s
@@ -47,7 +54,7 @@ class Tasks(Api):
             row['key_name'] = row.data['key_name']
             row['error_msg'] = row.data.get('error') or ''
             ret.append(row)
-        return ret
+        return shared.apply_live_task_progress(ret)
 
     def _generate_sql(self, params):
         query_params = shared.TaskState.projection_params()
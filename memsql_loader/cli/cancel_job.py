@@ -5,6 +5,7 @@ from memsql_loader.util import apsw_helpers, log
 
 from memsql_loader.loader_db.storage import LoaderStorage
 from memsql_loader.loader_db.tasks import Tasks
+from memsql_loader.loader_db.watches import Watches
 
 CANCEL_JOB_MESSAGE = '''
     Cancelled job%s matching ID `%s`, totalling %d task%s.
@@ -29,7 +30,9 @@ class CancelJob(Command):
 
         rows_affected = 0
         if self.options.multiple:
-            rows_affected = self.tasks.bulk_finish(extra_predicate=("job_id LIKE :job_id", { 'job_id': self.options.job_id + '%%' }))
+            predicate = ("job_id LIKE :job_id", { 'job_id': self.options.job_id + '%%' })
+            Watches().stop(predicate)
+            rows_affected = self.tasks.bulk_finish(extra_predicate=predicate)
         else:
             loader_storage = LoaderStorage()
             with loader_storage.transaction() as cursor:
@@ -47,7 +50,10 @@ class CancelJob(Command):
                 print '0 jobs match this job ID.'
                 sys.exit(1)
             else:
-                rows_affected = self.tasks.bulk_finish(extra_predicate=("job_id = :job_id", { 'job_id': jobs[0].id }))
+                # The watch is stopped first, so that it queues no more tasks
+                predicate = ("job_id = :job_id", { 'job_id': jobs[0].id })
+                Watches().stop(predicate)
+                rows_affected = self.tasks.bulk_finish(extra_predicate=predicate)
 
         job_suffix = '(s)' if self.options.multiple else ''
         task_suffix = 's' if not rows_affected == 1 else ''
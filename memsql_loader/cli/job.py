@@ -1,4 +1,4 @@
-import sys, datetime
+import sys
 
 from clark.super_enum import SuperEnum
 
@@ -7,7 +7,6 @@ from memsql_loader.util import log, super_json as json
 
 from memsql_loader.api import exceptions
 from memsql_loader.api.job import Job as JobApi
-from memsql_loader.api.tasks import Tasks as TasksApi
 
 class Job(Command):
     @staticmethod
@@ -24,7 +23,6 @@ class Job(Command):
     def run(self):
         self.logger = log.get_logger('Job')
         self.job_api = JobApi()
-        self.tasks_api = TasksApi()
 
         try:
             result = self.job_api.query({ 'job_id': self.options.job_id })
@@ -35,34 +33,20 @@ class Job(Command):
         if self.options.spec:
             print json.dumps(result.spec, sort_keys=True, indent=4 * ' ')
         else:
-            try:
-                finished_tasks = self.tasks_api.query({
-                    'job_id': self.options.job_id,
-                    'state': 'SUCCESS'
-                })
-            except exceptions.ApiException as e:
-                print e.message
-                sys.exit(1)
-
-            files_loaded = len(finished_tasks)
-            rows_loaded = reduce(lambda x, y: x + y.get('data', {}).get('row_count', 0), finished_tasks, 0)
+            # These are all maintained incrementally in job_stats, so they
+            # don't depend on the number of tasks in the job.
+            files_loaded = result.tasks_succeeded
+            rows_loaded = result.rows_loaded
             avg_rows_per_file = None
             avg_rows_per_second = None
 
             if files_loaded > 0:
                 avg_rows_per_file = rows_loaded / files_loaded
 
-                min_start_time = datetime.datetime.max
-                max_stop_time = datetime.datetime.min
-                for row in finished_tasks:
-                    for step in row.steps:
-                        if step['name'] == 'download':
-                            min_start_time = min(min_start_time, step['start'])
-                            max_stop_time = max(max_stop_time, step['stop'])
-                            break
-                    else:
-                        continue
-                avg_rows_per_second = rows_loaded / (max_stop_time - min_start_time).total_seconds()
+                if None not in (result.download_start, result.download_stop):
+                    download_seconds = result.download_stop - result.download_start
+                    if download_seconds > 0:
+                        avg_rows_per_second = rows_loaded / download_seconds
 
             result['stats'] = { k: v for k, v in {
                 'files_loaded': files_loaded,
@@ -82,6 +66,13 @@ class Job(Command):
 
             result = dict(result)
             del result['spec']
+            # Reported under stats
+            for key in ('rows_loaded', 'download_start', 'download_stop'):
+                del result[key]
+            if result['watch_last_scan'] is None and result['watch_next_scan'] is None:
+                # Not a watch job
+                for key in [ key for key in result if key.startswith('watch') ]:
+                    del result[key]
 
             result = { k: str(v) if isinstance(v, SuperEnum.Element) else v for k, v in result.iteritems() }
             print json.dumps(result, sort_keys=True, indent=4 * ' ')
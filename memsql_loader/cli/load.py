@@ -2,21 +2,26 @@
 
 import getpass
 import httplib
+import itertools
 import os
 import pycurl
 import sys
 import time
 
 from collections import defaultdict
+from datetime import datetime
 from memsql_loader.api import shared
 from memsql_loader.cli.server import ServerProcess
 from memsql_loader.db import load_data, pool
-from memsql_loader.loader_db.jobs import Jobs, Job
+from memsql_loader.loader_db.jobs import Jobs, Job, DEFAULT_LIST_CONCURRENCY
+from memsql_loader.loader_db import manifests
 from memsql_loader.loader_db.tasks import Tasks
 from memsql_loader.loader_db.storage import LoaderStorage
-from memsql_loader.util import bootstrap, log, db_utils, cli_utils, schema, webhdfs, servers
+from memsql_loader.loader_db.watches import Watches
+from memsql_loader.util import bootstrap, log, db_utils, cli_utils, file_lists, schema, webhdfs, servers
 from memsql_loader.util import super_json as json
 from memsql_loader.util.command import Command
+from memsql_loader.util.apsw_sql_step_queue.time_helpers import precise_unix_timestamp
 from simplejson import JSONDecodeError
 from boto.exception import S3ResponseError
 from boto.s3.connection import S3Connection
@@ -31,6 +36,10 @@ Error(s):
 For more information go to http://developers.memsql.com/docs/latest/loader/index.html.
 """
 
+# Files are submitted in batches of this many as they are listed, so that
+# only one batch of them is held in memory at a time however many a job has.
+SUBMIT_BATCH_SIZE = 10000
+
 class _PasswordNotSpecified(object):
     pass
 
@@ -83,12 +92,29 @@ class RunLoad(Command):
         file_access_options.add_argument('--aws-secret-key', type=str, default=None,
             help='AWS Secret Key (defaults to AWS_SECRET_ACCESS_KEY environment variable).')
 
+        file_access_options.add_argument('--list-concurrency', type=int, default=None,
+            help='Number of S3 prefixes or local directories to list, or HDFS checksums to fetch, at a time when matching '
+                 'paths (default %d, and 1 for local directories, which list fastest one at a time; network filesystems '
+                 'gain from more).' % DEFAULT_LIST_CONCURRENCY)
+
+        file_access_options.add_argument('--manifest', type=str, default=None,
+            help="A local file or S3 key that lists files to load, in addition to any paths. Its files are queued "
+                 "without listing anything; those it gives no size for are looked up on --list-concurrency threads.")
+        file_access_options.add_argument('--manifest-format', type=str, default=None, choices=file_lists.FORMATS,
+            help="The format of --manifest: one path per line, JSON objects with a path and optionally a size and "
+                 "etag, or CSV rows of path, size and etag. Defaults to jsonl for .jsonl/.json/.ndjson files, csv "
+                 "for .csv files, and lines otherwise.")
+
         file_access_options.add_argument('--hdfs-host', type=str, default=None,
             help='The hostname of the HDFS cluster namenode (for loading files from HDFS).')
         file_access_options.add_argument('--webhdfs-port', type=int, default=None,
             help='The WebHDFS port for the HDFS cluster namenode.')
         file_access_options.add_argument('--hdfs-user', type=str, default=None,
             help='The username to use when making HDFS requests.')
+        file_access_options.add_argument('--no-hdfs-checksums', dest='hdfs_checksums', default=None, action='store_false',
+            help="Don't fetch the checksums of HDFS files, which the datanodes compute by reading each whole file. Files "
+                 "are told apart by path, length and modification time instead, so a file copied to another path is no "
+                 "longer recognized as already loaded.")
 
         load_data_options = subparser.add_argument_group('load data options', description="Configure the target LOAD DATA command")
 
@@ -127,6 +153,22 @@ class RunLoad(Command):
         subparser.add_argument('--print-spec', default=False, action='store_true',
             help="Print a JSON spec for this load job rather than running it.")
 
+        subparser.add_argument('--incremental', default=None, choices=manifests.MODES,
+            help="Only load the files that are new or have changed since they were last loaded from the same path "
+                 "into the same table with --incremental. 'sorted' only lists the S3 keys that sort after the last "
+                 "key loaded, for paths where new keys always sort after old ones.")
+
+        watch_options = subparser.add_argument_group('watch options', description="Keep loading new files as they appear.")
+        watch_options.add_argument('--watch', default=None, action='store_true',
+            help="Keep scanning the paths after the files they match now have been queued, and load the new or changed "
+                 "files that each scan finds, until the job is cancelled. Implies --incremental=changed unless "
+                 "--incremental is given. The job is scanned by the MemSQL Loader server; on Linux, local paths are followed "
+                 "with inotify instead, and their files are loaded as soon as they have been written.")
+        watch_options.add_argument('--watch-interval', type=int, default=None,
+            help="Seconds between scans while scans keep finding new files; defaults to 60.")
+        watch_options.add_argument('--watch-max-interval', type=int, default=None,
+            help="Seconds between scans that the interval backs off to while scans find nothing new; defaults to 600.")
+
         subparser.add_argument('-f', '--force', default=False, action='store_true',
             help='Specify this flag to forcefully load all files in this job.\n'
                  'NOTE: This will cancel any currently queued or running tasks that are loading files in this job.')
@@ -221,11 +263,11 @@ class RunLoad(Command):
         except KeyError:
             paths = []
 
-        for path in paths:
-            if path.startswith('s3://'):
-                schema.DEFAULT_AWS_ACCESS_KEY = os.getenv('AWS_ACCESS_KEY_ID')
-                schema.DEFAULT_AWS_SECRET_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
-                break
+        # A manifest may list S3 keys, whatever its own path is
+        has_manifest = merged_spec.get('source', {}).get('manifest') is not None
+        if has_manifest or any(path.startswith('s3://') for path in paths):
+            schema.DEFAULT_AWS_ACCESS_KEY = os.getenv('AWS_ACCESS_KEY_ID')
+            schema.DEFAULT_AWS_SECRET_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
 
         try:
             self.job = Job(merged_spec)
@@ -287,6 +329,16 @@ Invalid command line options for load:
             print json.pformat(self.job.spec)
             sys.exit(0)
 
+        if self.job.spec.source.watch:
+            if self.options.sync:
+                self.logger.error("--sync can not be used with --watch, watch jobs never finish.")
+                sys.exit(1)
+            # The server scans the paths, from its own working directory
+            for path in self.job.paths + ([ self.job.file_list ] if self.job.file_list is not None else []):
+                if path.scheme == 'file' and not os.path.isabs(path.pattern):
+                    self.logger.error("--watch requires absolute file paths, %s is relative.", path)
+                    sys.exit(1)
+
     def validate_conditions(self):
         """ This happens after schema validation, and it checks the viability of the
         job based on "external" conditions like the existence of files, database connectivity,
@@ -296,6 +348,8 @@ Invalid command line options for load:
         self.s3_conn = None
         for path in self.job.paths:
             self.validate_path_conditions(path)
+        if self.job.file_list is not None:
+            self.validate_file_list_conditions(self.job.file_list)
 
         # validate database/table exists
         with pool.get_connection(database='INFORMATION_SCHEMA', **self.job.spec.connection) as conn:
@@ -314,15 +368,29 @@ Invalid command line options for load:
                 self.logger.error("The `file_id_column` specified (%s) must exist in the table and be of type BIGINT UNSIGNED", file_id_col)
                 sys.exit(1)
 
+    def connect_s3(self):
+        if self.s3_conn is not None:
+            return
+        is_anonymous = self.job.spec.source.aws_access_key is None or self.job.spec.source.aws_secret_key is None
+        if is_anonymous:
+            self.logger.debug('Either access key or secret key was not specified, connecting to S3 as anonymous')
+            self.s3_conn = S3Connection(anon=True)
+        else:
+            self.logger.debug('Connecting to S3')
+            self.s3_conn = S3Connection(self.job.spec.source.aws_access_key, self.job.spec.source.aws_secret_key)
+
+    def validate_file_list_conditions(self, path):
+        # The files it lists may be on S3 whatever its own path is
+        self.connect_s3()
+        if path.scheme == 's3':
+            self.validate_path_conditions(path)
+        elif not os.path.isfile(path.pattern):
+            self.logger.error("The manifest %s does not exist.", path.pattern)
+            sys.exit(1)
+
     def validate_path_conditions(self, path):
         if path.scheme == 's3':
-            is_anonymous = self.job.spec.source.aws_access_key is None or self.job.spec.source.aws_secret_key is None
-            if is_anonymous:
-                self.logger.debug('Either access key or secret key was not specified, connecting to S3 as anonymous')
-                self.s3_conn = S3Connection(anon=True)
-            else:
-                self.logger.debug('Connecting to S3')
-                self.s3_conn = S3Connection(self.job.spec.source.aws_access_key, self.job.spec.source.aws_secret_key)
+            self.connect_s3()
 
             try:
                 if not cli_utils.RE_VALIDATE_BUCKET_NAME.match(path.bucket):
@@ -379,27 +447,52 @@ Invalid command line options for load:
                     sys.exit(1)
 
     def queue_job(self):
-        all_keys = list(self.job.get_files(s3_conn=self.s3_conn))
+        # Incremental loads record the files they queue in the manifests,
+        # even with --force, which ignores what is in them.  The files are
+        # only recorded once all of them are queued, so that a load that is
+        # rolled back leaves the manifests as they were.
+        incremental = self.job.spec.source.incremental
+        self.manifests = manifests.Manifests() if incremental is not None else None
+        markers = None
+        if incremental == manifests.SORTED and not self.options.force:
+            markers = self.manifests.get_list_markers(self.job)
+
+        # The files are streamed from the listing, never held in a list.  A
+        # dry run lists them in a stable order.
+        scan_start = precise_unix_timestamp(datetime.utcnow())
+        keys = self.job.get_files(
+            s3_conn=self.s3_conn,
+            list_concurrency=self.options.list_concurrency,
+            ordered=self.options.dry_run,
+            markers=markers)
+        only_changed = incremental is not None and not self.options.force
+        if only_changed:
+            keys = self.manifests.filter_unchanged(self.job, keys)
 
         paths = self.job.spec.source.paths
+        if self.job.file_list is not None:
+            paths = paths + [ 'manifest %s' % self.job.file_list ]
+        matched_nothing = "Paths %s matched no %sfiles" % ([str(p) for p in paths], 'new or changed ' if only_changed else '')
 
         if self.options.dry_run:
             print "DRY RUN SUMMARY:"
             print "----------------"
-            if len(all_keys) == 0:
-                print "Paths %s matched no files" % ([str(p) for p in paths])
+            first_key = None
+            for key in keys:
+                if first_key is None:
+                    print "List of files to load:"
+                    first_key = key
+                print key.name
+            if first_key is None:
+                print matched_nothing
             else:
-                print "List of files to load:"
-                for key in all_keys:
-                    print key.name
                 print "Example LOAD DATA statement to execute:"
-                file_id = self.job.get_file_id(all_keys[0])
+                file_id = self.job.get_file_id(first_key)
                 print load_data.build_example_query(self.job, file_id)
             sys.exit(0)
-        elif len(all_keys) == 0:
-            self.logger.warning("Paths %s matched no files. Please check your path specification (be careful with relative paths)." % ([str(p) for p in paths]))
 
         self.jobs = None
+        self.tasks = None
         spec = self.job.spec
         try:
             self.logger.info('Creating job')
@@ -408,29 +501,39 @@ Invalid command line options for load:
 
             self.tasks = Tasks()
 
-            etags = []
-            for key in all_keys:
-                if key.scheme in ['s3', 'hdfs']:
-                    etags.append(key.etag)
-
-            if etags and not self.options.force:
+            # Incremental loads still skip the files that the manifests let
+            # through but other jobs are loading or have loaded under
+            # another name.
+            if not self.options.force:
                 database, table = spec.target.database, spec.target.table
                 host, port = spec.connection.host, spec.connection.port
                 competing_job_ids = [j.id for j in self.jobs.query_target(host, port, database, table)]
-                md5_map = self.get_current_tasks_md5_map(etags, competing_job_ids)
             else:
-                # For files loading on the filesystem, we are not going to MD5 files
-                # for performance reasons. We are also basing this on the assumption
-                # that filesystem loads are generally a one-time operation.
-                md5_map = None
-                if self.options.force:
-                    self.logger.info('Loading all files in this job, regardless of identical files that are currently loading or were previously loaded (because of the --force flag)')
-                if self.job.spec.options.file_id_column is not None:
-                    self.logger.info('Since you\'re using file_id_column, duplicate records will be checked and avoided')
-
-            count = self.submit_files(all_keys, md5_map, self.job, self.options.force)
-
-            if count == 0:
+                competing_job_ids = None
+                self.logger.info('Loading all files in this job, regardless of identical files that are currently loading or were previously loaded (because of the --force flag)')
+            if self.job.spec.options.file_id_column is not None:
+                self.logger.info('Since you\'re using file_id_column, duplicate records will be checked and avoided')
+
+            count, matched = self.submit_files(keys, competing_job_ids, self.job, self.options.force)
+            if self.manifests is not None:
+                self.manifests.commit_staged(self.job)
+
+            if matched == 0 and only_changed:
+                self.logger.info(matched_nothing)
+            elif matched == 0:
+                self.logger.warning(matched_nothing + ". Please check your path specification (be careful with relative paths).")
+
+            if spec.source.watch:
+                # The server takes over from here, and scans the paths again
+                # whenever the watch is due.
+                Watches().start(self.job, last_scan_start=scan_start, files_queued=count)
+                self.logger.info(
+                    "Successfully queued watch job with id: %s; it will keep loading new files until it is cancelled with "
+                    "memsql-loader cancel-job %s", self.job.id, self.job.id)
+
+                if not servers.is_server_running():
+                    self.start_server()
+            elif count == 0:
                 self.logger.info('Deleting the job, it has no child tasks')
                 try:
                     self.jobs.delete(self.job)
@@ -448,16 +551,46 @@ Invalid command line options for load:
         except (Exception, AssertionError):
             self.logger.error('Failed to submit files, attempting to roll back job creation...')
             exc_info = sys.exc_info()
-            if self.jobs is not None:
+            if self.jobs is not None and not self.keep_started_tasks():
                 try:
                     self.jobs.delete(self.job)
                 except:
                     self.logger.error("Rollback failed for job: %s", self.job.id)
+                if self.manifests is not None:
+                    try:
+                        self.manifests.discard_staged(self.job)
+                    except:
+                        self.logger.error("Failed to discard the files staged for the manifests of job: %s", self.job.id)
             # Have to use this old-style raise because raise just throws
             # the last exception that occured, which could be the one in
             # the above try/except block and not the original exception.
             raise exc_info[0], exc_info[1], exc_info[2]
 
+    def keep_started_tasks(self):
+        """ Cancels the tasks of a job that failed to be queued that no
+        worker has started yet.  Workers may have loaded files already, so if
+        any task was started, the job is kept, along with the files staged
+        for its manifests, and True is returned; cancelled files count as
+        unseen by the manifests (see loader_db/manifests.py). """
+        if self.tasks is None:
+            return False
+        try:
+            self.tasks.bulk_finish(extra_predicate=(
+                'job_id = :job_id AND execution_id IS NULL', { 'job_id': self.job.id }))
+            stats = self.tasks.get_job_stats(self.job.id)
+            if stats is None or stats.tasks_cancelled == stats.tasks_total:
+                return False
+            if self.manifests is not None:
+                self.manifests.commit_staged(self.job)
+        except:
+            # Workers may be loading its files, so it isn't safe to delete
+            self.logger.error("Failed to cancel the queued tasks of job %s, it is kept", self.job.id)
+            return True
+        self.logger.error(
+            "Workers had started loading files of job %s, so it is kept; its tasks that hadn't started were cancelled",
+            self.job.id)
+        return True
+
     def get_current_tasks_md5_map(self, etags, bad_job_ids):
         if not etags:
             return {}
@@ -485,57 +618,66 @@ Invalid command line options for load:
             ret += inlist_query(inlist[i:i + INLIST_SIZE])
         return ret
 
-    def submit_files(self, keys, md5_map, job, force):
-        if force:
-            def _finish_jobs_with_file_id(file_id_list):
-                # Opens us up to SQL injection, but we have to do this
-                # because we need uniform types or else the inlist will
-                # not be parameterized
-                # The reason for the sort is to avoid a deadlock inside MemSQL.
-                # Without the sort, we risk deadlocking against other QueueJobs
-                # running which collide on the same file_id(s).  More info: T11636
-                serialized = ','.join('"%s"' % str(file_id) for file_id in sorted(file_id_list))
-                return self.tasks.bulk_finish(extra_predicate=("file_id IN (%s)" % serialized, {}))
-            file_ids = [ job.get_file_id(key) for key in keys ]
-            tasks_cancelled = self.inlist_split(file_ids, _finish_jobs_with_file_id, 0)
-            if tasks_cancelled > 0:
-                if tasks_cancelled == 1:
-                    msg = "--force was specified, cancelled %d queued or running task that was loading a file identical to files in this job"
-                else:
-                    msg = "--force was specified, cancelled %d queued or running tasks that were loading files identical to files in this job"
-                self.logger.info(msg, tasks_cancelled)
+    def submit_files(self, keys, competing_job_ids, job, force):
+        """ Enqueues a task for each of keys, SUBMIT_BATCH_SIZE at a time.
+        Files identical to ones that the jobs in competing_job_ids are
+        loading or have loaded are skipped (files on the filesystem have no
+        MD5 to compare, for performance reasons, and we assume that
+        filesystem loads are generally a one-time operation); with force,
+        tasks of any job loading the same files are cancelled instead.
 
+        Returns the number of tasks enqueued and the number of keys. """
         self.logger.info('Submitting files')
 
+        keys = iter(keys)
+        index = 0
         count = 0
         ignored_count = 0
-        for index, key in enumerate(keys):
-            if index % 1000 == 0:
-                sys.stdout.write('. ')
-                sys.stdout.flush()
-
-            if not (md5_map and key.name in md5_map[key.etag]):
-                file_id = job.get_file_id(key)
-                data = {
-                    'scheme': key.scheme,
-                    'key_name': key.name
-                }
-                if key.bucket is not None:
-                    data['bucket'] = key.bucket.name
-                self.tasks.enqueue(
-                    data, job_id=job.id, file_id=str(file_id), md5=key.etag,
-                    bytes_total=key.size)
-                count += 1
-            else:
-                ignored_count += 1
+        tasks_cancelled = 0
+        while True:
+            batch = list(itertools.islice(keys, SUBMIT_BATCH_SIZE))
+            if not batch:
+                break
+
+            if force:
+                tasks_cancelled += self.tasks.bulk_finish_file_ids([ job.get_file_id(key) for key in batch ])
+
+            queued = []
+            md5_map = None
+            if competing_job_ids is not None:
+                etags = [ key.etag for key in batch if key.scheme in ['s3', 'hdfs'] ]
+                if etags:
+                    md5_map = self.get_current_tasks_md5_map(etags, competing_job_ids)
+
+            for key in batch:
+                if index % 1000 == 0:
+                    sys.stdout.write('. ')
+                    sys.stdout.flush()
+                index += 1
+
+                if not (md5_map and key.name in md5_map[key.etag]):
+                    job.enqueue_file(self.tasks, key)
+                    queued.append(key)
+                else:
+                    ignored_count += 1
+            count += len(queued)
+
+            if self.manifests is not None:
+                self.manifests.stage_files(job, queued)
 
         sys.stdout.write('\n')
+        if tasks_cancelled > 0:
+            if tasks_cancelled == 1:
+                msg = "--force was specified, cancelled %d queued or running task that was loading a file identical to files in this job"
+            else:
+                msg = "--force was specified, cancelled %d queued or running tasks that were loading files identical to files in this job"
+            self.logger.info(msg, tasks_cancelled)
         self.logger.info("Submitted %d files", count)
         if ignored_count > 0:
             self.logger.info("Ignored %d files that are identical to currently loading or previously loaded files.", ignored_count)
             self.logger.info('Run again with --force to load these files anyways.')
 
-        return count
+        return count, index
 
     def start_server(self):
         if self.options.no_daemon:
@@ -558,30 +700,30 @@ Invalid command line options for load:
 
     def wait_for_job(self):
         self.logger.info("Waiting for job %s to finish..." % self.job.id)
-        num_unfinished_tasks = -1
-        unfinished_states = [ shared.TaskState.RUNNING, shared.TaskState.QUEUED ]
-        predicate = ('job_id = :job_id', { 'job_id': self.job.id })
-        while num_unfinished_tasks != 0:
+        # job_stats is kept up to date as tasks change, so polling it costs
+        # the same however many tasks the job has.
+        while True:
             try:
                 time.sleep(0.5)
-                num_unfinished_tasks = len(self.tasks.get_tasks_in_state(
-                    unfinished_states, extra_predicate=predicate))
+                stats = self.tasks.get_job_stats(self.job.id)
+                if stats is None or stats.tasks_finished == stats.tasks_total:
+                    break
             except KeyboardInterrupt:
                 self.logger.info(
                     'Caught Ctrl-C. This load will continue running in the '
                     'background.  You can monitor its progress with '
                     'memsql-loader job %s' % (self.job.id))
                 sys.exit(0)
-        successful_tasks = self.tasks.get_tasks_in_state(
-            [ shared.TaskState.SUCCESS ], extra_predicate=predicate)
-        error_tasks = self.tasks.get_tasks_in_state(
-            [ shared.TaskState.ERROR ], extra_predicate=predicate)
-        cancelled_tasks = self.tasks.get_tasks_in_state(
-            [ shared.TaskState.CANCELLED ], extra_predicate=predicate)
-        self.logger.info("Job %s finished with %s successful tasks, %s cancelled tasks, and %s errored tasks" % (self.job.id, len(successful_tasks), len(cancelled_tasks), len(error_tasks)))
-        if error_tasks:
+        num_successful = stats.tasks_succeeded if stats is not None else 0
+        num_cancelled = stats.tasks_cancelled if stats is not None else 0
+        num_errored = stats.tasks_errored if stats is not None else 0
+        self.logger.info("Job %s finished with %s successful tasks, %s cancelled tasks, and %s errored tasks" % (self.job.id, num_successful, num_cancelled, num_errored))
+        if num_errored:
+            predicate = ('job_id = :job_id', { 'job_id': self.job.id })
+            error_tasks = itertools.islice(self.tasks.iter_tasks_in_state(
+                [ shared.TaskState.ERROR ], extra_predicate=predicate), 10)
             self.logger.info("Error messages include: ")
-            for task in error_tasks[:10]:
+            for task in error_tasks:
                 if task.data.get('error'):
                     self.logger.error(task.data['error'])
             self.logger.info("To see all error messages, run: memsql-loader tasks %s" % self.job.id)
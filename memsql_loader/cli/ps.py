@@ -1,6 +1,6 @@
 import curses
 import sys
-from datetime import datetime
+from datetime import datetime, timedelta
 from collections import OrderedDict, defaultdict
 
 from memsql_loader.api import shared, exceptions
@@ -31,7 +31,8 @@ class Processes(Command):
         ('progress', lambda row, for_display=False: row.bytes_downloaded or -1),
         ('rate', lambda row, for_display=False: row.download_rate or -1),
         ('time_left', lambda row, for_display=False: row.data.get('time_left', sys.maxint)),
-        ('last_contact', lambda row, for_display=False: row.last_contact or (None if for_display else datetime.min))
+        ('last_contact', lambda row, for_display=False: row.last_contact or (None if for_display else datetime.min)),
+        ('watch_lag', lambda row, for_display=False: row.watch_lag if row.watch_lag is not None else -1)
     ])
 
     @classmethod
@@ -59,6 +60,11 @@ class Processes(Command):
         self.logger = log.get_logger('Processes')
         self.error = False
         self.KEY_FN = self.JOBS_KEY_FN if self.options.jobs else self.TASKS_KEY_FN
+        self.tasks = Tasks()
+        # Running tasks by id, kept up to date from the change feed while
+        # watching
+        self._running_tasks = None
+        self._change_cursor = None
 
         if self.options.watch:
             # Takes care of setup and tear-down
@@ -101,7 +107,7 @@ class Processes(Command):
         if self.options.jobs:
             try:
                 active_rows = JobsApi().query({
-                    'state': [ shared.JobState.QUEUED, shared.JobState.RUNNING ],
+                    'state': [ shared.JobState.QUEUED, shared.JobState.RUNNING, shared.JobState.WATCHING ],
                 })
             except exceptions.ApiException as e:
                 self.error = True
@@ -113,7 +119,7 @@ class Processes(Command):
                     'time_left': row.time_left
                 }.iteritems() if v is not None }
         else:
-            active_rows = Tasks().get_tasks_in_state([ shared.TaskState.RUNNING ])
+            active_rows = shared.apply_live_task_progress(self._get_running_tasks())
 
         if len(active_rows) == 0:
             self.error = True
@@ -136,9 +142,11 @@ class Processes(Command):
             for key, fn in self.KEY_FN.iteritems():
                 formatted_row[key] = fn(row, for_display=True)
 
-            # The tasks column for jobs requires special formatting
+            # The tasks and watch_lag columns for jobs require special
+            # formatting
             if self.options.jobs:
                 formatted_row.update(self._format_tasks_col(row))
+                formatted_row['watch_lag'] = self._format_watch_lag(row)
 
             formatted_row.update(self._make_progress(row, 50))
             formatted_tasks.append(formatted_row)
@@ -152,6 +160,30 @@ class Processes(Command):
             format=TableFormat.TABLE
         ).format()
 
+    def _get_running_tasks(self):
+        if self._change_cursor is None:
+            # The cursor is taken first, so that no change made while the
+            # running tasks are read is missed.
+            self._change_cursor = self.tasks.change_cursor()
+            rows = self.tasks.get_tasks_in_state([ shared.TaskState.RUNNING ])
+            self._running_tasks = OrderedDict((row.id, row) for row in rows)
+        else:
+            changed, self._change_cursor = self.tasks.get_changes(self._change_cursor)
+            for row in changed:
+                if row.state == shared.TaskState.RUNNING:
+                    self._running_tasks[row.id] = row
+                else:
+                    self._running_tasks.pop(row.id, None)
+
+            # Tasks whose claim has expired are queued again, without
+            # having changed.
+            expired_before = datetime.utcnow() - timedelta(seconds=shared.TASKS_TTL)
+            for task_id, row in self._running_tasks.items():
+                if row.last_contact is None or row.last_contact <= expired_before:
+                    del self._running_tasks[task_id]
+
+        return sorted(self._running_tasks.values(), key=lambda row: row.id)
+
     def _sort(self, active_rows):
         if self.options.order_by not in self.KEY_FN.keys():
             print 'Invalid column to sort by'
@@ -168,6 +200,12 @@ class Processes(Command):
             'tasks': TASKS_FORMAT_STR.format(row.tasks_finished, row.tasks_total, self.max_tasks_digits)
         }
 
+    def _format_watch_lag(self, row):
+        if row.watch_lag is None:
+            return ''
+        lag = self._format_time(row.watch_lag)
+        return lag[:-len(' left')] if lag.endswith(' left') else lag
+
     def _create_formatted_totals_row(self, active_rows):
         totals_row = AttrDict({
             'tasks_finished': 0,
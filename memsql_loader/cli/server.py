@@ -4,17 +4,24 @@ from memsql_loader.util.command import Command
 from memsql_loader.util import log, cli_utils
 from memsql_loader.execution.worker_pool import WorkerPool
 from memsql_loader.db import pool
-from memsql_loader.loader_db import storage
+from memsql_loader.loader_db import shards, storage
+from memsql_loader.loader_db.archiver import TaskArchiver
+from memsql_loader.loader_db.watcher import JobWatcher
 from memsql_loader.util.daemonize import daemonize
 from memsql_loader.util.setuser import setuser
-from memsql_loader.util import bootstrap, servers
+from memsql_loader.util.apsw_storage import Snapshotter, WALCheckpointer
+from memsql_loader.util import apsw_sql_utility, bootstrap, servers
 import argparse
 import multiprocessing
+import os
 import time
 import sys
 import signal
 
 WORKER_WARN_THRESHOLD = 100
+DEFAULT_TASK_RETENTION_DAYS = 7
+DEFAULT_SNAPSHOT_INTERVAL = 60
+METRICS_LOG_INTERVAL = 60
 
 # This class is used in the load command to start a server with default
 # arguments in a separate process.
@@ -54,6 +61,10 @@ class Server(Command):
             help='Seconds before server automatically shuts down; defaults to never.')
         subparser.add_argument('-f', '--force-workers', action='store_true',
             help='Ignore warnings on number of workers. This is potentially dangerous!')
+        subparser.add_argument('--task-retention', default=DEFAULT_TASK_RETENTION_DAYS, type=float,
+            help='Days to keep finished tasks in the active task queue before archiving them; 0 disables archival. Archived tasks are still shown by the tasks, task and job commands.')
+        subparser.add_argument('--snapshot-interval', default=DEFAULT_SNAPSHOT_INTERVAL, type=int,
+            help='With --loader-db-mode=memory, seconds between snapshots of the loader database to disk; the database is also snapshotted when the server stops.')
 
     def ensure_bootstrapped(self):
         if not bootstrap.check_bootstrapped():
@@ -66,6 +77,10 @@ class Server(Command):
 
         self.exiting = False
         self.logger = log.get_logger('Server')
+        self.checkpointers = []
+        self.snapshotter = None
+        self.archiver = None
+        self.watcher = None
 
         if self.options.num_workers is not None and self.options.num_workers < 1:
             self.logger.error('number of workers must be a positive integer')
@@ -75,6 +90,14 @@ class Server(Command):
             self.logger.error('idle timeout must be a positive integer')
             sys.exit(1)
 
+        if self.options.task_retention < 0:
+            self.logger.error('task retention must not be negative')
+            sys.exit(1)
+
+        if self.options.snapshot_interval < 1:
+            self.logger.error('snapshot interval must be a positive integer')
+            sys.exit(1)
+
         # switch over to the correct user as soon as possible
         if self.options.set_user is not None:
             if not setuser(self.options.set_user):
@@ -92,7 +115,9 @@ class Server(Command):
                 daemonize(self.options.log_path)
             pool.recreate_pool()
 
-        # record the fact that we've started successfully
+        # record the fact that we've started successfully; the mode goes
+        # first, so that clients never see a running server without it
+        servers.write_mode_file(storage.get_loader_db_mode())
         servers.write_pid_file()
 
         if self.options.num_workers > WORKER_WARN_THRESHOLD and not self.options.force_workers:
@@ -103,15 +128,54 @@ class Server(Command):
         self.logger.debug('Starting worker pool')
         self.pool = WorkerPool(num_workers=self.options.num_workers, idle_timeout=self.options.idle_timeout)
 
+        # The server is the only process that checkpoints the loader
+        # database, so that workers never pay for it on their writes.  Each
+        # task shard has its own WAL.  MySQL loader databases have no WAL to
+        # checkpoint.
+        loader_storage = storage.LoaderStorage()
+        if loader_storage.dialect == apsw_sql_utility.SQLITE:
+            self.logger.debug('Starting WAL checkpointers')
+            for shard in xrange(shards.num_shards()):
+                checkpointer = WALCheckpointer(storage.LoaderStorage.shard(shard))
+                checkpointer.start()
+                self.checkpointers.append(checkpointer)
+
+            if storage.get_loader_db_mode() == storage.MEMORY_MODE:
+                # Tasks are enqueued after their job is saved, so the shards
+                # are snapshotted before the jobs in shard 0; that way every
+                # snapshotted task has its job in the snapshots too.
+                self.logger.info(
+                    'The loader database is kept in %s and snapshotted to %s every %d seconds',
+                    storage.get_memory_dir(), os.path.dirname(storage.get_shard_snapshot_path(0)), self.options.snapshot_interval)
+                self.snapshotter = Snapshotter([
+                    (storage.LoaderStorage.shard(shard), storage.get_shard_snapshot_path(shard))
+                    for shard in reversed(xrange(shards.num_shards())) ], interval=self.options.snapshot_interval)
+                self.snapshotter.start()
+
+        if self.options.task_retention > 0:
+            self.logger.debug('Starting task archiver')
+            self.archiver = TaskArchiver(int(self.options.task_retention * 24 * 60 * 60))
+            self.archiver.start()
+
+        self.logger.debug('Starting job watcher')
+        self.watcher = JobWatcher()
+        self.watcher.start()
+
         print 'MemSQL Loader Server running'
 
         loader_db_name = storage.MEMSQL_LOADER_DB
         has_valid_loader_db_conn = False
+        last_metrics_log = time.time()
         while not self.exiting:
             try:
+                if time.time() > last_metrics_log + METRICS_LOG_INTERVAL:
+                    self.log_metrics()
+                    last_metrics_log = time.time()
+
                 if bootstrap.check_bootstrapped():
                     has_valid_loader_db_conn = True
-                    if self.pool.poll():
+                    # Watch jobs keep the server from going idle
+                    if self.pool.poll(busy=self.watcher.is_watching()):
                         time.sleep(1)
                     else:
                         self.logger.info('Server has been idle for more than the idle timeout (%d seconds). Stopping.', self.options.idle_timeout)
@@ -127,6 +191,19 @@ class Server(Command):
 
         self.stop()
 
+    def log_metrics(self):
+        for shard, checkpointer in enumerate(self.checkpointers):
+            metrics = checkpointer.get_metrics()
+            self.logger.debug(
+                'Loader DB shard %d WAL size: %d bytes, checkpoints: %d (%d busy), last checkpoint: %s in %s sec, max checkpoint latency: %.3f sec',
+                shard, metrics['wal_size'], metrics['checkpoints'], metrics['busy_checkpoints'],
+                metrics['last_checkpoint_mode'], metrics['last_checkpoint_latency'], metrics['max_checkpoint_latency'])
+        if self.snapshotter is not None:
+            metrics = self.snapshotter.get_metrics()
+            self.logger.debug(
+                'Loader DB snapshots: %d (%d failed), last snapshot took %s sec',
+                metrics['snapshots'], metrics['failed_snapshots'], metrics['last_snapshot_latency'])
+
     def exit(self):
         # This function is used to stop the server's main loop from a different
         # thread.  This is useful for testing.
@@ -134,6 +211,20 @@ class Server(Command):
 
     def stop(self, unused_signal=None, unused_frame=None):
         self.pool.stop()
+        if self.archiver is not None:
+            self.archiver.stop()
+        if self.watcher is not None:
+            self.watcher.stop()
+        snapshotted = self.snapshotter.stop() if self.snapshotter is not None else False
+        for checkpointer in self.checkpointers:
+            checkpointer.stop()
+        if snapshotted:
+            storage.discard_memory_copy()
+        elif self.snapshotter is not None:
+            self.logger.warning(
+                'The final snapshot failed; the loader database is left in %s, and will be used '
+                'the next time the server is started in memory mode', storage.get_memory_dir())
         pool.close_connections()
         servers.delete_pid_file()
+        servers.delete_mode_file()
         sys.exit(0)
@@ -1,9 +1,13 @@
 """ Determines if a MemSQL Loader server is running. """
 
+import os
 import sys
+import time
 
 from memsql_loader.util.command import Command
-from memsql_loader.util import servers
+from memsql_loader.util import apsw_sql_utility, servers
+from memsql_loader.loader_db import shards, storage
+from memsql_loader.loader_db.storage import LoaderStorage
 
 class Status(Command):
     @staticmethod
@@ -12,6 +16,19 @@ class Status(Command):
         subparser.set_defaults(command=Status)
 
     def run(self):
+        loader_storage = LoaderStorage()
+        if loader_storage.dialect == apsw_sql_utility.MYSQL:
+            print 'Loader database: %s:%s/%s' % (loader_storage.host, loader_storage.port, loader_storage.database)
+        else:
+            num_shards = shards.num_shards()
+            wal_size = sum(LoaderStorage.shard(shard).wal_size() for shard in xrange(num_shards))
+            print 'Loader database WAL size: %d bytes (%d task shard%s)' % (wal_size, num_shards, '' if num_shards == 1 else 's')
+            if storage.get_loader_db_mode() == storage.MEMORY_MODE:
+                snapshot_path = storage.get_shard_snapshot_path(0)
+                if os.path.exists(snapshot_path):
+                    print 'Loader database is in memory, last snapshot: %s' % time.ctime(os.path.getmtime(snapshot_path))
+                else:
+                    print 'Loader database is in memory, and has never been snapshotted.'
         if servers.is_server_running():
             print 'A MemSQL Loader server is currently running.'
             sys.exit(0)
@@ -5,6 +5,7 @@ import sys
 import threading
 import time
 import os
+import stat
 import zlib
 
 from boto.exception import S3ResponseError
@@ -131,12 +132,15 @@ class Downloader(threading.Thread):
             globber = glob2.Globber()
             fname = globber._normalize_string(task.data['key_name'])
 
-            if not os.path.exists(fname):
+            # One stat, rather than one each for existence, type and size
+            try:
+                st = os.stat(fname)
+            except OSError:
                 raise WorkerException("File '%s' does not exist on this filesystem" % fname)
-            elif not os.path.isfile(fname):
+            if not stat.S_ISREG(st.st_mode):
                 raise WorkerException("File '%s' exists, but is not a file" % fname)
 
-            self.key = AttrDict({'name': fname, 'size': os.path.getsize(fname)})
+            self.key = AttrDict({'name': fname, 'size': st.st_size})
         else:
             raise WorkerException('Unsupported job with paths: %s' % [ str(p) for p in self.job.paths ])
 
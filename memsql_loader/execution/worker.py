@@ -6,6 +6,7 @@ import time
 import os
 import signal
 import traceback
+from collections import OrderedDict
 
 from memsql_loader.api import shared
 from memsql_loader.db import connection_wrapper, pool
@@ -16,19 +17,28 @@ from memsql_loader.execution.loader import Loader
 from memsql_loader.execution.downloader import Downloader
 from memsql_loader.util import db_utils, log
 from memsql_loader.util.fifo import FIFO
+from memsql_loader.util.progress_board import ProgressBoard, get_progress_board_path
 
 from memsql_loader.util.apsw_sql_step_queue.errors import APSWSQLStepQueueException, TaskDoesNotExist
 
 HUNG_DOWNLOADER_TIMEOUT = 3600
 
+# Live progress goes to the progress board every half second; the loader DB
+# only gets a checkpoint this often, which also serves as the heartbeat.
+PROGRESS_CHECKPOINT_INTERVAL = 10
+
+# Number of validated jobs each worker keeps around
+JOB_CACHE_SIZE = 128
+
 class ExitingException(Exception):
     pass
 
 class Worker(multiprocessing.Process):
-    def __init__(self, worker_sleep, parent_pid, worker_lock):
+    def __init__(self, worker_sleep, parent_pid, worker_lock, slot):
         self.worker_id = uuid.uuid1().hex[:8]
         self.worker_sleep = worker_sleep
         self.worker_lock = worker_lock
+        self.slot = slot
         self.worker_working = multiprocessing.Value('i', 1)
         self.parent_pid = parent_pid
         self._exit_evt = multiprocessing.Event()
@@ -59,7 +69,10 @@ class Worker(multiprocessing.Process):
 
     def run(self):
         self.jobs = Jobs()
-        self.tasks = Tasks()
+        # Spread the workers across the loader DB's task shards
+        self.tasks = Tasks(home_shard=self.slot)
+        self._job_cache = OrderedDict()
+        self.progress_board = ProgressBoard(get_progress_board_path(), writable=True)
         task = None
 
         ignore = lambda *args, **kwargs: None
@@ -77,7 +90,7 @@ class Worker(multiprocessing.Process):
                     self.worker_working.value = 1
 
                     job_id = task.job_id
-                    job = self.jobs.get(job_id)
+                    job = self._get_job(job_id)
 
                     old_conn_id = task.data.get('conn_id', None)
                     if old_conn_id is not None:
@@ -105,6 +118,8 @@ class Worker(multiprocessing.Process):
                     except Exception as e:
                         self.logger.debug("Traceback: %s" % (traceback.format_exc()))
                         raise
+                    finally:
+                        self.progress_board.clear(self.slot)
 
             raise ExitingException()
 
@@ -118,7 +133,7 @@ class Worker(multiprocessing.Process):
 
     def _process_task(self, task, db_connection):
         job_id = task.job_id
-        job = self.jobs.get(job_id)
+        job = self._get_job(job_id)
         if job is None:
             raise WorkerException('Failed to find job with ID %s' % job_id)
 
@@ -173,13 +188,20 @@ class Worker(multiprocessing.Process):
         loader.start()
         downloader.start()
 
+        self._checkpointed = (0, 0)
+        last_checkpoint = time.time()
         try:
             while not self.exiting():
                 time.sleep(0.5)
 
-                with task.protect():
-                    self._update_task(task, downloader)
-                    task.save()
+                self._publish_progress(task, downloader)
+                if time.time() > last_checkpoint + PROGRESS_CHECKPOINT_INTERVAL:
+                    with task.protect():
+                        self._update_task(task, downloader)
+                        task.save()
+                    last_checkpoint = time.time()
+                elif not task.valid():
+                    raise TaskDoesNotExist()
 
                 if downloader.is_alive() and time.time() > downloader.metrics.last_change + HUNG_DOWNLOADER_TIMEOUT:
                     # downloader has frozen, and the progress handler froze as well
@@ -249,6 +271,20 @@ class Worker(multiprocessing.Process):
             self._update_task(task, downloader)
             task.finish('success')
 
+    def _get_job(self, job_id):
+        """ Jobs never change once they have been saved, so validated Job
+        objects are kept in a small LRU cache instead of being loaded and
+        validated again for every task. """
+        job = self._job_cache.pop(job_id, None)
+        if job is None:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            if len(self._job_cache) >= JOB_CACHE_SIZE:
+                self._job_cache.popitem(last=False)
+        self._job_cache[job_id] = job
+        return job
+
     def _should_delete(self, job, task):
         competing_job_ids = ["'%s'" % j.id for j in self.jobs.query_target(job.spec.connection.host, job.spec.connection.port, job.spec.target.database, job.spec.target.table)]
         predicate_sql = "file_id = :file_id and job_id in (%s)" % ','.join(competing_job_ids)
@@ -322,6 +358,18 @@ class Worker(multiprocessing.Process):
         task.bytes_downloaded = stats['bytes_downloaded']
         task.download_rate = stats['download_rate']
         task.data['time_left'] = stats['time_left']
+        self._checkpointed = (task.bytes_downloaded or 0, task.download_rate or 0)
+
+    def _publish_progress(self, task, downloader):
+        stats = downloader.metrics.get_stats()
+        checkpointed_bytes, checkpointed_rate = self._checkpointed
+        self.progress_board.update(
+            self.slot, task.task_id, task.job_id,
+            bytes_downloaded=stats['bytes_downloaded'],
+            download_rate=stats['download_rate'],
+            time_left=stats['time_left'],
+            checkpointed_bytes=checkpointed_bytes,
+            checkpointed_rate=checkpointed_rate)
 
     def exiting(self):
         try:
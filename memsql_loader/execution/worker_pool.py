@@ -4,6 +4,7 @@ import time
 from memsql_loader.util import log
 from memsql_loader.execution.worker import Worker
 from memsql_loader.loader_db.storage import LoaderStorage
+from memsql_loader.util.progress_board import ProgressBoard, get_progress_board_path
 
 class WorkerPool(object):
     def __init__(self, num_workers=None, idle_timeout=None):
@@ -14,12 +15,17 @@ class WorkerPool(object):
         self.pid = os.getpid()
         self._worker_lock = multiprocessing.Lock()
         self._last_work_time = time.time()
+        # Each worker publishes live task progress to its own slot
+        self._progress_board = ProgressBoard.create(get_progress_board_path(), self.num_workers)
 
-    def poll(self):
+    def poll(self, busy=False):
+        """ Restarts any workers that have died.  Returns False if the pool
+        has been idle for longer than the idle timeout; busy tells it not to
+        count the current poll as idle. """
         running = [worker for worker in self._workers if worker.is_alive()]
 
         if self.idle_timeout is not None:
-            if any([worker.is_working() for worker in self._workers]):
+            if busy or any([worker.is_working() for worker in self._workers]):
                 self._last_work_time = time.time()
             elif time.time() > (self._last_work_time + self.idle_timeout):
                 return False
@@ -27,8 +33,13 @@ class WorkerPool(object):
         diff = self.num_workers - len(running)
         if diff > 0:
             self.logger.debug('Starting %d workers, for a total of %d', diff, self.num_workers)
+            used_slots = set(worker.slot for worker in running)
+            free_slots = [ slot for slot in xrange(self.num_workers) if slot not in used_slots ]
+            for slot in free_slots:
+                # Clear out anything a dead worker left behind
+                self._progress_board.clear(slot)
             with LoaderStorage.fork_wrapper():
-                running += [self._start_worker(i) for i in xrange(diff)]
+                running += [self._start_worker(i, slot) for i, slot in enumerate(free_slots)]
         self._workers = running
 
         return True
@@ -37,7 +48,7 @@ class WorkerPool(object):
         [worker.signal_exit() for worker in self._workers if worker.is_alive()]
         [worker.join() for worker in self._workers if worker.is_alive()]
 
-    def _start_worker(self, index):
-        worker = Worker(index * 0.1, self.pid, self._worker_lock)
+    def _start_worker(self, index, slot):
+        worker = Worker(index * 0.1, self.pid, self._worker_lock, slot)
         worker.start()
         return worker
@@ -0,0 +1,60 @@
+import threading
+import time
+from datetime import datetime
+
+from memsql_loader.loader_db.tasks import Tasks
+from memsql_loader.util import log
+from memsql_loader.util.apsw_sql_step_queue.time_helpers import unix_timestamp
+
+class TaskArchiver(threading.Thread):
+    """ Periodically moves finished tasks older than the retention window
+    from the tasks table into tasks_history.
+
+    Tasks are moved in small batches, each in its own short transaction,
+    with a pause in between so that workers can get at the write lock.
+    """
+
+    def __init__(self, retention, interval=60, batch_size=500, batch_pause=0.1):
+        """
+        retention       seconds to keep finished tasks in the tasks table
+        interval        seconds between archival passes
+        batch_size      maximum number of tasks to move per transaction
+        batch_pause     seconds to wait between batches
+        """
+        super(TaskArchiver, self).__init__(name='task-archiver')
+        self.daemon = True
+        self.retention = retention
+        self.interval = interval
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.logger = log.get_logger('TaskArchiver')
+        self._tasks = Tasks()
+        self._stopping = threading.Event()
+
+    def run(self):
+        while not self._stopping.is_set():
+            try:
+                self.poll()
+            except Exception:
+                self.logger.exception('Failed to archive finished tasks')
+            self._stopping.wait(self.interval)
+
+    def poll(self):
+        """ Archive everything that is currently past the retention window.
+        Returns the number of tasks that were archived. """
+        finished_before = unix_timestamp(datetime.utcnow()) - self.retention
+        archived = 0
+        while not self._stopping.is_set():
+            count = self._tasks.archive(finished_before, batch_size=self.batch_size)
+            archived += count
+            if count < self.batch_size:
+                break
+            time.sleep(self.batch_pause)
+
+        if archived > 0:
+            self.logger.info('Archived %d finished tasks', archived)
+        return archived
+
+    def stop(self):
+        self._stopping.set()
+        self.join()
@@ -1,28 +1,86 @@
+from memsql_loader.loader_db import shards
 from memsql_loader.loader_db.storage import LoaderStorage
 from memsql_loader.util.attr_dict import AttrDict
 from memsql_loader.util import super_json as json
-from memsql_loader.util import apsw_sql_utility, apsw_helpers, log, schema
+from memsql_loader.util import apsw_sql_utility, apsw_helpers, file_lists, schema
 from memsql_loader.util.apsw_sql_step_queue.time_helpers import unix_timestamp
 from memsql_loader.vendor import glob2
+from memsql_loader.vendor.glob2.parallel import ThreadPool
 
-from boto.exception import S3ResponseError
 from pywebhdfs.webhdfs import PyWebHdfsClient
 import uuid
 import datetime
-import os
 import hashlib
+import itertools
 
-PRIMARY_TABLE = apsw_sql_utility.TableDefinition('jobs', """\
+PRIMARY_TABLE = apsw_sql_utility.TableDefinition('jobs', { apsw_sql_utility.SQLITE: """\
 CREATE TABLE IF NOT EXISTS jobs (
     id BINARY(32) PRIMARY KEY,
-    created DATETIME NOT NULL,
-    spec TEXT NOT NULL
-)""", index_columns=('created',))
+    created INTEGER NOT NULL,
+    spec TEXT NOT NULL,
+
+    -- Copied out of spec so that jobs loading into the same table can be
+    -- found with an indexed lookup (see Jobs.query_target).
+    target_host TEXT,
+    target_port INTEGER,
+    target_database TEXT,
+    target_table TEXT
+)""", apsw_sql_utility.MYSQL: """\
+CREATE TABLE IF NOT EXISTS jobs (
+    id CHAR(32) PRIMARY KEY,
+    created BIGINT NOT NULL,
+    spec LONGTEXT NOT NULL,
+
+    target_host VARCHAR(255),
+    target_port INT,
+    target_database VARCHAR(64),
+    target_table VARCHAR(64)
+)""" }, index_columns=('created',), extra_sql=[
+    '''
+    CREATE INDEX IF NOT EXISTS jobs_target_idx
+    ON jobs (target_host, target_port, target_database, target_table)
+    '''
+])
+
+def target_columns(spec):
+    """ Returns the values of the target_* columns for a job spec. """
+    return (
+        spec['connection']['host'],
+        spec['connection']['port'],
+        spec['target']['database'],
+        spec['target']['table'])
+
+def local_file_key(load_path, entry):
+    """ The key (see Job.get_files) of entry, a glob2.FileEntry matched by
+    load_path, a file:// path. """
+    return AttrDict({
+        'scheme': 'file',
+        'name': entry.name,
+        'etag': None,
+        'size': entry.size,
+        'modified': entry.modified,
+        'bucket': None,
+        'load_path': str(load_path)
+    })
+
+def hdfs_stat_etag(entry):
+    """ Stands in for the checksum of entry, an HDFS glob2.FileEntry, in jobs
+    with source.hdfs_checksums off: the file is identified by its path,
+    length and modification time instead of its contents. """
+    identity = u'%s:%d:%d' % (entry.name, entry.size, int(round(entry.modified * 1000)))
+    return hashlib.md5(identity.encode('utf-8')).hexdigest()
 
 def hash_64_bit(value):
     result = hashlib.sha256(value.encode('utf-8'))
     return int(result.hexdigest()[:16], 16)
 
+def file_id(key):
+    """ Returns the file id of key, one of Job.get_files. """
+    bucket_name = ''
+    if key.bucket is not None:
+        bucket_name = key.bucket.name
+    return hash_64_bit(bucket_name + key.name)
+
 class Jobs(apsw_sql_utility.APSWSQLUtility):
     def __init__(self):
         super(Jobs, self).__init__(LoaderStorage())
@@ -33,17 +91,29 @@ class Jobs(apsw_sql_utility.APSWSQLUtility):
         assert isinstance(job, Job), 'job must be of type Job'
         with self.storage.transaction() as cursor:
             cursor.execute('''
-                REPLACE INTO jobs (id, created, spec)
-                VALUES (?, DATETIME(?, 'unixepoch'), ?)
-            ''', (job.id, unix_timestamp(datetime.datetime.utcnow()), job.json_spec()))
+                REPLACE INTO jobs (id, created, spec, target_host, target_port, target_database, target_table)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (job.id, unix_timestamp(datetime.datetime.utcnow()), job.json_spec()) + target_columns(job.spec))
 
     def delete(self, job):
+        """ Deletes job along with all of its tasks, e.g. to roll back a job
+        that failed to be queued.  The tasks are deleted in the same
+        transaction as the job if they are in the same database (shard 0,
+        or MySQL); otherwise they are deleted first, so that workers never
+        claim a task whose job is gone. """
         assert isinstance(job, Job), 'job must be of type Job'
-        with self.storage.transaction() as cursor:
-            cursor.execute('DELETE FROM jobs WHERE id = ?', (job.id,))
+        shard_storage = LoaderStorage.shard(shards.shard_for_job(job.id, shards.num_shards()))
+        with shard_storage.transaction() as cursor:
+            for table in ('tasks', 'tasks_history', 'job_stats'):
+                cursor.execute('DELETE FROM %s WHERE job_id = ?' % table, (job.id,))
+            if shard_storage is self.storage:
+                cursor.execute('DELETE FROM jobs WHERE id = ?', (job.id,))
+        if shard_storage is not self.storage:
+            with self.storage.transaction() as cursor:
+                cursor.execute('DELETE FROM jobs WHERE id = ?', (job.id,))
 
     def get(self, job_id):
-        with self.storage.transaction() as cursor:
+        with self.storage.cursor() as cursor:
             job = apsw_helpers.get(
                 cursor, 'SELECT id, spec FROM jobs WHERE id = ?', job_id)
 
@@ -60,21 +130,28 @@ class Jobs(apsw_sql_utility.APSWSQLUtility):
 
     def query_target(self, host, port, database, table):
         with self.storage.cursor() as cursor:
-            result = apsw_helpers.query(cursor, 'SELECT id, spec FROM jobs')
-
-        ret = []
-        for job in result:
-            spec = json.loads(job.spec)
-            if spec['connection']['host'] != host:
-                continue
-            if spec['connection']['port'] != port:
-                continue
-            if spec['target']['database'] != database:
-                continue
-            if spec['target']['table'] != table:
-                continue
-            ret.append(Job(spec, job.id))
-        return ret
+            result = apsw_helpers.query(cursor, '''
+                SELECT id, spec FROM jobs
+                WHERE
+                    target_host = :host
+                    AND target_port = :port
+                    AND target_database = :database
+                    AND target_table = :table
+            ''', host=host, port=port, database=database, table=table)
+
+        return [Job(json.loads(job.spec), job.id) for job in result]
+
+# Number of S3 prefixes to list, or HDFS checksums to fetch, at a time
+# while matching a job's paths
+DEFAULT_LIST_CONCURRENCY = 16
+
+# Number of local directories to list at a time; local disks list fastest
+# one directory at a time.
+DEFAULT_LOCAL_LIST_CONCURRENCY = 1
+
+# The files named by a job's file list are read this many at a time, and
+# the ones whose sizes must be looked up are looked up together.
+FILE_LIST_BATCH_SIZE = 1000
 
 class Job(object):
     def __init__(self, spec, job_id=None):
@@ -82,22 +159,47 @@ class Job(object):
         self.id = job_id if job_id is not None else uuid.uuid1().hex
         self.spec = schema.validate_spec(spec)
         self.paths = [ schema.LoadPath(path) for path in self.spec.source.paths ]
+        self.file_list = None
+        if self.spec.source.manifest is not None:
+            self.file_list = schema.LoadPath(self.spec.source.manifest)
 
     def json_spec(self):
         return json.dumps(self.spec)
 
     def get_file_id(self, key):
         """ Returns the file id for the specified key """
-        bucket_name = ''
+        return file_id(key)
+
+    def enqueue_file(self, tasks, key):
+        """ Queues a task in tasks to load key, one of get_files. """
+        data = {
+            'scheme': key.scheme,
+            'key_name': key.name
+        }
         if key.bucket is not None:
-            bucket_name = key.bucket.name
-        return hash_64_bit(bucket_name + key.name)
+            data['bucket'] = key.bucket.name
+        tasks.enqueue(
+            data, job_id=self.id, file_id=str(self.get_file_id(key)), md5=key.etag,
+            bytes_total=key.size)
 
     def has_file_id(self):
         assert 'file_id_column' in self.spec.options
         return self.spec.options.file_id_column is not None
 
-    def get_files(self, s3_conn=None):
+    def get_files(self, s3_conn=None, list_concurrency=None, ordered=False, markers=None):
+        """ Yields the files matched by the job's paths, and then the ones
+        named by its file list.  S3 prefixes and local directories are
+        listed, and the checksums of HDFS files fetched, on up to
+        list_concurrency threads at a time, and files are yielded as those
+        requests complete unless ordered is True.  If list_concurrency is
+        None, local directories are listed one at a time and everything
+        else on DEFAULT_LIST_CONCURRENCY threads.  markers maps the str of
+        S3 paths to the key name to list from (exclusive), see
+        loader_db/manifests.py.
+
+        Sizes and etags are taken from the listings, and nothing is kept
+        once a file has been yielded, so a path may match any number of
+        files as long as the caller streams them too. """
         # We are standardizing on UNIX semantics for file matching (vs. S3 prefix semantics). This means
         # we expect that on both S3 and UNIX:
         #   bucket/1
@@ -106,56 +208,126 @@ class Job(object):
         #   bucket/a/2
         #
         # bucket/* matches just 1,2 and bucket/** matches all 4 files
-        logger = log.get_logger('Jobs')
         for load_path in self.paths:
             if load_path.scheme == 's3':
                 bucket = s3_conn.get_bucket(load_path.bucket)
-                s3_globber = glob2.S3Globber(bucket)
-
-                for keyname in s3_globber.glob(load_path.pattern):
-                    if not s3_globber.isdir(keyname):
-                        try:
-                            key = s3_globber.get_key(keyname)
-                            if key is not None:
-                                yield AttrDict({
-                                    'scheme': 's3',
-                                    'name': key.name,
-                                    'etag': key.etag,
-                                    'size': key.size,
-                                    'bucket': bucket
-                                })
-                            else:
-                                logger.warning("Key `%s` not found, skipping", keyname)
-                        except S3ResponseError as e:
-                            logger.warning("Received %s %s accessing `%s`, skipping", e.status, e.reason, keyname)
+                marker = markers.get(str(load_path)) if markers else None
+                s3_globber = glob2.S3Globber(bucket, max_workers=list_concurrency or DEFAULT_LIST_CONCURRENCY, marker=marker)
+
+                for entry in s3_globber.iter_files(load_path.pattern, ordered=ordered):
+                    yield AttrDict({
+                        'scheme': 's3',
+                        'name': entry.name,
+                        'etag': entry.etag,
+                        'size': entry.size,
+                        'modified': entry.modified,
+                        'bucket': bucket,
+                        'load_path': str(load_path)
+                    })
             elif load_path.scheme == 'file':
-                fs_globber = glob2.Globber()
-                for fname in fs_globber.glob(load_path.pattern):
-                    if not fs_globber.isdir(fname):
-                        yield AttrDict({
-                            'scheme': 'file',
-                            'name': fname,
-                            'etag': None,
-                            'size': os.path.getsize(fs_globber._normalize_string(fname)),
-                            'bucket': None
-                        })
+                # Directories are only listed concurrently if asked to, for
+                # network filesystems.
+                fs_globber = glob2.Globber(max_workers=list_concurrency or DEFAULT_LOCAL_LIST_CONCURRENCY)
+                for entry in fs_globber.iter_files(load_path.pattern, ordered=ordered):
+                    yield local_file_key(load_path, entry)
             elif load_path.scheme == 'hdfs':
-                hdfs_host = self.spec.source.hdfs_host
-                webhdfs_port = self.spec.source.webhdfs_port
-                hdfs_user = self.spec.source.hdfs_user
-
-                client = PyWebHdfsClient(
-                    hdfs_host, webhdfs_port, user_name=hdfs_user)
-                hdfs_globber = glob2.HDFSGlobber(client)
-                for fname in hdfs_globber.glob(load_path.pattern):
-                    if not hdfs_globber.isdir(fname):
-                        fileinfo = hdfs_globber.get_fileinfo(fname)
-                        yield AttrDict({
-                            'scheme': 'hdfs',
-                            'name': fileinfo['path'],
-                            'etag': fileinfo['etag'],
-                            'size': fileinfo['length'],
-                            'bucket': None
-                        })
+                hdfs_globber = glob2.HDFSGlobber(self._hdfs_client())
+                entries = hdfs_globber.iter_files(load_path.pattern, ordered=ordered)
+                if self.spec.source.hdfs_checksums:
+                    entries = hdfs_globber.iter_checksums(entries, max_workers=list_concurrency or DEFAULT_LIST_CONCURRENCY, ordered=ordered)
+                else:
+                    entries = (entry._replace(etag=hdfs_stat_etag(entry)) for entry in entries)
+                for entry in entries:
+                    yield AttrDict({
+                        'scheme': 'hdfs',
+                        'name': entry.name,
+                        'etag': entry.etag,
+                        'size': entry.size,
+                        'modified': entry.modified,
+                        'bucket': None,
+                        'load_path': str(load_path)
+                    })
             else:
                 assert False, "Unknown scheme %s" % load_path.scheme
+
+        if self.file_list is not None:
+            for key in self._iter_file_list(s3_conn, list_concurrency or DEFAULT_LIST_CONCURRENCY, ordered):
+                yield key
+
+    def _iter_file_list(self, s3_conn, concurrency, ordered):
+        """ Yields the files named by the job's file list (see
+        util/file_lists.py), without listing anything.  Files that the
+        list gives a size for are yielded as they are read, without any
+        requests; the others are looked up on up to concurrency threads at
+        a time. """
+        file_list_format = self.spec.source.manifest_format or file_lists.detect_format(self.file_list.pattern)
+        entries = file_lists.iter_entries(file_lists.iter_lines(self.file_list, s3_conn), file_list_format)
+        load_path = str(self.file_list)
+        buckets = {}
+        globbers = {}
+
+        def get_globber(entry):
+            globber_id = (entry.scheme, entry.bucket)
+            if globber_id not in globbers:
+                if entry.scheme == 's3':
+                    globbers[globber_id] = glob2.S3Globber(get_bucket(entry.bucket))
+                elif entry.scheme == 'hdfs':
+                    globbers[globber_id] = glob2.HDFSGlobber(self._hdfs_client())
+                else:
+                    globbers[globber_id] = glob2.Globber()
+            return globbers[globber_id]
+
+        def get_bucket(name):
+            # Not validated, which would take a request per bucket
+            if name not in buckets:
+                buckets[name] = s3_conn.get_bucket(name, validate=False)
+            return buckets[name]
+
+        def to_key(entry, found=None):
+            etag = entry.etag
+            if etag is not None and entry.scheme == 's3':
+                # As S3 lists them
+                etag = '"%s"' % etag.strip('"')
+            return AttrDict({
+                'scheme': entry.scheme,
+                'name': entry.name,
+                'etag': etag if etag is not None or found is None else found.etag,
+                'size': found.size if found is not None else entry.size,
+                'modified': found.modified if found is not None else None,
+                'bucket': get_bucket(entry.bucket) if entry.scheme == 's3' else None,
+                'load_path': load_path
+            })
+
+        def look_up(entry):
+            if entry.size is not None:
+                return to_key(entry)
+            # A file that doesn't exist is still queued, and fails to load
+            return to_key(entry, get_globber(entry).lookup_file(entry.name))
+
+        # Its workers only start if some file needs to be looked up
+        with ThreadPool(concurrency) as pool:
+            while True:
+                batch = list(itertools.islice(entries, FILE_LIST_BATCH_SIZE))
+                if not batch:
+                    break
+                unsized = [ entry for entry in batch if entry.size is None ]
+                if not unsized:
+                    for entry in batch:
+                        yield to_key(entry)
+                    continue
+
+                # The globbers are made here, not on the pool
+                for entry in unsized:
+                    get_globber(entry)
+                if ordered:
+                    keys = pool.imap(look_up, batch, True)
+                else:
+                    keys = itertools.chain(
+                        (to_key(entry) for entry in batch if entry.size is not None),
+                        pool.imap(look_up, unsized))
+                for key in keys:
+                    yield key
+
+    def _hdfs_client(self):
+        return PyWebHdfsClient(
+            self.spec.source.hdfs_host, self.spec.source.webhdfs_port, user_name=self.spec.source.hdfs_user)
@@ -0,0 +1,232 @@
+""" Follows the local paths of watch jobs with inotify, see JobWatcher.
+
+Every directory that may hold files matching one of a job's paths (see
+glob2.compile_dir_pattern), from the deepest directory that the path names
+literally down, is watched.  Files are picked up once they have been closed
+after writing (IN_CLOSE_WRITE) or moved into a watched directory
+(IN_MOVED_TO), so partially written files are never loaded.  New
+directories that may hold matching files are watched as they are created,
+and the files already in them are picked up.
+
+Links to directories are followed, as in scans (see glob2.Globber), unless
+they lead back to a directory on their own path.  inotify watches a
+directory once however many paths lead to it, and its events are reported
+under each of them.
+
+Nothing else is listed after a job has been added, so it is up to the
+caller to scan a job's paths after adding it, and to scan every job again
+if the kernel's event queue overflows.
+"""
+
+import errno
+import os
+import sys
+from collections import defaultdict
+
+from memsql_loader.loader_db.jobs import local_file_key
+from memsql_loader.util import inotify
+from memsql_loader.vendor import glob2
+
+DIR_EVENTS = inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO | inotify.IN_CREATE | inotify.IN_ONLYDIR
+
+_FS_ENCODING = sys.getfilesystemencoding() or 'utf-8'
+
+def _encode(path):
+    return path.encode(_FS_ENCODING) if isinstance(path, unicode) else path
+
+def _decode(name):
+    try:
+        return name.decode(_FS_ENCODING)
+    except UnicodeDecodeError:
+        return name.decode('utf-8', 'replace')
+
+def can_watch(job):
+    """ Whether every path of job is an absolute local path.  Jobs with a
+    manifest are left to scans, which read it again. """
+    if job.file_list is not None or not job.paths:
+        return False
+    return all(path.scheme == 'file' and os.path.isabs(path.pattern) for path in job.paths)
+
+def _top_dir(pattern):
+    """ The deepest directory that pattern names literally. """
+    segments = pattern.split('/')
+    i = 0
+    while i < len(segments) - 1 and not glob2.has_magic(segments[i]):
+        i += 1
+    return '/'.join(segments[:i]) or '/'
+
+class _WatchedPath(object):
+    def __init__(self, load_path):
+        self.load_path = load_path
+        self.top = _top_dir(load_path.pattern)
+        self.match_file = glob2.compile_path_pattern(load_path.pattern)
+        self.match_dir = glob2.compile_dir_pattern(load_path.pattern)
+
+class LocalWatcher(object):
+    def __init__(self):
+        self._inotify = inotify.Inotify()
+        self._globber = glob2.Globber()
+        # job id -> (job, [ _WatchedPath ])
+        self._jobs = {}
+        # Watched directory -> watch descriptor, and back to every
+        # directory (path) that it watches
+        self._wds = defaultdict(set)
+        self._dirs = {}
+        # Watched directory -> ids of the jobs that need it watched
+        self._dir_jobs = defaultdict(set)
+
+    def job_ids(self):
+        return self._jobs.keys()
+
+    def get_job(self, job_id):
+        return self._jobs[job_id][0]
+
+    def __contains__(self, job_id):
+        return job_id in self._jobs
+
+    def add(self, job):
+        """ Starts watching the directories of job's paths.  Returns False,
+        watching nothing, if any of their literal directories doesn't
+        exist, and raises InotifyError if they can't all be watched (e.g.
+        because there are more than fs.inotify.max_user_watches). """
+        paths = [ _WatchedPath(load_path) for load_path in job.paths ]
+        if not all(os.path.isdir(_encode(path.top)) for path in paths):
+            return False
+
+        self._jobs[job.id] = (job, paths)
+        try:
+            for path in paths:
+                self._watch_tree(job.id, path, path.top)
+        except inotify.InotifyError:
+            self.remove(job.id)
+            raise
+        return True
+
+    def remove(self, job_id):
+        self._jobs.pop(job_id, None)
+        for dirname in [ d for d, job_ids in self._dir_jobs.items() if job_id in job_ids ]:
+            self._dir_jobs[dirname].discard(job_id)
+            if not self._dir_jobs[dirname]:
+                del self._dir_jobs[dirname]
+                wd = self._dirs.pop(dirname, None)
+                if wd is not None and wd in self._wds:
+                    self._wds[wd].discard(dirname)
+                    if not self._wds[wd]:
+                        del self._wds[wd]
+                        self._inotify.rm_watch(wd)
+
+    def close(self):
+        self._inotify.close()
+
+    def read(self, timeout):
+        """ Waits up to timeout seconds for events.  Returns whether the
+        event queue overflowed, and the keys (see Job.get_files) of the
+        files that were written or moved into the watched directories by
+        job id, which may include files that were already seen. """
+        keys = defaultdict(list)
+        overflowed = False
+        for event in self._inotify.read_events(timeout):
+            if event.mask & inotify.IN_Q_OVERFLOW:
+                overflowed = True
+                continue
+
+            if event.wd not in self._wds:
+                continue
+            if event.mask & inotify.IN_IGNORED:
+                self._lost_dir(event.wd)
+                continue
+
+            for dirname in list(self._wds[event.wd]):
+                path = os.path.join(dirname, _decode(event.name))
+                if event.mask & inotify.IN_ISDIR:
+                    if event.mask & (inotify.IN_CREATE | inotify.IN_MOVED_TO):
+                        self._new_dir(path, keys)
+                elif event.mask & (inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO):
+                    self._new_file(path, keys)
+        return overflowed, keys
+
+    def _lost_dir(self, wd):
+        """ Forgets the directories wd watched, which was deleted or moved
+        away.  They are watched again if they come back, unless one was the
+        top directory of a job's path: that job is dropped, and left to
+        scans. """
+        for dirname in self._wds.pop(wd):
+            if self._dirs.get(dirname) == wd:
+                del self._dirs[dirname]
+            for job_id in list(self._dir_jobs.pop(dirname, ())):
+                if job_id in self._jobs and any(watched.top == dirname for watched in self._jobs[job_id][1]):
+                    self.remove(job_id)
+
+    def _new_file(self, path, keys):
+        entry = None
+        for job_id, (_, paths) in self._jobs.items():
+            for watched in paths:
+                if watched.match_file(path):
+                    entry = entry or self._globber.lookup_file(path)
+                    if entry is not None:
+                        keys[job_id].append(local_file_key(watched.load_path, entry))
+                    break
+
+    def _new_dir(self, dirname, keys):
+        """ Watches dirname for the jobs that need it, and picks up the
+        files that were written to it before it was watched. """
+        for job_id, (_, paths) in self._jobs.items():
+            for watched in paths:
+                if watched.match_dir(dirname):
+                    try:
+                        entries = self._watch_tree(job_id, watched, dirname, collect_files=True)
+                    except inotify.InotifyError:
+                        # Left to scans, which find the files in dirname
+                        self.remove(job_id)
+                        break
+                    for entry in entries:
+                        keys[job_id].append(local_file_key(watched.load_path, entry))
+
+    def _watch_tree(self, job_id, watched, top, collect_files=False):
+        """ Watches top and the directories below it that watched's path
+        needs.  If collect_files is True, returns the FileEntry of each
+        matching file that is in them already. """
+        entries = []
+        # (directory, its real path, the real paths of the links on the
+        # way to it), as in glob2.Globber._scan_flat
+        pending = [ (top, os.path.realpath(_encode(top)), ()) ]
+        while pending:
+            dirname, real, links = pending.pop()
+            if dirname not in self._dirs:
+                try:
+                    wd = self._inotify.add_watch(_encode(dirname), DIR_EVENTS)
+                except inotify.InotifyError as e:
+                    if e.errno in (errno.ENOENT, errno.ENOTDIR):
+                        # It was deleted already
+                        continue
+                    raise
+                self._dirs[dirname] = wd
+                self._wds[wd].add(dirname)
+            self._dir_jobs[dirname].add(job_id)
+
+            try:
+                listing = list(self._globber.iterdir(dirname))
+            except os.error:
+                continue
+            for name, dir_entry in listing:
+                path = os.path.join(dirname, name)
+                try:
+                    is_dir = dir_entry.is_dir()
+                    is_link = is_dir and dir_entry.is_symlink()
+                except os.error:
+                    continue
+                if is_dir:
+                    if not watched.match_dir(path):
+                        continue
+                    if not is_link:
+                        pending.append((path, os.path.join(real, _encode(name)), links))
+                        continue
+                    target = os.path.realpath(_encode(path))
+                    if target in links or target == real or real.startswith(os.path.join(target, '')):
+                        continue
+                    pending.append((path, target, links + (target,)))
+                elif collect_files and watched.match_file(path):
+                    entry = self._globber.lookup_file(path)
+                    if entry is not None:
+                        entries.append(entry)
+        return entries
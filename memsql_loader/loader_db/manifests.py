@@ -0,0 +1,275 @@
+""" Listing manifests, for incremental loads (see the source.incremental job
+option).
+
+A manifest records every file that was queued from one path into one target
+table, with the etag, size and modification time it had when it was queued.
+Loading the same path into the same table again with source.incremental set
+only queues the files that are new or have changed since.  Of those, files
+identical to ones that other jobs are loading or have loaded into the table
+are still skipped, as in any other load.
+
+- 'changed' still lists every file the path matches, and skips the ones
+  that the manifest has seen unchanged.
+- 'sorted' also keeps a high-water mark for S3 paths, the greatest key
+  name queued so far, and only lists the keys after it.  This is only
+  correct if new keys always sort after the ones already loaded, e.g. if
+  they start with the date they were written.
+
+Manifests are never pruned: a file that is deleted from the source keeps its
+row.  Loading with --force ignores the manifest, and records every file it
+queues again.
+
+A file is recorded when it is queued, not when it is loaded, so a file whose
+tasks (in the jobs loading into the same table) all errored or were
+cancelled counts as unseen, and is queued again.  A file whose tasks are
+gone, e.g. because their job was deleted, still counts as seen.
+
+A load stages the files it queues under its job, and only records them in
+the manifests once it has queued all of them, so a load that fails part way
+(and is rolled back) doesn't leave files it never queued marked as seen.
+"""
+
+import datetime
+import hashlib
+import itertools
+from collections import defaultdict
+
+from memsql_loader.loader_db import jobs
+from memsql_loader.loader_db.storage import LoaderStorage
+from memsql_loader.loader_db.tasks import Tasks
+from memsql_loader.util import apsw_sql_utility, apsw_helpers
+from memsql_loader.util.apsw_sql_step_queue.time_helpers import unix_timestamp
+
+CHANGED = 'changed'
+SORTED = 'sorted'
+MODES = [ CHANGED, SORTED ]
+
+MANIFESTS_TABLE = apsw_sql_utility.TableDefinition('manifests', { apsw_sql_utility.SQLITE: """\
+CREATE TABLE IF NOT EXISTS manifests (
+    id CHAR(40) PRIMARY KEY,
+    path TEXT NOT NULL,
+    target_host TEXT,
+    target_port INTEGER,
+    target_database TEXT,
+    target_table TEXT,
+    high_water_mark TEXT,
+    updated INTEGER
+)""", apsw_sql_utility.MYSQL: """\
+CREATE TABLE IF NOT EXISTS manifests (
+    id CHAR(40) PRIMARY KEY,
+    path LONGTEXT NOT NULL,
+    target_host VARCHAR(255),
+    target_port INT,
+    target_database VARCHAR(64),
+    target_table VARCHAR(64),
+    high_water_mark VARBINARY(1024),
+    updated BIGINT
+)""" })
+
+# The names are compared byte for byte, in the order S3 lists them in.
+MANIFEST_FILES_TABLE = apsw_sql_utility.TableDefinition('manifest_files', { apsw_sql_utility.SQLITE: """\
+CREATE TABLE IF NOT EXISTS manifest_files (
+    manifest_id CHAR(40) NOT NULL,
+    name TEXT NOT NULL,
+    etag TEXT,
+    size INTEGER,
+    modified REAL,
+    PRIMARY KEY (manifest_id, name)
+)""", apsw_sql_utility.MYSQL: """\
+CREATE TABLE IF NOT EXISTS manifest_files (
+    manifest_id CHAR(40) NOT NULL,
+    name VARBINARY(1024) NOT NULL,
+    etag VARCHAR(255),
+    size BIGINT,
+    modified DOUBLE,
+    PRIMARY KEY (manifest_id, name)
+)""" })
+
+# The files a load has queued so far, recorded in manifest_files once the load
+# has queued all of them (see Manifests.commit_staged).
+MANIFEST_STAGED_FILES_TABLE = apsw_sql_utility.TableDefinition('manifest_staged_files', { apsw_sql_utility.SQLITE: """\
+CREATE TABLE IF NOT EXISTS manifest_staged_files (
+    job_id BINARY(32) NOT NULL,
+    manifest_id CHAR(40) NOT NULL,
+    name TEXT NOT NULL,
+    etag TEXT,
+    size INTEGER,
+    modified REAL,
+    PRIMARY KEY (job_id, manifest_id, name)
+)""", apsw_sql_utility.MYSQL: """\
+CREATE TABLE IF NOT EXISTS manifest_staged_files (
+    job_id CHAR(32) NOT NULL,
+    manifest_id CHAR(40) NOT NULL,
+    name VARBINARY(1024) NOT NULL,
+    etag VARCHAR(255),
+    size BIGINT,
+    modified DOUBLE,
+    PRIMARY KEY (job_id, manifest_id, name)
+)""" })
+
+# SQLite allows at most 999 parameters in a query
+LOOKUP_BATCH_SIZE = 900
+
+# Listed files are looked up in the manifests this many at a time
+FILTER_BATCH_SIZE = 10000
+
+def _text(value):
+    # MySQL returns VARBINARY columns as UTF-8 encoded str
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    return value
+
+def manifest_id(spec, load_path):
+    """ The id of the manifest of files queued from load_path (a
+    schema.LoadPath, or its str) into the target table of spec. """
+    parts = [ _text(part) if isinstance(part, str) else unicode(part) for part in jobs.target_columns(spec) ]
+    parts.append(_text(str(load_path)))
+    return hashlib.sha1(u'\0'.join(parts).encode('utf-8')).hexdigest()
+
+def _by_load_path(keys):
+    by_path = defaultdict(list)
+    for key in keys:
+        by_path[key.load_path].append(key)
+    return by_path
+
+def file_identity(key):
+    """ What a file must keep to count as unchanged. """
+    return (key.etag, key.size, key.modified)
+
+class Manifests(apsw_sql_utility.APSWSQLUtility):
+    def __init__(self):
+        super(Manifests, self).__init__(LoaderStorage())
+
+        self._define_table(MANIFESTS_TABLE)
+        self._define_table(MANIFEST_FILES_TABLE)
+        self._define_table(MANIFEST_STAGED_FILES_TABLE)
+
+    def get(self, manifest_id):
+        with self.storage.cursor() as cursor:
+            return apsw_helpers.get(cursor, 'SELECT * FROM manifests WHERE id = ?', manifest_id)
+
+    def get_high_water_mark(self, manifest_id):
+        manifest = self.get(manifest_id)
+        return _text(manifest.high_water_mark) if manifest is not None else None
+
+    def get_list_markers(self, job):
+        """ Returns the high-water marks of job's S3 paths, as the markers
+        for Job.get_files to list them from. """
+        markers = {}
+        for path in job.paths:
+            if path.scheme == 's3':
+                markers[str(path)] = self.get_high_water_mark(manifest_id(job.spec, path))
+        return markers
+
+    def filter_unchanged(self, job, keys):
+        """ Yields the keys (see Job.get_files) that aren't in the manifest
+        of the path they were matched by, or have changed since they were
+        recorded in it, or whose tasks all failed (see above). """
+        keys = iter(keys)
+        job_ids = None
+        while True:
+            batch = list(itertools.islice(keys, FILTER_BATCH_SIZE))
+            if not batch:
+                break
+            if job_ids is None:
+                job_ids = [ target_job.id for target_job in jobs.Jobs().query_target(*jobs.target_columns(job.spec)) ]
+            for load_path, path_keys in _by_load_path(batch).items():
+                for key in self.filter_changed(manifest_id(job.spec, load_path), path_keys, job_ids=job_ids):
+                    yield key
+
+    def record_files(self, job, keys):
+        """ Records keys (see Job.get_files) in the manifests of the paths
+        they were matched by. """
+        for load_path, path_keys in _by_load_path(keys).items():
+            self.record(manifest_id(job.spec, load_path), job.spec, load_path, path_keys)
+
+    def stage_files(self, job, keys):
+        """ Stages keys (see Job.get_files) to be recorded in the manifests
+        of the paths they were matched by when commit_staged is called for
+        job. """
+        if not keys:
+            return
+        with self.storage.transaction() as cursor:
+            cursor.executemany('''
+                REPLACE INTO manifest_staged_files (job_id, manifest_id, name, etag, size, modified)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', [ (job.id, manifest_id(job.spec, key.load_path), key.name) + file_identity(key) for key in keys ])
+
+    def commit_staged(self, job):
+        """ Records every file staged for job in its manifest, in one
+        transaction, and moves the high-water marks up accordingly. """
+        load_paths = job.paths + ([ job.file_list ] if job.file_list is not None else [])
+        load_paths = dict((manifest_id(job.spec, load_path), load_path) for load_path in load_paths)
+        now = unix_timestamp(datetime.datetime.utcnow())
+        with self.storage.transaction() as cursor:
+            marks = apsw_helpers.query(cursor, '''
+                SELECT manifest_id, MAX(name) AS high_water_mark FROM manifest_staged_files
+                WHERE job_id = ?
+                GROUP BY manifest_id
+            ''', job.id)
+            cursor.execute('''
+                REPLACE INTO manifest_files (manifest_id, name, etag, size, modified)
+                SELECT manifest_id, name, etag, size, modified FROM manifest_staged_files
+                WHERE job_id = ?
+            ''', (job.id,))
+            for mark in marks:
+                self._raise_high_water_mark(
+                    cursor, mark.manifest_id, job.spec, load_paths[mark.manifest_id], _text(mark.high_water_mark), now)
+            cursor.execute('DELETE FROM manifest_staged_files WHERE job_id = ?', (job.id,))
+
+    def discard_staged(self, job):
+        """ Drops the files staged for job without recording them. """
+        with self.storage.transaction() as cursor:
+            cursor.execute('DELETE FROM manifest_staged_files WHERE job_id = ?', (job.id,))
+
+    def filter_changed(self, manifest_id, keys, job_ids=None):
+        """ Returns the keys that the manifest hasn't seen, or has seen with
+        a different etag, size or modification time.  Unchanged keys whose
+        tasks in the jobs in job_ids all errored or were cancelled are
+        returned as well. """
+        changed = []
+        with self.storage.cursor() as cursor:
+            for i in xrange(0, len(keys), LOOKUP_BATCH_SIZE):
+                batch = keys[i:i + LOOKUP_BATCH_SIZE]
+                names = [ key.name for key in batch ]
+                rows = apsw_helpers.query(cursor, '''
+                    SELECT name, etag, size, modified FROM manifest_files
+                    WHERE manifest_id = ? AND name IN (%s)
+                ''' % ','.join('?' * len(names)), manifest_id, *names)
+                seen = dict((_text(row.name), (row.etag, row.size, row.modified)) for row in rows)
+                unchanged = [ key for key in batch if seen.get(key.name) == file_identity(key) ]
+                failed = set()
+                if job_ids and unchanged:
+                    failed = Tasks().get_failed_file_ids(job_ids, [ jobs.file_id(key) for key in unchanged ])
+                changed.extend(
+                    key for key in batch
+                    if seen.get(key.name) != file_identity(key) or str(jobs.file_id(key)) in failed)
+        return changed
+
+    def record(self, manifest_id, spec, load_path, keys):
+        """ Records keys (files queued from load_path) in the manifest, and
+        moves its high-water mark up to the greatest of their names. """
+        if not keys:
+            return
+        high_water_mark = max(key.name for key in keys)
+        now = unix_timestamp(datetime.datetime.utcnow())
+        with self.storage.transaction() as cursor:
+            cursor.executemany('''
+                REPLACE INTO manifest_files (manifest_id, name, etag, size, modified)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [ (manifest_id, key.name) + file_identity(key) for key in keys ])
+            self._raise_high_water_mark(cursor, manifest_id, spec, load_path, high_water_mark, now)
+
+    def _raise_high_water_mark(self, cursor, manifest_id, spec, load_path, high_water_mark, now):
+        manifest = apsw_helpers.get(cursor, 'SELECT high_water_mark FROM manifests WHERE id = ?', manifest_id)
+        if manifest is None:
+            cursor.execute('''
+                INSERT INTO manifests (id, path, target_host, target_port, target_database, target_table, high_water_mark, updated)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (manifest_id, _text(str(load_path))) + jobs.target_columns(spec) + (high_water_mark, now))
+        else:
+            if manifest.high_water_mark is not None and _text(manifest.high_water_mark) > high_water_mark:
+                high_water_mark = _text(manifest.high_water_mark)
+            cursor.execute(
+                'UPDATE manifests SET high_water_mark = ?, updated = ? WHERE id = ?',
+                (high_water_mark, now, manifest_id))
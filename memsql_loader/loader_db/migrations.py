@@ -0,0 +1,302 @@
+""" Schema migrations for existing loader databases.
+
+New databases are created with the latest schema by bootstrap and stamped
+with SCHEMA_VERSION.  Databases created by older versions of MemSQL Loader
+are brought up to date by running every migration newer than the version
+recorded in the database, in order, inside a single transaction.
+
+Migrations that create tables use the current table definitions, so
+migrations that add columns must tolerate the columns already existing
+(see _add_columns).
+
+MySQL loader databases (see loader_db/storage.py) were introduced at schema
+version 5, so the migrations up to version 5 only ever run on SQLite.
+
+Task shards other than shard 0 (see loader_db/shards.py) were introduced at
+schema version 6.  Migrations that change the task tables are also run on
+every other shard (see _on_every_shard).
+
+A migration can be a dict of dialect -> migration function (see
+apsw_sql_utility.for_dialect) if the backends need different migrations.
+"""
+
+from dateutil import parser
+
+from memsql_loader.loader_db import jobs, manifests, shards, tasks, watches
+from memsql_loader.loader_db.storage import LoaderStorage
+from memsql_loader.util import apsw_helpers, apsw_sql_utility, log, super_json as json
+from memsql_loader.util.apsw_sql_step_queue.time_helpers import precise_unix_timestamp
+
+def _add_columns(cursor, table, columns):
+    existing = set(row.name for row in apsw_helpers.query(cursor, 'PRAGMA table_info(%s)' % table))
+    for column, column_type in columns:
+        if column not in existing:
+            cursor.execute('ALTER TABLE %s ADD COLUMN %s %s' % (table, column, column_type))
+
+def _timestamp_column(column):
+    return '''
+        %(column)s = CASE
+            WHEN typeof(%(column)s) = 'text' THEN CAST(strftime('%%s', %(column)s) AS INTEGER)
+            ELSE %(column)s
+        END
+    ''' % { 'column': column }
+
+def _integer_timestamps(cursor):
+    """ Timestamps used to be stored as DATETIME text built with
+    datetime(:now, 'unixepoch'); strftime('%s') turns them back into the
+    exact same unix timestamps. """
+    cursor.execute('UPDATE jobs SET %s' % _timestamp_column('created'))
+    cursor.execute('UPDATE tasks SET %s' % ', '.join(
+        _timestamp_column(column) for column in ('created', 'started', 'last_contact', 'finished')))
+
+def _job_stats(cursor):
+    """ Build job_stats for the tasks that already exist; the triggers keep
+    it up to date from here on. """
+    tasks.JOB_STATS_TABLE.create(cursor)
+    cursor.execute('''
+        INSERT OR REPLACE INTO job_stats (
+            job_id, tasks_total, tasks_finished, tasks_succeeded, tasks_errored,
+            tasks_cancelled, tasks_claimed, bytes_total, bytes_downloaded,
+            download_rate, first_task_start, last_contact)
+        SELECT
+            job_id,
+            COUNT(*),
+            SUM(finished IS NOT NULL),
+            SUM(result IS 'success'),
+            SUM(result IS 'error'),
+            SUM(result IS 'cancelled'),
+            SUM(finished IS NULL AND execution_id IS NOT NULL),
+            SUM(bytes_total),
+            SUM(bytes_downloaded),
+            SUM(download_rate),
+            MIN(started),
+            MAX(last_contact)
+        FROM tasks
+        GROUP BY job_id
+    ''')
+
+def _tasks_history(cursor):
+    tasks.TASKS_HISTORY_TABLE.create(cursor)
+
+def _job_target_columns(cursor):
+    _add_columns(cursor, 'jobs', [
+        ('target_host', 'TEXT'), ('target_port', 'INTEGER'),
+        ('target_database', 'TEXT'), ('target_table', 'TEXT')])
+
+    rows = apsw_helpers.query(cursor, 'SELECT id, spec FROM jobs')
+    for row in rows:
+        cursor.execute('''
+            UPDATE jobs
+            SET target_host = ?, target_port = ?, target_database = ?, target_table = ?
+            WHERE id = ?
+        ''', jobs.target_columns(json.loads(row.spec)) + (row.id,))
+
+    for statement in jobs.PRIMARY_TABLE.extra_statements():
+        cursor.execute(statement)
+
+def _step_time(value):
+    # Steps written before migration 1 hold ISO formatted strings
+    if isinstance(value, basestring):
+        return precise_unix_timestamp(parser.parse(value))
+    return value
+
+def _task_load_stats(cursor, batch_size=10000):
+    """ Copy row_count and the download step times of successful tasks out
+    of their data and steps JSON, and add them to job_stats. """
+    load_stats_columns = [ ('row_count', 'INTEGER'), ('download_start', 'REAL'), ('download_stop', 'REAL') ]
+    for table in ('tasks', 'tasks_history'):
+        _add_columns(cursor, table, load_stats_columns)
+    _add_columns(cursor, 'job_stats', [ ('rows_loaded', 'INTEGER'), ('download_start', 'REAL'), ('download_stop', 'REAL') ])
+
+    # The triggers and the all_tasks view have to know about the new
+    # columns; they are recreated once the backfill is done.
+    cursor.execute('DROP TRIGGER IF EXISTS job_stats_task_insert')
+    cursor.execute('DROP TRIGGER IF EXISTS job_stats_task_update')
+    cursor.execute('DROP VIEW IF EXISTS all_tasks')
+
+    for table in ('tasks', 'tasks_history'):
+        last_id = 0
+        while True:
+            rows = apsw_helpers.query(cursor, '''
+                SELECT id, data, steps FROM %s
+                WHERE id > :last_id AND result = 'success'
+                ORDER BY id
+                LIMIT :limit
+            ''' % table, last_id=last_id, limit=batch_size)
+            if not rows:
+                break
+            for row in rows:
+                data = json.safe_loads(row.data or '', {})
+                download = {}
+                for step in json.safe_loads(row.steps or '', []):
+                    if step.get('name') == 'download':
+                        download = step
+                        break
+                cursor.execute(
+                    'UPDATE %s SET row_count = ?, download_start = ?, download_stop = ? WHERE id = ?' % table,
+                    (data.get('row_count'), _step_time(download.get('start')), _step_time(download.get('stop')), row.id))
+            last_id = rows[-1].id
+
+    tasks.JOB_STATS_TABLE.create(cursor)
+    tasks.TASKS_HISTORY_TABLE.create(cursor)
+
+    # Archived tasks still count towards job_stats.  The all_tasks view
+    # may refer to columns that later migrations add, so it can't be used
+    # here.
+    cursor.execute('''
+        UPDATE job_stats SET
+            rows_loaded = (
+                SELECT SUM(row_count) FROM %(all_tasks)s
+                WHERE all_tasks.job_id = job_stats.job_id AND result = 'success'),
+            download_start = (
+                SELECT MIN(download_start) FROM %(all_tasks)s
+                WHERE all_tasks.job_id = job_stats.job_id AND result = 'success'),
+            download_stop = (
+                SELECT MAX(download_stop) FROM %(all_tasks)s
+                WHERE all_tasks.job_id = job_stats.job_id AND result = 'success')
+    ''' % { 'all_tasks': '''(
+        SELECT job_id, result, row_count, download_start, download_stop FROM tasks
+        UNION ALL
+        SELECT job_id, result, row_count, download_start, download_stop FROM tasks_history
+    ) AS all_tasks''' })
+
+def _task_shards(cursor):
+    """ Existing databases keep all of their tasks in a single shard. """
+    shards.PRIMARY_TABLE.create(cursor)
+    cursor.execute('INSERT INTO task_shards (shard) VALUES (0)')
+
+def _on_every_shard(migration):
+    """ Run migration on the loader database and on every other task shard.
+    Each shard is a separate file that is migrated in its own transaction,
+    so the migration must be safe to run again on a shard that it has
+    already migrated. """
+    def migrate_shards(cursor):
+        migration(cursor)
+        num_shards = apsw_helpers.get(cursor, 'SELECT COUNT(*) AS count FROM task_shards').count
+        for shard in xrange(1, num_shards):
+            with LoaderStorage.shard(shard).transaction() as shard_cursor:
+                migration(shard_cursor)
+    return migrate_shards
+
+def _task_change_feed(cursor):
+    for table in ('tasks', 'tasks_history'):
+        _add_columns(cursor, table, [ ('change_seq', 'INTEGER') ])
+    # all_tasks has to know about the new column
+    cursor.execute('DROP VIEW IF EXISTS all_tasks')
+    tasks.TASKS_HISTORY_TABLE.create(cursor)
+    tasks.TASK_CHANGES_TABLE.create(cursor)
+
+def _mysql_task_change_feed(cursor):
+    for table in ('tasks', 'tasks_history'):
+        cursor.execute('ALTER TABLE %s ADD COLUMN change_seq BIGINT DEFAULT NULL' % table)
+    tasks.TASKS_HISTORY_TABLE.create(cursor, apsw_sql_utility.MYSQL)
+    tasks.TASK_CHANGES_TABLE.create(cursor, apsw_sql_utility.MYSQL)
+
+def _listing_manifests(cursor):
+    manifests.MANIFESTS_TABLE.create(cursor)
+    manifests.MANIFEST_FILES_TABLE.create(cursor)
+
+def _mysql_listing_manifests(cursor):
+    manifests.MANIFESTS_TABLE.create(cursor, apsw_sql_utility.MYSQL)
+    manifests.MANIFEST_FILES_TABLE.create(cursor, apsw_sql_utility.MYSQL)
+
+def _manifest_staging(cursor):
+    manifests.MANIFEST_STAGED_FILES_TABLE.create(cursor)
+
+def _mysql_manifest_staging(cursor):
+    manifests.MANIFEST_STAGED_FILES_TABLE.create(cursor, apsw_sql_utility.MYSQL)
+
+def _job_watches(cursor):
+    watches.PRIMARY_TABLE.create(cursor)
+
+def _mysql_job_watches(cursor):
+    watches.PRIMARY_TABLE.create(cursor, apsw_sql_utility.MYSQL)
+
+def _no_job_stats_table(cursor):
+    # job_stats has always been a table on SQLite
+    pass
+
+def _mysql_job_stats_table(cursor):
+    """ job_stats used to be a view that aggregated all_tasks whenever it
+    was read; it is now a table that TaskShard keeps up to date. """
+    cursor.execute('DROP VIEW IF EXISTS job_stats')
+    tasks.JOB_STATS_TABLE.create(cursor, apsw_sql_utility.MYSQL)
+    # SUM() returns DECIMAL on MySQL
+    cursor.execute('''
+        REPLACE INTO job_stats (
+            job_id, tasks_total, tasks_finished, tasks_succeeded, tasks_errored,
+            tasks_cancelled, tasks_claimed, bytes_total, bytes_downloaded,
+            download_rate, first_task_start, last_contact, rows_loaded,
+            download_start, download_stop)
+        SELECT
+            job_id,
+            COUNT(*),
+            CAST(SUM(finished IS NOT NULL) AS SIGNED),
+            CAST(SUM(IFNULL(result = 'success', 0)) AS SIGNED),
+            CAST(SUM(IFNULL(result = 'error', 0)) AS SIGNED),
+            CAST(SUM(IFNULL(result = 'cancelled', 0)) AS SIGNED),
+            CAST(SUM(finished IS NULL AND execution_id IS NOT NULL) AS SIGNED),
+            CAST(SUM(bytes_total) AS SIGNED),
+            CAST(SUM(bytes_downloaded) AS SIGNED),
+            CAST(SUM(download_rate) AS SIGNED),
+            MIN(started),
+            MAX(last_contact),
+            CAST(SUM(CASE WHEN result = 'success' THEN row_count END) AS SIGNED),
+            MIN(CASE WHEN result = 'success' THEN download_start END),
+            MAX(CASE WHEN result = 'success' THEN download_stop END)
+        FROM all_tasks
+        GROUP BY job_id
+    ''')
+
+# (version, description, migration function)
+MIGRATIONS = [
+    (1, 'integer timestamps', _integer_timestamps),
+    (2, 'job stats', _job_stats),
+    (3, 'tasks history', _tasks_history),
+    (4, 'job target columns', _job_target_columns),
+    (5, 'task load statistics', _task_load_stats),
+    (6, 'task shards', _task_shards),
+    (7, 'task change feed', {
+        apsw_sql_utility.SQLITE: _on_every_shard(_task_change_feed),
+        apsw_sql_utility.MYSQL: _mysql_task_change_feed
+    }),
+    (8, 'listing manifests', {
+        apsw_sql_utility.SQLITE: _listing_manifests,
+        apsw_sql_utility.MYSQL: _mysql_listing_manifests
+    }),
+    (9, 'job watches', {
+        apsw_sql_utility.SQLITE: _job_watches,
+        apsw_sql_utility.MYSQL: _mysql_job_watches
+    }),
+    (10, 'manifest staging', {
+        apsw_sql_utility.SQLITE: _manifest_staging,
+        apsw_sql_utility.MYSQL: _mysql_manifest_staging
+    }),
+    (11, 'job stats table', {
+        apsw_sql_utility.SQLITE: _no_job_stats_table,
+        apsw_sql_utility.MYSQL: _mysql_job_stats_table
+    }),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def needs_migration(storage):
+    with storage.cursor() as cursor:
+        return storage.get_schema_version(cursor) < SCHEMA_VERSION
+
+def mark_current(storage):
+    """ Stamp a freshly created database with the latest schema version. """
+    with storage.transaction() as cursor:
+        storage.set_schema_version(cursor, SCHEMA_VERSION)
+
+def migrate(storage):
+    logger = log.get_logger('Migrations')
+    with storage.transaction() as cursor:
+        # Re-read the version under the write lock in case another process
+        # migrated the database while we were waiting for it.
+        version = storage.get_schema_version(cursor)
+        for target_version, description, migration in MIGRATIONS:
+            if target_version > version:
+                logger.info('Migrating loader database to version %d (%s)', target_version, description)
+                apsw_sql_utility.for_dialect(migration, storage.dialect)(cursor)
+                storage.set_schema_version(cursor, target_version)
@@ -0,0 +1,90 @@
+""" The task queue is partitioned across one or more SQLite files (shards),
+each with its own write lock and WAL, so that workers claiming and updating
+tasks in different shards don't wait for each other.
+
+Shard 0 is the loader database itself, which also holds the jobs table;
+shards 1 and up live in their own files next to it (see
+storage.get_shard_db_path).  Every shard has its own tasks, tasks_history
+and job_stats tables.
+
+- The number of shards is fixed when the loader database is created (see
+  storage.MEMSQL_LOADER_DB_SHARDS_ENV) and recorded in the task_shards
+  table.  Databases created before sharding have a single shard.
+- All tasks of a job live in the same shard, so a job's counters in
+  job_stats never have to be combined across shards.
+- Task ids carry their shard in their high bits, so that a task can be
+  found from its id alone, and ordering tasks by id orders them by shard.
+"""
+
+import weakref
+import zlib
+
+from memsql_loader.loader_db.storage import LoaderStorage, get_configured_shards, get_shard_db_path
+from memsql_loader.util import apsw_helpers, apsw_sql_utility
+
+SHARD_ID_BITS = 40
+
+PRIMARY_TABLE = apsw_sql_utility.TableDefinition('task_shards', """\
+CREATE TABLE IF NOT EXISTS task_shards (
+    shard INTEGER PRIMARY KEY
+)""")
+
+# storage -> number of shards, filled in once the storage has a task_shards
+# table
+_num_shards = weakref.WeakKeyDictionary()
+
+def num_shards():
+    storage = LoaderStorage()
+    if storage not in _num_shards:
+        if PRIMARY_TABLE.table_name not in storage.table_names():
+            # Not bootstrapped yet, so this is what bootstrap will create.
+            return get_configured_shards()
+        with storage.cursor() as cursor:
+            row = apsw_helpers.get(cursor, 'SELECT COUNT(*) AS count FROM task_shards')
+        _num_shards[storage] = max(row.count, 1)
+    return _num_shards[storage]
+
+def shard_for_job(job_id, shards):
+    if job_id is None:
+        return 0
+    return (zlib.crc32(str(job_id)) & 0xffffffff) % shards
+
+def shard_for_task(task_id):
+    return task_id >> SHARD_ID_BITS
+
+def first_task_id(shard):
+    """ Task ids in shard are greater than this. """
+    return shard << SHARD_ID_BITS
+
+def schema_name(shard):
+    """ The name shard is ATTACHed as by attach_shards, or None for shard 0,
+    whose tables are the loader database's own. """
+    return 'shard%d' % shard if shard > 0 else None
+
+def attach_shards(cursor):
+    """ ATTACH every shard to the connection of cursor, a read cursor on the
+    loader database, and return the schema names of all shards (see
+    schema_name).  Connections keep the shards they have attached, so this
+    is cheap to call before every query. """
+    shards = num_shards()
+    if shards > 1:
+        attached = set(row.name for row in apsw_helpers.query(cursor, 'PRAGMA database_list'))
+        for shard in xrange(1, shards):
+            if schema_name(shard) not in attached:
+                cursor.execute('ATTACH DATABASE ? AS %s' % schema_name(shard), (get_shard_db_path(shard),))
+    return [ schema_name(shard) for shard in xrange(shards) ]
+
+class TaskShards(apsw_sql_utility.APSWSQLUtility):
+    def __init__(self):
+        super(TaskShards, self).__init__(LoaderStorage())
+
+        self._define_table(PRIMARY_TABLE)
+
+    def setup(self):
+        super(TaskShards, self).setup()
+        with self.storage.transaction() as cursor:
+            if apsw_helpers.get(cursor, 'SELECT COUNT(*) AS count FROM task_shards').count == 0:
+                cursor.executemany(
+                    'INSERT INTO task_shards (shard) VALUES (?)',
+                    [ (shard,) for shard in xrange(get_configured_shards()) ])
+        return self
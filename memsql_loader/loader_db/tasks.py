@@ -1,15 +1,302 @@
 import copy
+import itertools
+import random
+import time
+import uuid
 from contextlib import contextmanager
 from threading import RLock
 from datetime import datetime
 
 import memsql_loader.api as api
+from memsql_loader.loader_db import shards
 from memsql_loader.loader_db.storage import LoaderStorage
-from memsql_loader.util import apsw_helpers, apsw_sql_step_queue
+from memsql_loader.util import apsw_helpers, apsw_sql_step_queue, apsw_sql_utility
 from memsql_loader.util import super_json as json
 from memsql_loader.util.apsw_sql_step_queue.errors import TaskDoesNotExist, StepRunning, AlreadyFinished
+from memsql_loader.util.apsw_sql_step_queue.queue import primary_table_definition
 from memsql_loader.util.apsw_sql_step_queue.time_helpers import unix_timestamp
 
+# Per-job task counters, kept up to date by triggers on the tasks table so
+# that the Jobs/Job APIs don't need to aggregate the whole tasks table.
+#
+# Whether a claimed task is queued or running depends on the current time
+# (its claim expires after TASKS_TTL), so job_stats only counts claimed
+# tasks; expired claims are counted at read time through tasks_claimed_idx,
+# which only covers currently claimed tasks.
+#
+# There is intentionally no DELETE trigger: a job's counters cover every
+# task that was ever enqueued for it.
+#
+# MemSQL doesn't support triggers, so on MySQL storages the triggers are
+# emulated by MySQLStorage (see _update_mysql_job_stats), which works out
+# the same increments in Python from each counter's function of a task row.
+_JOB_STATS_COUNTS = [
+    ('tasks_finished', '%(row)s.finished IS NOT NULL', lambda task: task.finished is not None),
+    ('tasks_succeeded', "%(row)s.result IS 'success'", lambda task: task.result == 'success'),
+    ('tasks_errored', "%(row)s.result IS 'error'", lambda task: task.result == 'error'),
+    ('tasks_cancelled', "%(row)s.result IS 'cancelled'", lambda task: task.result == 'cancelled'),
+    ('tasks_claimed', '%(row)s.finished IS NULL AND %(row)s.execution_id IS NOT NULL',
+        lambda task: task.finished is None and task.execution_id is not None)
+]
+_SUCCESSFUL = "CASE WHEN %%(row)s.result IS 'success' THEN %s END"
+
+def _if_successful(column):
+    return lambda task: getattr(task, column) if task.result == 'success' else None
+
+_JOB_STATS_SUMS = [
+    ('bytes_total', '%(row)s.bytes_total', lambda task: task.bytes_total),
+    ('bytes_downloaded', '%(row)s.bytes_downloaded', lambda task: task.bytes_downloaded),
+    ('download_rate', '%(row)s.download_rate', lambda task: task.download_rate),
+    ('rows_loaded', _SUCCESSFUL % '%(row)s.row_count', _if_successful('row_count'))
+]
+_JOB_STATS_MINS = [
+    ('first_task_start', '%(row)s.started', lambda task: task.started),
+    ('download_start', _SUCCESSFUL % '%(row)s.download_start', _if_successful('download_start'))
+]
+_JOB_STATS_MAXES = [
+    ('last_contact', '%(row)s.last_contact', lambda task: task.last_contact),
+    ('download_stop', _SUCCESSFUL % '%(row)s.download_stop', _if_successful('download_stop'))
+]
+
+# The task columns that the counters are worked out from
+_JOB_STATS_TASK_COLUMNS = [
+    'job_id', 'finished', 'result', 'execution_id', 'bytes_total', 'bytes_downloaded',
+    'download_rate', 'row_count', 'started', 'download_start', 'last_contact', 'download_stop'
+]
+
+def _job_stats_assignments(include_old):
+    """ Builds the SET clause that adds the NEW task row to its job's
+    counters and, for updates, takes the OLD row back out.  Minimums and
+    maximums only ever move outwards. """
+    assignments = []
+    for column, condition, _ in _JOB_STATS_COUNTS:
+        expr = '%s + (%s)' % (column, condition % { 'row': 'NEW' })
+        if include_old:
+            expr += ' - (%s)' % (condition % { 'row': 'OLD' })
+        assignments.append('%s = %s' % (column, expr))
+    for column, value, _ in _JOB_STATS_SUMS:
+        new = value % { 'row': 'NEW' }
+        delta = 'IFNULL(%s, 0)' % new
+        if include_old:
+            delta += ' - IFNULL(%s, 0)' % (value % { 'row': 'OLD' })
+        # Behaves like SUM(): NULL until the first non-NULL value shows up.
+        assignments.append(
+            '%(column)s = CASE WHEN %(column)s IS NULL AND (%(new)s) IS NULL THEN NULL '
+            'ELSE IFNULL(%(column)s, 0) + %(delta)s END' % { 'column': column, 'new': new, 'delta': delta })
+    for columns, operator in [ (_JOB_STATS_MINS, '<'), (_JOB_STATS_MAXES, '>') ]:
+        for column, value, _ in columns:
+            assignments.append(
+                '%(column)s = CASE WHEN %(column)s IS NULL OR (%(new)s) %(operator)s %(column)s '
+                'THEN IFNULL(%(new)s, %(column)s) ELSE %(column)s END' % {
+                    'column': column, 'new': value % { 'row': 'NEW' }, 'operator': operator })
+    return ',\n            '.join(assignments)
+
+def _job_stats_increments():
+    """ Like _job_stats_assignments, but builds the SET clause that
+    applies the increments _add_job_stats_increments has added up for a job,
+    passed in as parameters named after the columns. """
+    assignments = [ 'tasks_total = tasks_total + :tasks_total' ]
+    for column, _, _ in _JOB_STATS_COUNTS:
+        assignments.append('%(column)s = %(column)s + :%(column)s' % { 'column': column })
+    for column, _, _ in _JOB_STATS_SUMS:
+        # :<column>_seen is whether any of the new rows had a value
+        assignments.append(
+            '%(column)s = CASE WHEN %(column)s IS NULL AND NOT :%(column)s_seen THEN NULL '
+            'ELSE IFNULL(%(column)s, 0) + :%(column)s END' % { 'column': column })
+    for columns, operator in [ (_JOB_STATS_MINS, '<'), (_JOB_STATS_MAXES, '>') ]:
+        for column, _, _ in columns:
+            assignments.append(
+                '%(column)s = CASE WHEN %(column)s IS NULL OR :%(column)s %(operator)s %(column)s '
+                'THEN IFNULL(:%(column)s, %(column)s) ELSE %(column)s END' % {
+                    'column': column, 'operator': operator })
+    return ',\n            '.join(assignments)
+
+def _add_job_stats_increments(increments, old, new):
+    """ Adds what the task row new, which was old before (None for a new
+    task), adds to its job's counters to increments. """
+    if old is None:
+        increments['tasks_total'] += 1
+    for column, _, value in _JOB_STATS_COUNTS:
+        increments[column] += int(value(new)) - (int(value(old)) if old is not None else 0)
+    for column, _, value in _JOB_STATS_SUMS:
+        new_value = value(new)
+        increments[column] += (new_value or 0) - ((value(old) or 0) if old is not None else 0)
+        increments[column + '_seen'] = increments[column + '_seen'] or new_value is not None
+    for columns, pick in [ (_JOB_STATS_MINS, min), (_JOB_STATS_MAXES, max) ]:
+        for column, _, value in columns:
+            new_value = value(new)
+            if new_value is not None:
+                increments[column] = new_value if increments[column] is None else pick(increments[column], new_value)
+
+def _update_mysql_job_stats(cursor, old_tasks, new_tasks):
+    """ Does what the job_stats_task_insert and job_stats_task_update
+    triggers do, for MySQLStorage.add_trigger. """
+    by_job = {}
+    for task_id, new in new_tasks.items():
+        increments = by_job.get(new.job_id)
+        if increments is None:
+            increments = by_job[new.job_id] = dict(
+                [ ('tasks_total', 0) ] +
+                [ (column, 0) for column, _, _ in _JOB_STATS_COUNTS + _JOB_STATS_SUMS ] +
+                [ (column + '_seen', False) for column, _, _ in _JOB_STATS_SUMS ] +
+                [ (column, None) for column, _, _ in _JOB_STATS_MINS + _JOB_STATS_MAXES ])
+        _add_job_stats_increments(increments, old_tasks.get(task_id), new)
+
+    for job_id, increments in by_job.items():
+        if increments['tasks_total'] > 0:
+            cursor.execute('INSERT IGNORE INTO job_stats (job_id) VALUES (?)', (job_id,))
+        increments['job_id'] = job_id
+        cursor.execute('UPDATE job_stats SET %s WHERE job_id = :job_id' % _MYSQL_JOB_STATS_INCREMENTS, increments)
+
+_MYSQL_JOB_STATS_INCREMENTS = _job_stats_increments()
+
+JOB_STATS_TABLE = apsw_sql_utility.TableDefinition('job_stats', { apsw_sql_utility.SQLITE: """\
+CREATE TABLE IF NOT EXISTS job_stats (
+    job_id BINARY(32) PRIMARY KEY,
+    tasks_total INTEGER DEFAULT 0 NOT NULL,
+    tasks_finished INTEGER DEFAULT 0 NOT NULL,
+    tasks_succeeded INTEGER DEFAULT 0 NOT NULL,
+    tasks_errored INTEGER DEFAULT 0 NOT NULL,
+    tasks_cancelled INTEGER DEFAULT 0 NOT NULL,
+    -- unfinished tasks that have been claimed by a worker
+    tasks_claimed INTEGER DEFAULT 0 NOT NULL,
+    bytes_total INTEGER,
+    bytes_downloaded INTEGER,
+    download_rate INTEGER,
+    first_task_start INTEGER,
+    last_contact INTEGER,
+    -- rows loaded and download window of successful tasks
+    rows_loaded INTEGER,
+    download_start REAL,
+    download_stop REAL
+)""", apsw_sql_utility.MYSQL: """\
+CREATE TABLE IF NOT EXISTS job_stats (
+    job_id CHAR(32) PRIMARY KEY,
+    tasks_total BIGINT DEFAULT 0 NOT NULL,
+    tasks_finished BIGINT DEFAULT 0 NOT NULL,
+    tasks_succeeded BIGINT DEFAULT 0 NOT NULL,
+    tasks_errored BIGINT DEFAULT 0 NOT NULL,
+    tasks_cancelled BIGINT DEFAULT 0 NOT NULL,
+    tasks_claimed BIGINT DEFAULT 0 NOT NULL,
+    bytes_total BIGINT,
+    bytes_downloaded BIGINT,
+    download_rate BIGINT,
+    first_task_start BIGINT,
+    last_contact BIGINT,
+    rows_loaded BIGINT,
+    download_start DOUBLE,
+    download_stop DOUBLE
+)""" }, extra_sql=[
+    {
+        apsw_sql_utility.SQLITE: '''
+            CREATE INDEX IF NOT EXISTS tasks_claimed_idx ON tasks (job_id, last_contact)
+            WHERE finished IS NULL AND execution_id IS NOT NULL
+        ''',
+        apsw_sql_utility.MYSQL: '''
+            CREATE INDEX IF NOT EXISTS tasks_claimed_idx ON tasks (finished, last_contact)
+        '''
+    },
+    { apsw_sql_utility.SQLITE: '''
+    CREATE TRIGGER IF NOT EXISTS job_stats_task_insert AFTER INSERT ON tasks
+    BEGIN
+        INSERT OR IGNORE INTO job_stats (job_id) VALUES (NEW.job_id);
+        UPDATE job_stats SET
+            tasks_total = tasks_total + 1,
+            %s
+        WHERE job_id = NEW.job_id;
+    END
+    ''' % _job_stats_assignments(include_old=False) },
+    { apsw_sql_utility.SQLITE: '''
+    CREATE TRIGGER IF NOT EXISTS job_stats_task_update
+    AFTER UPDATE OF
+        execution_id, finished, result, bytes_total, bytes_downloaded, download_rate,
+        started, last_contact, row_count, download_start, download_stop
+    ON tasks
+    BEGIN
+        UPDATE job_stats SET
+            %s
+        WHERE job_id = NEW.job_id;
+    END
+    ''' % _job_stats_assignments(include_old=True) }
+])
+
+# Finished tasks are moved out of the hot tasks table into tasks_history
+# once they are older than the server's retention window (see
+# loader_db/archiver.py).  tasks_history has the same columns as tasks, but
+# columns added by migrations may be in a different order, so always copy
+# and union them by name.  Any column added to one table must be added to
+# the other and to TASK_COLUMNS as well.
+#
+# all_tasks reads across both tables; it is meant to be queried AS tasks so
+# that TaskState.PROJECTION applies to it unchanged.  SQLite pushes WHERE
+# clauses down into both halves of the view, but not join conditions, so
+# filter it directly instead of joining it against other tables.
+TASK_COLUMNS = ', '.join([
+    'id', 'created', 'data', 'result', 'execution_id', 'steps', 'job_id',
+    'file_id', 'bytes_total', 'bytes_downloaded', 'download_rate', 'md5',
+    'row_count', 'download_start', 'download_stop', 'started',
+    'last_contact', 'update_count', 'finished', 'change_seq'
+])
+
+TASKS_HISTORY_TABLE = apsw_sql_utility.TableDefinition(
+    'tasks_history', primary_table_definition('tasks_history').sql,
+    index_columns=('job_id', 'file_id', 'md5'),
+    extra_sql=[ {
+        apsw_sql_utility.SQLITE: '''
+            CREATE VIEW IF NOT EXISTS all_tasks AS
+                SELECT %(columns)s FROM tasks
+                UNION ALL
+                SELECT %(columns)s FROM tasks_history
+        ''' % { 'columns': TASK_COLUMNS },
+        apsw_sql_utility.MYSQL: '''
+            CREATE OR REPLACE VIEW all_tasks AS
+                SELECT %(columns)s FROM tasks
+                UNION ALL
+                SELECT %(columns)s FROM tasks_history
+        ''' % { 'columns': TASK_COLUMNS } } ])
+
+# The change feed (see Tasks.get_changes): every insert into or update of
+# the tasks table takes the next number from task_changes and stores it in
+# the row's change_seq, so the tasks that changed since a watcher last
+# looked can be read through tasks_change_seq_idx instead of re-reading
+# every task.  The sequence only ever grows, and since it is taken under the
+# write lock, readers never see a change before an earlier one.
+#
+# MemSQL doesn't support triggers, so MySQL storages have no change feed.
+TASK_CHANGES_TABLE = apsw_sql_utility.TableDefinition('task_changes', '''\
+CREATE TABLE IF NOT EXISTS task_changes (
+    seq BIGINT NOT NULL
+)''', extra_sql=[
+    'INSERT INTO task_changes (seq) SELECT 0 FROM (SELECT 1) AS one WHERE NOT EXISTS (SELECT 1 FROM task_changes)',
+    { apsw_sql_utility.SQLITE: 'CREATE INDEX IF NOT EXISTS tasks_change_seq_idx ON tasks (change_seq)' },
+    { apsw_sql_utility.SQLITE: '''
+    CREATE TRIGGER IF NOT EXISTS tasks_change_insert AFTER INSERT ON tasks
+    BEGIN
+        UPDATE task_changes SET seq = seq + 1;
+        UPDATE tasks SET change_seq = (SELECT seq FROM task_changes) WHERE id = NEW.id;
+    END
+    ''' },
+    # The WHEN clause keeps the trigger's own update of change_seq from
+    # counting as another change.
+    { apsw_sql_utility.SQLITE: '''
+    CREATE TRIGGER IF NOT EXISTS tasks_change_update AFTER UPDATE ON tasks
+    WHEN NEW.change_seq IS OLD.change_seq
+    BEGIN
+        UPDATE task_changes SET seq = seq + 1;
+        UPDATE tasks SET change_seq = (SELECT seq FROM task_changes) WHERE id = NEW.id;
+    END
+    ''' }
+])
+
+# Bulk state transitions (Tasks.bulk_finish and friends) work through the
+# matching tasks this many at a time.
+BULK_BATCH_SIZE = 1000
+
+# Temporary table of file ids for Tasks.bulk_finish_file_ids
+_FILE_IDS_TABLE = {
+    apsw_sql_utility.SQLITE: 'CREATE TEMP TABLE %s (file_id TEXT PRIMARY KEY)',
+    apsw_sql_utility.MYSQL: 'CREATE TEMPORARY TABLE %s (file_id VARCHAR(255) PRIMARY KEY)'
+}
 
 class TaskHandler(apsw_sql_step_queue.TaskHandler):
     def __init__(self, *args, **kwargs):
@@ -27,6 +314,16 @@ class TaskHandler(apsw_sql_step_queue.TaskHandler):
             self.data['error'] = message
             self.finish(result='error')
 
+    def finish(self, result='success'):
+        # Copy the load statistics into their own columns, so that job_stats
+        # can aggregate them without parsing data and steps.
+        self.row_count = self.data.get('row_count')
+        download = self._get_step('download')
+        if download is not None:
+            self.download_start = download.get('start')
+            self.download_stop = download.get('stop')
+        super(TaskHandler, self).finish(result=result)
+
     # Monkey-patching this to reset download progress
     def requeue(self):
         if self._running_steps() != 0:
@@ -45,7 +342,7 @@ class TaskHandler(apsw_sql_step_queue.TaskHandler):
                 WHERE
                     id = :task_id
                     AND execution_id = :execution_id
-                    AND last_contact > datetime(:now, 'unixepoch', '-%s second')
+                    AND last_contact > :now - %s
             ''' % (self._queue.table_name, self._queue.execution_ttl),
                 now=unix_timestamp(datetime.utcnow()),
                 task_id=self.task_id,
@@ -68,54 +365,214 @@ class TaskHandler(apsw_sql_step_queue.TaskHandler):
                 WHERE
                     id = :task_id
                     AND execution_id = :execution_id
-                    AND last_contact > datetime(:now, 'unixepoch', '-%s second')
+                    AND last_contact > :now - %s
             ''' % (self._queue.table_name, self._queue.execution_ttl),
                 data=json.dumps(data),
                 now=unix_timestamp(datetime.utcnow()),
                 task_id=self.task_id,
                 execution_id=self.execution_id)
 
-class Tasks(apsw_sql_step_queue.APSWSQLStepQueue):
-    def __init__(self):
-        storage = LoaderStorage()
-        super(Tasks, self).__init__('tasks', storage, execution_ttl=api.shared.TASKS_TTL, task_handler_class=TaskHandler)
+class TaskShard(apsw_sql_step_queue.APSWSQLStepQueue):
+    """ The tasks of a single shard of the loader database (see
+    loader_db/shards.py).  Use Tasks, which routes to the right shards,
+    instead of using this directly. """
+
+    def __init__(self, shard=0):
+        self.shard = shard
+        storage = LoaderStorage.shard(shard)
+        super(TaskShard, self).__init__('tasks', storage, execution_ttl=api.shared.TASKS_TTL, task_handler_class=TaskHandler)
+        self._define_table(TASKS_HISTORY_TABLE)
+        self._define_table(JOB_STATS_TABLE)
+        self._define_table(TASK_CHANGES_TABLE)
+        if storage.dialect == apsw_sql_utility.MYSQL:
+            storage.add_trigger('job_stats_task_write', self.table_name, _JOB_STATS_TASK_COLUMNS, _update_mysql_job_stats)
+
+    def setup(self):
+        super(TaskShard, self).setup()
+        if self.shard > 0:
+            # AUTOINCREMENT continues from the sequence, so this puts the
+            # shard into the high bits of every task id it hands out.
+            with self.storage.transaction() as cursor:
+                apsw_helpers.query(cursor, '''
+                    INSERT INTO sqlite_sequence (name, seq)
+                    SELECT :name, :seq
+                    WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = :name)
+                ''', name=self.table_name, seq=shards.first_task_id(self.shard))
+        return self
+
+    def has_queued(self, extra_predicate=None):
+        """ Returns True if the shard has a queued task, without taking the
+        write lock. """
+        with self.storage.cursor() as cursor:
+            return len(self._query_queued(cursor, 'id', limit=1, extra_predicate=extra_predicate)) > 0
+
+    def change_cursor(self):
+        """ Returns the shard's latest change sequence number, or None if
+        the shard has no change feed. """
+        if self.storage.dialect != apsw_sql_utility.SQLITE:
+            return None
+        with self.storage.cursor() as cursor:
+            return apsw_helpers.get(cursor, 'SELECT seq FROM task_changes').seq
+
+    def get_changes(self, since):
+        """ Returns the tasks whose last change came after change sequence
+        number since, with their current state, in the order they changed. """
+        query_params = api.shared.TaskState.projection_params()
+        with self.storage.cursor() as cursor:
+            rows = apsw_helpers.query(cursor, '''
+                SELECT *, %s AS state
+                FROM %s
+                WHERE change_seq > :since
+                ORDER BY change_seq ASC
+            ''' % (api.shared.TaskState.PROJECTION, self.table_name),
+                since=since, **query_params)
+        return [ api.shared.task_load_row(row) for row in rows ]
 
     # NOTE: This method overrides bulk_finish on APSWSQLStepQueue so that it
     # finishes tasks even if they are currently running.
-    def bulk_finish(self, result='cancelled', extra_predicate=None):
+    def bulk_finish(self, result='cancelled', extra_predicate=None, batch_size=BULK_BATCH_SIZE):
+        """ Finish every unfinished task that matches extra_predicate.
+        Returns the number of tasks that were finished.
+
+        Tasks are finished batch_size at a time, each batch in its own
+        transaction, so that workers can write between batches. """
         extra_predicate_sql, extra_predicate_args = (
             self._build_extra_predicate(extra_predicate))
 
+        return self._finish_in_batches('''
+            SELECT id FROM %s
+            WHERE
+                finished IS NULL
+                %s
+            ORDER BY id ASC
+            LIMIT :limit
+        ''' % (self.table_name, extra_predicate_sql), extra_predicate_args, result, batch_size)
+
+    def bulk_finish_file_ids(self, file_ids, result='cancelled', batch_size=BULK_BATCH_SIZE):
+        """ Like bulk_finish, but finishes every unfinished task that is
+        loading one of file_ids.  The file ids are copied into a temporary
+        table that the tasks are joined against, so any number of them can
+        be passed in. """
+        table = 'bulk_file_ids_' + uuid.uuid1().hex
+        file_ids = sorted(set(str(file_id) for file_id in file_ids))
+
         with self.storage.transaction() as cursor:
-            now = unix_timestamp(datetime.utcnow())
-            affected_rows = apsw_helpers.query(cursor, '''
-                SELECT * from %s
+            cursor.execute(apsw_sql_utility.for_dialect(_FILE_IDS_TABLE, self.storage.dialect) % table)
+        try:
+            for i in xrange(0, len(file_ids), batch_size):
+                with self.storage.transaction() as cursor:
+                    cursor.executemany(
+                        'INSERT INTO %s (file_id) VALUES (?)' % table,
+                        [ (file_id,) for file_id in file_ids[i:i + batch_size] ])
+
+            return self._finish_in_batches('''
+                SELECT tasks.id AS id
+                FROM
+                    %s AS tasks
+                    INNER JOIN %s AS file_ids ON file_ids.file_id = tasks.file_id
+                WHERE tasks.finished IS NULL
+                ORDER BY tasks.id ASC
+                LIMIT :limit
+            ''' % (self.table_name, table), {}, result, batch_size)
+        finally:
+            with self.storage.transaction() as cursor:
+                cursor.execute('DROP TABLE %s' % table)
+
+    def get_file_outcomes(self, job_ids, file_ids):
+        """ Returns a dict of each of file_ids that the jobs in job_ids
+        have tasks for -> whether any of those tasks is queued, running or
+        succeeded, rather than errored or cancelled. """
+        if not job_ids or not file_ids:
+            return {}
+        job_ids_string = ','.join("'%s'" % job_id for job_id in job_ids)
+        with self.storage.cursor() as cursor:
+            rows = apsw_helpers.query(cursor, '''
+                SELECT
+                    file_id,
+                    MAX(CASE WHEN finished IS NULL OR result = 'success' THEN 1 ELSE 0 END) AS loaded
+                FROM all_tasks AS tasks
                 WHERE
-                    finished IS NULL
-                    %s
-            ''' % (self.table_name, extra_predicate_sql),
-                **extra_predicate_args)
-            apsw_helpers.query(cursor, '''
-                UPDATE %s
-                SET
-                    execution_id = 0,
-                    last_contact = datetime(:now, 'unixepoch'),
-                    update_count = update_count + 1,
-                    steps = '[]',
-                    started = datetime(:now, 'unixepoch'),
-                    finished = datetime(:now, 'unixepoch'),
-                    result = :result
+                    job_id IN (%s)
+                    AND file_id IN (%s)
+                GROUP BY file_id
+            ''' % (job_ids_string, ','.join('?' * len(file_ids))), *[ str(file_id) for file_id in file_ids ])
+        return dict((row.file_id, bool(row.loaded)) for row in rows)
+
+    def archive(self, finished_before, batch_size=500):
+        """ Move up to batch_size tasks that finished before the
+        finished_before unix timestamp into tasks_history.  Returns the
+        number of tasks that were moved.
+
+        job_stats is left alone, so per-job summaries still include
+        archived tasks. """
+        with self.storage.transaction() as cursor:
+            # A finished task is never contacted again, and last_contact is
+            # indexed while finished is not.
+            rows = apsw_helpers.query(cursor, '''
+                SELECT id FROM %s
                 WHERE
-                    finished IS NULL
-                    %s
-            ''' % (self.table_name, extra_predicate_sql),
-                now=now,
-                result=result,
-                **extra_predicate_args)
+                    last_contact < :finished_before
+                    AND finished IS NOT NULL
+                ORDER BY last_contact ASC
+                LIMIT :limit
+            ''' % self.table_name,
+                finished_before=finished_before,
+                limit=batch_size)
+
+            if rows:
+                id_list = ','.join(str(row.id) for row in rows)
+                cursor.execute('''
+                    REPLACE INTO tasks_history (%s)
+                    SELECT %s FROM %s WHERE id IN (%s)
+                ''' % (TASK_COLUMNS, TASK_COLUMNS, self.table_name, id_list))
+                cursor.execute('DELETE FROM %s WHERE id IN (%s)' % (self.table_name, id_list))
+
+        return len(rows)
+
+    def _finish_in_batches(self, select_sql, params, result, batch_size):
+        """ Finish the tasks whose ids are returned by select_sql, batch_size
+        at a time, until it returns no more.  select_sql must only return
+        unfinished tasks and take a :limit parameter; ordering by id keeps
+        concurrent bulk operations from deadlocking on MySQL. """
+        finished = 0
+        while True:
+            with self.storage.transaction() as cursor:
+                rows = apsw_helpers.query(cursor, select_sql, limit=batch_size, **params)
+                if not rows:
+                    break
 
-        return len(affected_rows)
+                # The ids are integers straight from the database, so they
+                # are safe to inline.
+                apsw_helpers.query(cursor, '''
+                    UPDATE %s
+                    SET
+                        execution_id = 0,
+                        last_contact = :now,
+                        update_count = update_count + 1,
+                        steps = '[]',
+                        started = :now,
+                        finished = :now,
+                        result = :result
+                    WHERE
+                        id IN (%s)
+                        AND finished IS NULL
+                ''' % (self.table_name, ','.join(str(row.id) for row in rows)),
+                    now=unix_timestamp(datetime.utcnow()),
+                    result=result)
+                finished += self.storage.transaction_changes()
+
+            if len(rows) < batch_size:
+                break
+        return finished
 
     def get_tasks_in_state(self, state, extra_predicate=None):
+        return list(self.iter_tasks_in_state(state, extra_predicate=extra_predicate))
+
+    def iter_tasks_in_state(self, state, extra_predicate=None):
+        """ Like get_tasks_in_state, but yields the tasks one at a time
+        instead of building a list of all of them.  The query keeps reading
+        the same snapshot of the loader DB until the generator is exhausted
+        or closed. """
         extra_predicate_sql, extra_predicate_args = (
             self._build_extra_predicate(extra_predicate))
 
@@ -125,15 +582,147 @@ class Tasks(apsw_sql_step_queue.APSWSQLStepQueue):
         else:
             state_list = str(tuple(str(v) for v in state ))
         query_params.update(extra_predicate_args)
+
+        # Only finished tasks ever get archived
+        unfinished_states = (api.shared.TaskState.QUEUED, api.shared.TaskState.RUNNING)
+        if all(s in unfinished_states for s in state):
+            table = self.table_name
+        else:
+            table = 'all_tasks AS %s' % self.table_name
+
         with self.storage.cursor() as cursor:
-            rows = apsw_helpers.query(cursor, '''
+            rows = apsw_helpers.iquery(cursor, '''
                 SELECT *
                 FROM %s
                 WHERE
                     %s IN %s
                     %s
                 ORDER BY id ASC
-            ''' % (self.table_name, api.shared.TaskState.PROJECTION, state_list, extra_predicate_sql),
+            ''' % (table, api.shared.TaskState.PROJECTION, state_list, extra_predicate_sql),
                 **query_params)
+            for row in rows:
+                yield api.shared.task_load_row(row)
 
-        return [ api.shared.task_load_row(row) for row in rows ]
+class Tasks(object):
+    """ The task queue, spread across the shards of the loader database
+    (see loader_db/shards.py).
+
+    A job's tasks are all enqueued into the same shard.  start() claims from
+    home_shard first and only steals from the other shards when it has no
+    queued tasks, so giving each worker a different home_shard spreads the
+    workers across the shards' write locks.  Everything else is run on
+    every shard and the results are combined.
+    """
+
+    def __init__(self, home_shard=None):
+        self.shards = [ TaskShard(shard) for shard in xrange(shards.num_shards()) ]
+        if home_shard is None:
+            home_shard = random.randrange(len(self.shards))
+        home_shard %= len(self.shards)
+        # The home shard, followed by the others in the order they are
+        # stolen from.
+        self._claim_order = self.shards[home_shard:] + self.shards[:home_shard]
+
+    def ready(self):
+        return all(shard.ready() for shard in self.shards)
+
+    def setup(self):
+        for shard in self.shards:
+            shard.setup()
+        return self
+
+    def qsize(self, extra_predicate=None):
+        return sum(shard.qsize(extra_predicate=extra_predicate) for shard in self.shards)
+
+    def enqueue(self, data, job_id=None, file_id=None, md5=None, bytes_total=None):
+        shard = self.shards[shards.shard_for_job(job_id, len(self.shards))]
+        return shard.enqueue(data, job_id=job_id, file_id=file_id, md5=md5, bytes_total=bytes_total)
+
+    def start(self, block=False, timeout=None, retry_interval=0.5, extra_predicate=None):
+        """ Claim a task, see APSWSQLStepQueue.start. """
+        start = time.time()
+        while 1:
+            task_handler = self._claim(extra_predicate)
+            if task_handler is None and block:
+                if timeout is not None and (time.time() - start) > timeout:
+                    break
+                time.sleep(retry_interval * (random.random() + 0.1))
+            else:
+                break
+        return task_handler
+
+    def bulk_finish(self, result='cancelled', extra_predicate=None, batch_size=BULK_BATCH_SIZE):
+        return sum(
+            shard.bulk_finish(result=result, extra_predicate=extra_predicate, batch_size=batch_size)
+            for shard in self.shards)
+
+    def bulk_finish_file_ids(self, file_ids, result='cancelled', batch_size=BULK_BATCH_SIZE):
+        return sum(
+            shard.bulk_finish_file_ids(file_ids, result=result, batch_size=batch_size)
+            for shard in self.shards)
+
+    def get_failed_file_ids(self, job_ids, file_ids):
+        """ Returns the set of file_ids that the jobs in job_ids have tasks
+        for, every one of which errored or was cancelled. """
+        loaded = {}
+        for shard in self.shards:
+            shard_job_ids = [ job_id for job_id in job_ids if shards.shard_for_job(job_id, len(self.shards)) == shard.shard ]
+            for file_id, file_loaded in shard.get_file_outcomes(shard_job_ids, file_ids).items():
+                loaded[file_id] = loaded.get(file_id, False) or file_loaded
+        return set(file_id for file_id, file_loaded in loaded.items() if not file_loaded)
+
+    def archive(self, finished_before, batch_size=500):
+        return sum(shard.archive(finished_before, batch_size=batch_size) for shard in self.shards)
+
+    def get_tasks_in_state(self, state, extra_predicate=None):
+        return list(self.iter_tasks_in_state(state, extra_predicate=extra_predicate))
+
+    def get_job_stats(self, job_id):
+        """ Returns the job's task counters from job_stats, or None if the
+        job has no tasks. """
+        shard = self.shards[shards.shard_for_job(job_id, len(self.shards))]
+        with shard.storage.cursor() as cursor:
+            return apsw_helpers.get(cursor, 'SELECT * FROM job_stats WHERE job_id = :job_id', job_id=job_id)
+
+    def change_cursor(self):
+        """ Returns a change feed cursor that is past every change made so
+        far, or None if the loader DB has no change feed (see
+        TASK_CHANGES_TABLE).
+
+        Watchers read the tasks they are interested in once, having taken a
+        cursor first, and from then on only read the tasks that changed
+        with get_changes. """
+        cursor = tuple(shard.change_cursor() for shard in self.shards)
+        return None if None in cursor else cursor
+
+    def get_changes(self, cursor):
+        """ Returns (tasks, cursor): every task that changed after cursor,
+        once each and with its current state, and the cursor to pass in
+        next time.  Tasks that are archived stop showing up in the feed.
+
+        A task's state also changes from RUNNING to QUEUED when its claim
+        expires, which is not a change to the task. """
+        changed = []
+        next_cursor = []
+        for shard, since in zip(self.shards, cursor):
+            rows = shard.get_changes(since)
+            changed.extend(rows)
+            next_cursor.append(rows[-1].change_seq if rows else since)
+        return changed, tuple(next_cursor)
+
+    def iter_tasks_in_state(self, state, extra_predicate=None):
+        """ Yields the tasks of every shard, ordered by id. """
+        return itertools.chain.from_iterable(
+            shard.iter_tasks_in_state(state, extra_predicate=extra_predicate)
+            for shard in self.shards)
+
+    def _claim(self, extra_predicate):
+        for shard in self._claim_order:
+            # Empty shards are skipped on a read snapshot, so that idle
+            # workers don't queue up for every shard's write lock.
+            if not shard.has_queued(extra_predicate):
+                continue
+            task_handler = shard._dequeue_task(extra_predicate)
+            if task_handler is not None:
+                return task_handler
+        return None
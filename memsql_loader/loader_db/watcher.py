@@ -0,0 +1,210 @@
+import itertools
+import threading
+import time
+from datetime import datetime
+
+from boto.s3.connection import S3Connection
+
+from memsql_loader.loader_db import local_watcher
+from memsql_loader.loader_db.jobs import Jobs
+from memsql_loader.loader_db.manifests import Manifests, SORTED
+from memsql_loader.loader_db.tasks import Tasks
+from memsql_loader.loader_db.watches import Watches
+from memsql_loader.util import inotify, log
+from memsql_loader.util.apsw_sql_step_queue.time_helpers import precise_unix_timestamp
+
+# Files found by a scan are queued this many at a time
+ENQUEUE_BATCH_SIZE = 1000
+
+# Seconds between records of how far the watches followed with inotify have
+# got while no new files arrive; they are recorded as soon as files do.
+LOCAL_HEARTBEAT_INTERVAL = 5
+
+class JobWatcher(threading.Thread):
+    """ Scans the paths of every watch job (see loader_db/watches.py) when
+    it is due, and queues the files that are new or have changed since its
+    last scan.
+
+    Due watches are scanned one after the other, the most overdue first.
+    Files are queued as they are listed, in small batches, so that workers
+    can start loading them before a long listing is over.  Every watch is
+    scanned when the watcher starts, due or not, since files may have
+    appeared while no server was watching.
+
+    Watches whose paths are all local are also followed with inotify (see
+    loader_db/local_watcher.py) in between polls, and their files are
+    queued as soon as they have been written, without scanning.  Such
+    watches are only scanned again if inotify drops events.
+    """
+
+    def __init__(self, poll_interval=1):
+        """
+        poll_interval   seconds between checks for due watches
+        """
+        super(JobWatcher, self).__init__(name='job-watcher')
+        self.daemon = True
+        self.poll_interval = poll_interval
+        self.logger = log.get_logger('JobWatcher')
+        self._jobs = Jobs()
+        self._tasks = Tasks()
+        self._manifests = Manifests()
+        self._watches = Watches()
+        self._stopping = threading.Event()
+        self._watching = False
+        self._local = None
+        self._last_heartbeat = 0
+
+        if inotify.is_supported():
+            try:
+                self._local = local_watcher.LocalWatcher()
+            except inotify.InotifyError as e:
+                self.logger.warning('Local paths will be scanned for new files, inotify is unavailable: %s', e)
+
+    def run(self):
+        rescan = True
+        while not self._stopping.is_set():
+            try:
+                self.poll(rescan=rescan)
+                rescan = False
+            except Exception:
+                self.logger.exception('Failed to check for due watch jobs')
+            try:
+                self.follow_local(self.poll_interval)
+            except Exception:
+                self.logger.exception('Failed to queue new local files')
+                self._stopping.wait(self.poll_interval)
+        if self._local is not None:
+            self._local.close()
+
+    def is_watching(self):
+        """ Whether there were active watches at the last poll. """
+        return self._watching
+
+    def poll(self, rescan=False):
+        """ Scan every watch that is due, or every watch if rescan is True.
+        Returns the number of files queued. """
+        self._watching = self._watches.has_active()
+        queued = 0
+        for watch in self._watches.get_active() if rescan else self._watches.get_due():
+            if self._stopping.is_set():
+                break
+            queued += self.scan(watch)
+        return queued
+
+    def scan(self, watch):
+        """ Scan the paths of watch's job once, and schedule its next scan.
+        Returns the number of files queued.  Watches that another server
+        claimed since they were read are left to it. """
+        if not self._watches.claim(watch):
+            return 0
+        job = self._jobs.get(watch.job_id)
+        if job is None:
+            self.logger.info('Job %s no longer exists, stopping its watch', watch.job_id)
+            self._watches.stop(('job_id = :job_id', { 'job_id': watch.job_id }))
+            return 0
+
+        # Followed before the scan, so that no file is missed in between
+        if self._local is not None and job.id not in self._local and local_watcher.can_watch(job):
+            self._follow(job)
+
+        scan_start = precise_unix_timestamp(datetime.utcnow())
+        count = 0
+        error = None
+        try:
+            markers = None
+            if job.spec.source.incremental == SORTED:
+                markers = self._manifests.get_list_markers(job)
+
+            keys = job.get_files(s3_conn=self._s3_connection(job), markers=markers)
+            keys = self._manifests.filter_unchanged(job, keys)
+            while True:
+                batch = list(itertools.islice(keys, ENQUEUE_BATCH_SIZE))
+                if not batch:
+                    break
+                if self._is_stopped(watch.job_id):
+                    self.logger.info('Job %s was cancelled during a scan', watch.job_id)
+                    break
+                for key in batch:
+                    job.enqueue_file(self._tasks, key)
+                self._manifests.record_files(job, batch)
+                count += len(batch)
+        except Exception as e:
+            self.logger.exception('Failed to scan the paths of job %s', watch.job_id)
+            error = str(e)
+
+        if count > 0:
+            self.logger.info('Queued %d new files for job %s', count, watch.job_id)
+        self._watches.finish_scan(watch, scan_start, count, error=error)
+        return count
+
+    def follow_local(self, timeout):
+        """ Queue the files written to the paths followed with inotify for
+        timeout seconds. """
+        if self._local is None or not self._local.job_ids():
+            self._stopping.wait(timeout)
+            return
+
+        deadline = time.time() + timeout
+        while not self._stopping.is_set() and time.time() < deadline:
+            read_start = precise_unix_timestamp(datetime.utcnow())
+            overflowed, keys = self._local.read(max(deadline - time.time(), 0))
+            if overflowed:
+                self.logger.warning('inotify dropped events, scanning the paths of every job it follows again')
+                for job_id in self._local.job_ids():
+                    watch = self._watches.get(job_id)
+                    if watch is not None and watch.stopped is None:
+                        self.scan(watch)
+                continue
+
+            queued = {}
+            for job_id, job_keys in keys.items():
+                queued[job_id] = self._queue_local(job_id, job_keys)
+            if any(queued.values()) or time.time() >= self._last_heartbeat + LOCAL_HEARTBEAT_INTERVAL:
+                self._heartbeat(read_start, queued)
+
+    def _queue_local(self, job_id, keys):
+        if job_id not in self._local or self._is_stopped(job_id):
+            return 0
+        job = self._local.get_job(job_id)
+        # A file that was written to twice since the last read is only
+        # queued once.
+        keys = dict((key.name, key) for key in keys).values()
+        keys = list(self._manifests.filter_unchanged(job, keys))
+        for key in keys:
+            job.enqueue_file(self._tasks, key)
+        self._manifests.record_files(job, keys)
+        if keys:
+            self.logger.info('Queued %d new files for job %s', len(keys), job_id)
+        return len(keys)
+
+    def _heartbeat(self, scan_start, queued):
+        """ Records that every file written to the followed paths before
+        scan_start has been queued, which holds off their next scans. """
+        for job_id in self._local.job_ids():
+            if not self._watches.record_events(job_id, scan_start, queued.get(job_id, 0)):
+                self.logger.info('Stopped following the paths of job %s', job_id)
+                self._local.remove(job_id)
+        self._last_heartbeat = time.time()
+
+    def _follow(self, job):
+        try:
+            if self._local.add(job):
+                self.logger.info('Following the paths of job %s with inotify', job.id)
+        except inotify.InotifyError as e:
+            self.logger.warning('Scanning the paths of job %s for new files, they can not be followed with inotify: %s', job.id, e)
+
+    def _is_stopped(self, job_id):
+        current = self._watches.get(job_id)
+        return current is None or current.stopped is not None
+
+    def _s3_connection(self, job):
+        # A manifest may list S3 keys, whatever its own path is
+        if job.file_list is None and not any(path.scheme == 's3' for path in job.paths):
+            return None
+        if job.spec.source.aws_access_key is None or job.spec.source.aws_secret_key is None:
+            return S3Connection(anon=True)
+        return S3Connection(job.spec.source.aws_access_key, job.spec.source.aws_secret_key)
+
+    def stop(self):
+        self._stopping.set()
+        self.join()
@@ -0,0 +1,170 @@
+""" Watch jobs, see `load --watch`.
+
+A watch job keeps queueing the files that appear in its paths after it was
+created: the server's JobWatcher (see loader_db/watcher.py) scans the
+paths of every active watch whenever it is due, and queues the new or
+changed files in the job, using the listing manifests (see
+loader_db/manifests.py) to tell them apart.
+
+Watches are scanned every interval seconds while scans keep finding new
+files.  Every scan that finds nothing doubles the wait before the next one,
+up to max_interval, and a scan that finds something resets it.  A watch
+runs until its job is cancelled.
+
+Several servers may share a loader database (see MEMSQL_LOADER_DB_URL), so a
+server claims a watch before scanning it, by moving its next scan max_interval
+seconds on, and only scans it if the watch was still due as it read it.  The
+next scan is scheduled properly when the scan finishes; if the server dies
+first, another one picks the watch up once the claim runs out.
+
+Watches whose paths are all local are also followed with inotify between
+scans, which keeps putting their next scan off for as long as it works: they
+are only scanned again after the server restarts or inotify drops events.
+"""
+
+import datetime
+
+from memsql_loader.loader_db.storage import LoaderStorage
+from memsql_loader.util import apsw_sql_utility, apsw_helpers
+from memsql_loader.util.apsw_sql_step_queue.time_helpers import unix_timestamp
+
+PRIMARY_TABLE = apsw_sql_utility.TableDefinition('job_watches', { apsw_sql_utility.SQLITE: """\
+CREATE TABLE IF NOT EXISTS job_watches (
+    job_id BINARY(32) PRIMARY KEY,
+    interval INTEGER NOT NULL,
+    max_interval INTEGER NOT NULL,
+
+    -- Seconds to wait after the last scan, backed off while scans find
+    -- nothing new.
+    current_interval INTEGER NOT NULL,
+    next_scan INTEGER NOT NULL,
+
+    last_scan_start REAL,
+    last_scan_stop REAL,
+    last_scan_files INTEGER,
+    last_error TEXT,
+    files_queued INTEGER NOT NULL DEFAULT 0,
+
+    -- Set when the job is cancelled
+    stopped INTEGER
+)""", apsw_sql_utility.MYSQL: """\
+CREATE TABLE IF NOT EXISTS job_watches (
+    job_id CHAR(32) PRIMARY KEY,
+    `interval` INT NOT NULL,
+    max_interval INT NOT NULL,
+
+    current_interval INT NOT NULL,
+    next_scan BIGINT NOT NULL,
+
+    last_scan_start DOUBLE,
+    last_scan_stop DOUBLE,
+    last_scan_files BIGINT,
+    last_error LONGTEXT,
+    files_queued BIGINT NOT NULL DEFAULT 0,
+
+    stopped BIGINT
+)""" }, index_columns=('next_scan',))
+
+def _now():
+    return unix_timestamp(datetime.datetime.utcnow())
+
+class Watches(apsw_sql_utility.APSWSQLUtility):
+    def __init__(self):
+        super(Watches, self).__init__(LoaderStorage())
+
+        self._define_table(PRIMARY_TABLE)
+
+    def start(self, job, last_scan_start=None, files_queued=0):
+        """ Starts watching job, whose paths were last scanned at
+        last_scan_start (a unix timestamp), queueing files_queued files. """
+        now = _now()
+        interval = job.spec.source.watch_interval
+        with self.storage.transaction() as cursor:
+            cursor.execute('''
+                REPLACE INTO job_watches (
+                    job_id, `interval`, max_interval, current_interval, next_scan,
+                    last_scan_start, last_scan_files, files_queued)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (job.id, interval, job.spec.source.watch_max_interval, interval, now + interval,
+                  last_scan_start, files_queued if last_scan_start is not None else None, files_queued))
+
+    def get(self, job_id):
+        with self.storage.cursor() as cursor:
+            return apsw_helpers.get(cursor, 'SELECT * FROM job_watches WHERE job_id = ?', job_id)
+
+    def has_active(self):
+        with self.storage.cursor() as cursor:
+            return apsw_helpers.get(cursor, 'SELECT 1 AS active FROM job_watches WHERE stopped IS NULL LIMIT 1') is not None
+
+    def get_active(self):
+        with self.storage.cursor() as cursor:
+            return apsw_helpers.query(cursor, 'SELECT * FROM job_watches WHERE stopped IS NULL ORDER BY next_scan ASC')
+
+    def get_due(self):
+        """ Returns the active watches that are due for a scan, the most
+        overdue first. """
+        with self.storage.cursor() as cursor:
+            return apsw_helpers.query(cursor, '''
+                SELECT * FROM job_watches
+                WHERE stopped IS NULL AND next_scan <= ?
+                ORDER BY next_scan ASC
+            ''', _now())
+
+    def claim(self, watch):
+        """ Claims a scan of watch, as read by get_due or get_active.
+        Returns False if another server has claimed or scanned it since
+        (or it has been stopped), in which case it mustn't be scanned. """
+        with self.storage.transaction() as cursor:
+            cursor.execute('''
+                UPDATE job_watches SET next_scan = ? + max_interval
+                WHERE job_id = ? AND next_scan = ? AND stopped IS NULL
+            ''', (_now(), watch.job_id, watch.next_scan))
+            return self.storage.transaction_changes() == 1
+
+    def finish_scan(self, watch, scan_start, files, error=None):
+        """ Records a scan of watch that started at scan_start and queued
+        files files, and schedules the next one. """
+        if files > 0:
+            interval = watch.interval
+        else:
+            interval = min(watch.current_interval * 2, watch.max_interval)
+        now = _now()
+        with self.storage.transaction() as cursor:
+            cursor.execute('''
+                UPDATE job_watches SET
+                    current_interval = ?,
+                    next_scan = ?,
+                    last_scan_start = ?,
+                    last_scan_stop = ?,
+                    last_scan_files = ?,
+                    last_error = ?,
+                    files_queued = files_queued + ?
+                WHERE job_id = ?
+            ''', (interval, now + interval, scan_start, now, files, error, files, watch.job_id))
+
+    def record_events(self, job_id, scan_start, files):
+        """ Records that every file that appeared in the paths of job_id's
+        job before scan_start has been seen without scanning them (see
+        loader_db/local_watcher.py), files of them new, and holds off the
+        next scan.  Returns False if the watch has been stopped. """
+        now = _now()
+        with self.storage.transaction() as cursor:
+            cursor.execute('''
+                UPDATE job_watches SET
+                    next_scan = ? + max_interval,
+                    last_scan_start = ?,
+                    last_scan_stop = ?,
+                    last_error = NULL,
+                    files_queued = files_queued + ?
+                WHERE job_id = ? AND stopped IS NULL
+            ''', (now, scan_start, now, files, job_id))
+            return self.storage.transaction_changes() > 0
+
+    def stop(self, job_id_predicate):
+        """ Stops the watches of the jobs matching job_id_predicate, a
+        (predicate on job_id, params) pair. """
+        predicate, params = job_id_predicate
+        with self.storage.transaction() as cursor:
+            cursor.execute(
+                'UPDATE job_watches SET stopped = :now WHERE stopped IS NULL AND (%s)' % predicate,
+                dict(params, now=_now()))
@@ -4,25 +4,42 @@ class _NoDefault(object):
     pass
 
 class _RowBase(object):
-    pass
+    __slots__ = ()
+
+def field_index(fields):
+    """ Build the field name -> position map for a field tuple.
+
+    If a name appears more than once the first position wins, just like
+    tuple.index.
+    """
+    index = {}
+    for i, field in enumerate(fields):
+        index.setdefault(field, i)
+    return index
 
 class Row(_RowBase):
     """ Encapsulates a value tuple and column dictionary from APSW.
 
     Provides very fast access to values/column names via attribute and item
-    lookup.
+    lookup.  Rows have no instance dict; the field tuple and the field ->
+    position map are shared by every row of a result set, so a row costs
+    little more than its value tuple.
 
     It is recommended to use the query and get methods in this module to create
     Row objects.
     """
 
-    def __init__(self, fields, values):
+    __slots__ = ("_fields", "_index", "_values")
+
+    def __init__(self, fields, values, index=None):
         """ Row() constructs a new Row object from a field and value tuple.
 
         :param fields: The field names for this Row.
         :param values: The field values for this Row.
+        :param index: The field_index() of fields, if the caller has it already.
         """
         super(Row, self).__setattr__("_fields", fields)
+        super(Row, self).__setattr__("_index", index if index is not None else field_index(fields))
         super(Row, self).__setattr__("_values", values)
 
     def get(self, name, default=_NoDefault):
@@ -32,9 +49,9 @@ class Row(_RowBase):
         :param default: An optional default value to return if the column doesn't exist.
         """
         try:
-            return self._values[self._fields.index(name)]
-        except (ValueError, IndexError):
-            if default == _NoDefault:
+            return self._values[self._index[name]]
+        except (KeyError, IndexError):
+            if default is _NoDefault:
                 raise KeyError(name)
             else:
                 return default
@@ -44,13 +61,20 @@ class Row(_RowBase):
 
         :param name: The name of the column
         """
-        try:
-            if isinstance(self._values, tuple):
-                self._values = list(self._values)
-            self._values[self._fields.index(name)] = value
-        except (ValueError, IndexError):
-            self._fields += (name,)
-            self._values += (value,)
+        if isinstance(self._values, tuple):
+            self._values = list(self._values)
+
+        position = self._index.get(name)
+        if position is not None:
+            self._values[position] = value
+        else:
+            # The field tuple and index are shared with the rest of the
+            # result set, so adding a field copies them.
+            index = dict(self._index)
+            index[name] = len(self._fields)
+            self._index = index
+            self._fields = self._fields + (name,)
+            self._values.append(value)
 
     def __getattr__(self, name):
         """ Rows support looking up a column value by attribute access.
@@ -73,7 +97,7 @@ class Row(_RowBase):
             row = get(cursor, "select * from foo limit 1")
             row.bar = "boing"
         """
-        if hasattr(self, name) and name not in self._fields:
+        if hasattr(self, name) and name not in self._index:
             super(Row, self).__setattr__(name, value)
         else:
             self.set(name, value)
@@ -103,7 +127,7 @@ class Row(_RowBase):
 
         :param name: The name of the column to check.
         """
-        return name in self._fields
+        return name in self._index
 
     has_key = __contains__
 
@@ -162,7 +186,11 @@ class SelectResult(list):
 
     It is very efficient since it doesn't copy the underlying tuples at all.  It
     reads the provided row iterator (usually a cursor) and builds a single list
-    of refs to the original tuples.  A single field list is shared by all rows.
+    of refs to the original tuples.  A single field list and field index are
+    shared by all rows.
+
+    Use iquery instead of query to process large result sets without holding
+    all of the rows in memory.
     """
 
     def __init__(self, fields, rows, is_rows=False, RowClass=Row):
@@ -175,7 +203,8 @@ class SelectResult(list):
         self.fields = fields
         self.RowClass = RowClass
         if not is_rows:
-            super(SelectResult, self).__init__(self.RowClass(fields, row) for row in rows)
+            index = field_index(fields)
+            super(SelectResult, self).__init__(self.RowClass(fields, row, index) for row in rows)
         else:
             super(SelectResult, self).__init__(rows)
 
@@ -228,6 +257,38 @@ def query(cursor, query, *params, **kwparams):
     else:
         return SelectResult(tuple(f[0] for f in description), cursor, RowClass=RowClass)
 
+def iquery(cursor, query, *params, **kwparams):
+    """ Run a query on the cursor, and return a generator of Rows.
+
+    Unlike query, rows are built as they are read from the cursor, so large
+    result sets can be processed without holding them all in memory.  The
+    generator must be consumed before the cursor is used for anything else.
+
+    Takes the same arguments as query.
+
+    Usage::
+
+        for row in iquery(cursor, "select * from foo where bar=:baz", baz="test"):
+            assert row.bar == "test"
+    """
+    RowClass = kwparams.pop("RowClass", Row)
+
+    if len(params) and len(kwparams):
+        raise apsw.Error("Only specify positional or dictionary params, not both")
+
+    params = params if len(params) else kwparams
+    cursor.execute(query, params)
+
+    try:
+        description = cursor.getdescription()
+    except apsw.ExecutionCompleteError:
+        return
+
+    fields = tuple(f[0] for f in description)
+    index = field_index(fields)
+    for row in cursor:
+        yield RowClass(fields, row, index)
+
 def get(cursor, query, *params, **kwparams):
     """ Run a query on the cursor, and return the first row as a Row or None.
 
@@ -9,10 +9,12 @@ from memsql_loader.util.apsw_sql_step_queue.task_handler import TaskHandler
 from memsql_loader.util.apsw_sql_step_queue.time_helpers import unix_timestamp
 
 def primary_table_definition(table_name):
-    return apsw_sql_utility.TableDefinition(table_name, """\
+    return apsw_sql_utility.TableDefinition(table_name, { apsw_sql_utility.SQLITE: """\
 CREATE TABLE IF NOT EXISTS %(table_name)s (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
-    created DATETIME NOT NULL,
+    -- All timestamps are stored as integer unix timestamps (see
+    -- time_helpers.unix_timestamp) so that they compare as numbers.
+    created INTEGER NOT NULL,
 
     data TEXT,
     result TEXT,
@@ -28,12 +30,44 @@ CREATE TABLE IF NOT EXISTS %(table_name)s (
     bytes_downloaded INTEGER DEFAULT NULL,
     download_rate INTEGER DEFAULT NULL,
     md5 TEXT DEFAULT NULL,
+    row_count INTEGER DEFAULT NULL,
+    -- precise unix timestamps of the download step, set on finish
+    download_start REAL DEFAULT NULL,
+    download_stop REAL DEFAULT NULL,
+    -- position of the row's last change in the change feed
+    change_seq INTEGER DEFAULT NULL,
 
-    started DATETIME,
-    last_contact DATETIME,
+    started INTEGER,
+    last_contact INTEGER,
     update_count INT UNSIGNED DEFAULT 0 NOT NULL,
-    finished DATETIME
-    )""" % { 'table_name': table_name }, index_columns=('created', 'started', 'last_contact', 'job_id', 'file_id'))
+    finished INTEGER
+    )""" % { 'table_name': table_name }, apsw_sql_utility.MYSQL: """\
+CREATE TABLE IF NOT EXISTS %(table_name)s (
+    id BIGINT PRIMARY KEY AUTO_INCREMENT,
+    created BIGINT NOT NULL,
+
+    data LONGTEXT,
+    result VARCHAR(32),
+
+    execution_id CHAR(32) DEFAULT NULL,
+    steps LONGTEXT,
+
+    job_id CHAR(32) DEFAULT NULL,
+    file_id VARCHAR(255) DEFAULT NULL,
+    bytes_total BIGINT DEFAULT NULL,
+    bytes_downloaded BIGINT DEFAULT NULL,
+    download_rate BIGINT DEFAULT NULL,
+    md5 VARCHAR(255) DEFAULT NULL,
+    row_count BIGINT DEFAULT NULL,
+    download_start DOUBLE DEFAULT NULL,
+    download_stop DOUBLE DEFAULT NULL,
+    change_seq BIGINT DEFAULT NULL,
+
+    started BIGINT,
+    last_contact BIGINT,
+    update_count INT UNSIGNED DEFAULT 0 NOT NULL,
+    finished BIGINT
+    )""" % { 'table_name': table_name } }, index_columns=('created', 'started', 'last_contact', 'job_id', 'file_id'))
 
 class APSWSQLStepQueue(apsw_sql_utility.APSWSQLUtility):
     def __init__(self, table_name, storage, execution_ttl=60, task_handler_class=TaskHandler):
@@ -71,7 +105,7 @@ class APSWSQLStepQueue(apsw_sql_utility.APSWSQLUtility):
                      md5,
                      bytes_total)
                 VALUES
-                    (datetime(:now, "unixepoch"),
+                    (:now,
                      :data,
                      :job_id,
                      :file_id,
@@ -120,33 +154,21 @@ class APSWSQLStepQueue(apsw_sql_utility.APSWSQLUtility):
 
         with self.storage.transaction() as cursor:
             now = unix_timestamp(datetime.utcnow())
-            affected_rows = apsw_helpers.query(cursor, '''
-                SELECT * from %s
-                WHERE
-                    finished IS NULL
-                    AND (
-                        execution_id IS NULL
-                        OR last_contact <= datetime(:now, 'unixepoch', '-%s second')
-                    )
-                    %s
-            ''' % (self.table_name, self.execution_ttl, extra_predicate_sql),
-                now=now,
-                **extra_predicate_args)
             apsw_helpers.query(cursor, '''
                 UPDATE %s
                 SET
                     execution_id = 0,
-                    last_contact = datetime(:now, 'unixepoch'),
+                    last_contact = :now,
                     update_count = update_count + 1,
                     steps = '[]',
-                    started = datetime(:now, 'unixepoch'),
-                    finished = datetime(:now, 'unixepoch'),
+                    started = :now,
+                    finished = :now,
                     result = :result
                 WHERE
                     finished IS NULL
                     AND (
                         execution_id IS NULL
-                        OR last_contact <= datetime(:now, 'unixepoch', '-%s second')
+                        OR last_contact <= :now - %s
                     )
                     %s
             ''' % (self.table_name, self.execution_ttl, extra_predicate_sql),
@@ -154,7 +176,7 @@ class APSWSQLStepQueue(apsw_sql_utility.APSWSQLUtility):
                 result=result,
                 **extra_predicate_args)
 
-        return len(affected_rows)
+            return self.storage.transaction_changes()
 
     ###############################
     # Private Interface
@@ -171,7 +193,7 @@ class APSWSQLStepQueue(apsw_sql_utility.APSWSQLUtility):
                 finished IS NULL
                 AND (
                     execution_id IS NULL
-                    OR last_contact <= datetime(:now, 'unixepoch', '-%s second')
+                    OR last_contact <= :now - %s
                 )
                 %s
             ORDER BY created ASC
@@ -189,8 +211,11 @@ class APSWSQLStepQueue(apsw_sql_utility.APSWSQLUtility):
             self._build_extra_predicate(extra_predicate))
 
         task_id = None
-        with self.storage.transaction() as cursor:
-            while task_id is None:
+        while task_id is None:
+            # Each attempt is its own transaction, so that on storages shared
+            # between processes the candidates are re-read once they have
+            # all been claimed by someone else.
+            with self.storage.transaction() as cursor:
                 possible_tasks = self._query_queued(cursor, 'id, created, data', limit=5, extra_predicate=extra_predicate)
 
                 if not possible_tasks:
@@ -198,22 +223,23 @@ class APSWSQLStepQueue(apsw_sql_utility.APSWSQLUtility):
                     return None
 
                 for possible_task in possible_tasks:
-                    # attempt to claim the task
+                    # attempt to claim the task; the UPDATE re-checks that it
+                    # is still queued, so only one claimer can succeed
                     now = unix_timestamp(datetime.utcnow())
                     apsw_helpers.query(cursor, '''
                         UPDATE %s
                         SET
                             execution_id = :execution_id,
-                            last_contact = datetime(:now, 'unixepoch'),
+                            last_contact = :now,
                             update_count = update_count + 1,
-                            started = datetime(:now, 'unixepoch'),
+                            started = :now,
                             steps = '[]'
                         WHERE
                             id = :task_id
                             AND finished IS NULL
                             AND (
                                 execution_id IS NULL
-                                OR last_contact <= datetime(:now, 'unixepoch', '-%s second')
+                                OR last_contact <= :now - %s
                             )
                             %s
                     ''' % (self.table_name, self.execution_ttl, extra_predicate_sql),
@@ -221,8 +247,9 @@ class APSWSQLStepQueue(apsw_sql_utility.APSWSQLUtility):
                         execution_id=execution_id,
                         task_id=possible_task.id,
                         **extra_predicate_args)
-                    task_id = possible_task.id
-                    break
+                    if self.storage.transaction_changes() == 1:
+                        task_id = possible_task.id
+                        break
         return self.TaskHandlerClass(execution_id=execution_id, task_id=task_id, queue=self)
 
     def _build_extra_predicate(self, extra_predicate):
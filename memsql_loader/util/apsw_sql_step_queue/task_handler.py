@@ -1,15 +1,10 @@
 import copy
 from datetime import datetime
-from dateutil import parser
 from contextlib import contextmanager
 
 from memsql_loader.util import apsw_helpers, super_json as json
 from memsql_loader.util.apsw_sql_step_queue.errors import TaskDoesNotExist, StepAlreadyStarted, StepNotStarted, StepAlreadyFinished, StepRunning, AlreadyFinished
-from memsql_loader.util.apsw_sql_step_queue.time_helpers import unix_timestamp
-
-def timedelta_total_seconds(td):
-    """ Needed for python 2.6 compat """
-    return (td.microseconds + (td.seconds + td.days * 24 * 3600) * 10. ** 6) / 10. ** 6
+from memsql_loader.util.apsw_sql_step_queue.time_helpers import unix_timestamp, precise_unix_timestamp
 
 class TaskHandler(object):
     def __init__(self, execution_id, task_id, queue):
@@ -31,6 +26,9 @@ class TaskHandler(object):
         self.bytes_total = None
         self.bytes_downloaded = None
         self.download_rate = None
+        self.row_count = None
+        self.download_start = None
+        self.download_stop = None
 
         self.steps = None
 
@@ -46,7 +44,7 @@ class TaskHandler(object):
 
         with self.storage.cursor() as cursor:
             row = apsw_helpers.get(cursor, '''
-                SELECT (last_contact > datetime(:now, 'unixepoch', '-%s second')) AS valid
+                SELECT (last_contact > :now - %s) AS valid
                 FROM %s
                 WHERE
                     id = :task_id
@@ -69,7 +67,7 @@ class TaskHandler(object):
                 WHERE
                     id = :task_id
                     AND execution_id = :execution_id
-                    AND last_contact > datetime(:now, 'unixepoch', '-%s second')
+                    AND last_contact > :now - %s
             ''' % (self._queue.table_name, self._queue.execution_ttl),
                 now=unix_timestamp(datetime.utcnow()),
                 task_id=self.task_id,
@@ -82,12 +80,12 @@ class TaskHandler(object):
             apsw_helpers.query(cursor, '''
                 UPDATE %s
                 SET
-                    last_contact=datetime(:now, 'unixepoch'),
+                    last_contact=:now,
                     update_count=update_count + 1
                 WHERE
                     id = :task_id
                     AND execution_id = :execution_id
-                    AND last_contact > datetime(:now, 'unixepoch', '-%s second')
+                    AND last_contact > :now - %s
             ''' % (self._queue.table_name, self._queue.execution_ttl),
                 now=unix_timestamp(datetime.utcnow()),
                 task_id=self.task_id,
@@ -99,7 +97,7 @@ class TaskHandler(object):
         if self.finished is not None:
             raise AlreadyFinished()
 
-        self._save(finished=datetime.utcnow(), result=result)
+        self._save(finished=unix_timestamp(datetime.utcnow()), result=result)
 
     def requeue(self):
         if self._running_steps() != 0:
@@ -113,7 +111,7 @@ class TaskHandler(object):
                 WHERE
                     id = :task_id
                     AND execution_id = :execution_id
-                    AND last_contact > datetime(:now, 'unixepoch', '-%s second')
+                    AND last_contact > :now - %s
             ''' % (self._queue.table_name, self._queue.execution_ttl),
                 now=unix_timestamp(datetime.utcnow()),
                 task_id=self.task_id,
@@ -152,7 +150,7 @@ class TaskHandler(object):
 
         steps = copy.deepcopy(self.steps)
         steps.append({
-            "start": datetime.utcnow(),
+            "start": precise_unix_timestamp(datetime.utcnow()),
             "name": step_name
         })
         self._save(steps=steps)
@@ -170,9 +168,9 @@ class TaskHandler(object):
         elif 'stop' in step_data:
             raise StepAlreadyFinished()
 
-        step_data['stop'] = datetime.utcnow()
+        step_data['stop'] = precise_unix_timestamp(datetime.utcnow())
 
-        step_data['duration'] = timedelta_total_seconds(step_data['stop'] - step_data['start'])
+        step_data['duration'] = step_data['stop'] - step_data['start']
         self._save(steps=steps)
 
     @contextmanager
@@ -206,7 +204,7 @@ class TaskHandler(object):
                 WHERE
                     id = :task_id
                     AND execution_id = :execution_id
-                    AND last_contact > datetime(:now, 'unixepoch', '-%s second')
+                    AND last_contact > :now - %s
             ''' % (self._queue.table_name, self._queue.execution_ttl),
                 now=unix_timestamp(datetime.utcnow()),
                 task_id=self.task_id,
@@ -224,46 +222,48 @@ class TaskHandler(object):
         self.bytes_total = row.bytes_total
         self.bytes_downloaded = row.bytes_downloaded
         self.download_rate = row.download_rate
-        self.steps = self._load_steps(json.loads(row.steps))
+        self.row_count = row.row_count
+        self.download_start = row.download_start
+        self.download_stop = row.download_stop
+        # Step start and stop times are stored as unix timestamps, so they
+        # don't need any parsing.
+        self.steps = json.loads(row.steps)
         self.started = row.started
         self.finished = row.finished
 
-    def _load_steps(self, raw_steps):
-        """ load steps -> basically load all the datetime isoformats into datetimes """
-        for step in raw_steps:
-            if 'start' in step:
-                step['start'] = parser.parse(step['start'])
-            if 'stop' in step:
-                step['stop'] = parser.parse(step['stop'])
-        return raw_steps
-
     def _save(self, finished=None, steps=None, result=None, data=None):
         finished = finished if finished is not None else self.finished
         with self.storage.transaction() as cursor:
             apsw_helpers.query(cursor, '''
                 UPDATE %s
                 SET
-                    last_contact=datetime(:now, 'unixepoch'),
+                    last_contact=:now,
                     update_count=update_count + 1,
                     steps=:steps,
-                    finished=datetime(:finished, 'unixepoch'),
+                    finished=:finished,
                     result=:result,
                     bytes_downloaded=:bytes_downloaded,
                     download_rate=:download_rate,
+                    row_count=:row_count,
+                    download_start=:download_start,
+                    download_stop=:download_stop,
                     data=:data
                 WHERE
                     id = :task_id
                     AND execution_id = :execution_id
-                    AND last_contact > datetime(:now, 'unixepoch', '-%s second')
+                    AND last_contact > :now - %s
             ''' % (self._queue.table_name, self._queue.execution_ttl),
                 now=unix_timestamp(datetime.utcnow()),
                 task_id=self.task_id,
                 execution_id=self.execution_id,
                 steps=json.dumps(steps if steps is not None else self.steps),
-                finished=unix_timestamp(finished) if finished else None,
+                finished=finished,
                 result=result if result is not None else self.result,
                 bytes_downloaded=self.bytes_downloaded,
                 download_rate=self.download_rate,
+                row_count=self.row_count,
+                download_start=self.download_start,
+                download_stop=self.download_stop,
                 data=json.dumps(data if data is not None else self.data))
 
             affected_row = apsw_helpers.get(cursor, '''
@@ -271,7 +271,7 @@ class TaskHandler(object):
                 WHERE
                     id = :task_id
                     AND execution_id = :execution_id
-                    AND last_contact > datetime(:now, 'unixepoch', '-%s second')
+                    AND last_contact > :now - %s
             ''' % (self._queue.table_name, self._queue.execution_ttl),
                 now=unix_timestamp(datetime.utcnow()),
                 task_id=self.task_id,
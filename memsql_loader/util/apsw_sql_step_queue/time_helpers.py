@@ -1,4 +1,15 @@
 import time
+from datetime import datetime
 
 def unix_timestamp(dt):
     return int(time.mktime(dt.timetuple()))
+
+def precise_unix_timestamp(dt):
+    """ Like unix_timestamp, but keeps sub-second precision """
+    return time.mktime(dt.timetuple()) + dt.microsecond / 1000000.0
+
+def from_unix_timestamp(timestamp):
+    """ The inverse of unix_timestamp and precise_unix_timestamp """
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp)
@@ -1,15 +1,50 @@
-from memsql_loader.util import apsw_helpers
+from collections import OrderedDict
+
+# SQL dialects spoken by the storage backends (see APSWStorage.dialect and
+# MySQLStorage.dialect).
+SQLITE = 'sqlite'
+MYSQL = 'mysql'
+
+def for_dialect(statement, dialect):
+    """ Statements are either plain SQL that works on every backend, or a
+    dict of dialect -> SQL.  Returns None if the statement doesn't apply to
+    the dialect. """
+    if isinstance(statement, dict):
+        return statement.get(dialect)
+    return statement
 
 class TableDefinition(object):
-    def __init__(self, table_name, sql, index_columns=None):
+    def __init__(self, table_name, sql, index_columns=None, extra_sql=None):
+        """ extra_sql is a list of statements (triggers, partial indexes,
+        etc.) to run after the table and its indexes have been created.
+
+        sql and each of the extra_sql statements can be a dict of dialect ->
+        SQL (see for_dialect) where the backends need different SQL. """
         self.table_name = table_name
         self.sql = sql
         self.index_columns = index_columns or []
+        self.extra_sql = extra_sql or []
+
+    def extra_statements(self, dialect=SQLITE):
+        statements = [ for_dialect(statement, dialect) for statement in self.extra_sql ]
+        return [ statement for statement in statements if statement is not None ]
+
+    def create(self, cursor, dialect=SQLITE):
+        cursor.execute(for_dialect(self.sql, dialect))
+        for index_column in self.index_columns:
+            index_name = self.table_name + '_' + index_column + '_idx'
+            cursor.execute(
+                'CREATE INDEX IF NOT EXISTS %s ON %s (%s)' %
+                (index_name, self.table_name, index_column))
+        for statement in self.extra_statements(dialect):
+            cursor.execute(statement)
 
 class APSWSQLUtility(object):
     def __init__(self, storage):
         self.storage = storage
-        self._tables = {}
+        # Tables are created in the order they were defined, so that later
+        # definitions can refer to earlier ones.
+        self._tables = OrderedDict()
 
     ###############################
     # Public Interface
@@ -18,20 +53,12 @@ class APSWSQLUtility(object):
         """ Initialize the required tables in the database """
         with self.storage.transaction() as cursor:
             for table_defn in self._tables.values():
-                cursor.execute(table_defn.sql)
-                for index_column in table_defn.index_columns:
-                    index_name = table_defn.table_name + '_' + index_column + '_idx'
-                    cursor.execute(
-                        'CREATE INDEX %s ON %s (%s)' %
-                        (index_name, table_defn.table_name, index_column))
+                table_defn.create(cursor, self.storage.dialect)
         return self
 
     def ready(self):
         """ Returns True if the tables have been setup, False otherwise """
-        with self.storage.cursor() as cursor:
-            rows = apsw_helpers.query(
-                cursor, 'SELECT name FROM sqlite_master WHERE type = "table"')
-        tables = [row.name for row in rows]
+        tables = self.storage.table_names()
         return all([table_name in tables for table_name in self._tables])
 
     ###############################
@@ -1,7 +1,28 @@
 import apsw
 import contextlib
 import multiprocessing
+import os
 import threading
+import time
+import weakref
+
+from memsql_loader.util import log
+from memsql_loader.util.apsw_sql_utility import SQLITE
+
+# TRUNCATE checkpoints were added in SQLite 3.8.8; older builds get RESTART,
+# which does the same work without shrinking the WAL file.
+CHECKPOINT_PASSIVE = apsw.SQLITE_CHECKPOINT_PASSIVE
+CHECKPOINT_TRUNCATE = getattr(apsw, 'SQLITE_CHECKPOINT_TRUNCATE', apsw.SQLITE_CHECKPOINT_RESTART)
+
+# Connections no longer checkpoint after every transaction; a WALCheckpointer
+# is expected to do it in the background.  SQLite's own auto-checkpoint is
+# kept as a safety net for processes that don't run one, with a threshold
+# high enough that it won't fire while a checkpointer is keeping up.
+WAL_AUTOCHECKPOINT_PAGES = 10000
+
+# Values of PRAGMA synchronous
+SYNCHRONOUS_OFF = 0
+SYNCHRONOUS_NORMAL = 1
 
 class APSWStorageInitFailure(Exception):
     pass
@@ -19,7 +40,8 @@ class APSWStorage(object):
             storage = BarStorage('bar.db')
 
             # transactions can be nested
-            # note that cursor() returns a different connection from the transaction
+            # note that cursor() returns a different connection from the transaction,
+            # and that each thread gets its own cursor() connection
             with storage.transaction() as cursor:
                 cursor.execute("insert into bar values (1)")
 
@@ -37,25 +59,42 @@ class APSWStorage(object):
                 assert storage.transaction_changes() == 0, "no changes made by transaction"
 
     """
-    _db = None
     _db_t = None
+    _db_c = None
     _write_lock = None
-    _read_lock = None
+    _checkpoint_lock = None
+    _generation = 0
 
-    def __init__(self, path):
+    dialect = SQLITE
+
+    def __init__(self, path, synchronous=SYNCHRONOUS_NORMAL):
+        """ synchronous=SYNCHRONOUS_OFF skips fsync entirely, which is
+        only safe for databases that don't need to survive a crash, e.g.
+        ones on tmpfs that are kept with snapshot(). """
+        self.synchronous = synchronous
         self._write_lock = multiprocessing.RLock()
+        self._checkpoint_lock = threading.Lock()
+        self._readers_lock = threading.Lock()
+        self._readers = weakref.WeakSet()
+        self._local = threading.local()
         self.path = path
         self.setup_connections()
 
     def setup_connections(self):
         """ Setup a sqlite3 database at the provided path. """
-        # _db_t is for transactions, _db is for all other cursors
-        self._db = apsw.Connection(self.path)
+        # _db_t is for transactions and _db_c is only used for checkpointing
+        # the WAL.  All other cursors use per-thread read connections, which
+        # are opened on demand (see _read_connection).
         self._db_t = apsw.Connection(self.path)
-        self._db.setbusytimeout(60000)
         self._db_t.setbusytimeout(60000)
+        # Makes every thread open a new read connection, since any it had
+        # was closed along with the rest in close_connections.
+        self._generation += 1
 
-        self._read_lock = threading.RLock()
+        with self._checkpoint_lock:
+            self._db_c = apsw.Connection(self.path)
+            # Checkpoints are opportunistic, so don't wait long on readers
+            self._db_c.setbusytimeout(1000)
 
         def pragma(cursor, name, value, check_val):
             cursor.execute("pragma %s=%s" % (name, value))
@@ -64,11 +103,12 @@ class APSWStorage(object):
                 raise APSWStorageInitFailure("Failed to set %s to %s (%s != %s)" % (name, value, server_val, check_val))
 
         with self._write_lock:
-            for db in [self._db, self._db_t]:
+            for db in [self._db_t, self._db_c]:
                 cursor = db.cursor()
                 pragma(cursor, "journal_mode", "WAL", "wal")
-                pragma(cursor, "synchronous", "NORMAL", 1)
+                pragma(cursor, "synchronous", self.synchronous, self.synchronous)
                 pragma(cursor, "foreign_keys", "ON", 1)
+                pragma(cursor, "wal_autocheckpoint", WAL_AUTOCHECKPOINT_PAGES, WAL_AUTOCHECKPOINT_PAGES)
 
     @contextlib.contextmanager
     def transaction(self):
@@ -80,26 +120,283 @@ class APSWStorage(object):
         with self._write_lock:
             with self._db_t:
                 yield self._db_t.cursor()
-            try:
-                self._db_t.wal_checkpoint()
-            except (apsw.BusyError, apsw.LockedError):
-                pass
-        with self._read_lock:
-            try:
-                self._db.wal_checkpoint()
-            except (apsw.BusyError, apsw.LockedError):
-                pass
 
     @contextlib.contextmanager
     def cursor(self):
-        with self._read_lock:
-            yield self._db.cursor()
+        """ Return a cursor on this thread's read connection.
+
+        Reads take no locks: in WAL mode every statement reads a snapshot of
+        the last committed state, so readers neither wait for writers nor
+        for each other.
+        """
+        yield self._read_connection().cursor()
 
     def transaction_changes(self):
         return self._db_t.changes()
 
+    def connected(self):
+        return self._db_t is not None
+
+    def table_names(self):
+        """ Returns the names of all tables and views in the database. """
+        with self.cursor() as cursor:
+            return set(row[0] for row in cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type IN ('table', 'view')"))
+
+    def get_schema_version(self, cursor):
+        """ Returns the schema version recorded in the database file. """
+        return cursor.execute("pragma user_version").fetchone()[0]
+
+    def set_schema_version(self, cursor, version):
+        cursor.execute("pragma user_version=%d" % version)
+
+    def checkpoint(self, mode=CHECKPOINT_PASSIVE):
+        """ Checkpoint the WAL back into the database file.
+
+        PASSIVE checkpoints never block writers.  Any other mode takes the
+        write lock so that the WAL can be reset without racing our own
+        writers.
+
+        Returns a (wal_frames, checkpointed_frames) tuple, or None if the
+        checkpoint could not run.
+        """
+        with self._checkpoint_lock:
+            if self._db_c is None:
+                return None
+            try:
+                if mode == CHECKPOINT_PASSIVE:
+                    return self._db_c.wal_checkpoint(mode=mode)
+                with self._write_lock:
+                    return self._db_c.wal_checkpoint(mode=mode)
+            except (apsw.BusyError, apsw.LockedError):
+                return None
+
+    def snapshot(self, path):
+        """ Copy the database to path with the SQLite backup API.
+
+        The copy is taken in a single read transaction, so it is consistent
+        and neither waits for nor blocks writers.  It is written next to
+        path and renamed over it, and uses a rollback journal so that path
+        is always one complete, self-contained file.
+        """
+        tmp_path = path + '.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        db = apsw.Connection(tmp_path)
+        try:
+            with db.backup('main', self._read_connection(), 'main') as backup:
+                backup.step()
+            db.cursor().execute('pragma journal_mode=DELETE').fetchall()
+        finally:
+            db.close(True)
+        os.rename(tmp_path, path)
+
+    def wal_size(self):
+        """ Returns the size of the WAL file in bytes. """
+        try:
+            return os.path.getsize(self.path + '-wal')
+        except OSError:
+            return 0
+
     def close_connections(self):
-        self._db.close(True)
+        with self._readers_lock:
+            readers = list(self._readers)
+            self._readers.clear()
+        for db in readers:
+            db.close(True)
         self._db_t.close(True)
-        self._db = None
+        with self._checkpoint_lock:
+            self._db_c.close(True)
+            self._db_c = None
         self._db_t = None
+
+    def _read_connection(self):
+        """ Returns the calling thread's read connection, opening it if
+        this thread doesn't have one yet.  A thread's connection is closed
+        when the thread exits. """
+        local = self._local
+        if getattr(local, 'generation', None) != self._generation:
+            # The database is already in WAL mode, and read connections
+            # never write, so they only need a busy timeout.
+            db = apsw.Connection(self.path)
+            db.setbusytimeout(60000)
+            with self._readers_lock:
+                self._readers.add(db)
+            local.db = db
+            local.generation = self._generation
+        return local.db
+
+def restore_snapshot(snapshot_path, path):
+    """ Copy a database written by APSWStorage.snapshot to path, which must
+    not be open. """
+    db = apsw.Connection(path)
+    try:
+        source = apsw.Connection(snapshot_path, flags=apsw.SQLITE_OPEN_READONLY)
+        try:
+            with db.backup('main', source, 'main') as backup:
+                backup.step()
+        finally:
+            source.close(True)
+    finally:
+        db.close(True)
+
+class WALCheckpointer(threading.Thread):
+    """ Checkpoints the WAL of an APSWStorage in the background.
+
+    A PASSIVE checkpoint runs whenever the WAL grows past max_wal_bytes, or
+    when interval seconds have passed since the last one and there is
+    anything in the WAL.  If a PASSIVE checkpoint copies everything back
+    while the WAL is over max_wal_bytes, it is followed by a TRUNCATE so the
+    file doesn't stay at its high-water mark.
+
+    Usage ::
+
+        checkpointer = WALCheckpointer(storage)
+        checkpointer.start()
+        ...
+        checkpointer.stop()
+    """
+
+    def __init__(self, storage, interval=30, max_wal_bytes=4 * 1024 * 1024, poll_interval=1):
+        super(WALCheckpointer, self).__init__(name='wal-checkpointer')
+        self.daemon = True
+        self.storage = storage
+        self.interval = interval
+        self.max_wal_bytes = max_wal_bytes
+        self.poll_interval = poll_interval
+
+        self._stop_evt = threading.Event()
+        self._last_checkpoint = time.time()
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            'wal_size': 0,
+            'checkpoints': 0,
+            'busy_checkpoints': 0,
+            'last_checkpoint_mode': None,
+            'last_checkpoint_latency': None,
+            'max_checkpoint_latency': 0
+        }
+
+    def run(self):
+        while not self._stop_evt.wait(self.poll_interval):
+            self.poll()
+
+    def stop(self):
+        """ Stop the thread and leave the WAL fully checkpointed. """
+        self._stop_evt.set()
+        if self.is_alive():
+            self.join()
+        self.checkpoint(CHECKPOINT_TRUNCATE)
+
+    def poll(self):
+        wal_size = self.storage.wal_size()
+        self._update_metrics(wal_size=wal_size)
+
+        elapsed = time.time() - self._last_checkpoint
+        if wal_size == 0 or (wal_size < self.max_wal_bytes and elapsed < self.interval):
+            return
+
+        result = self.checkpoint(CHECKPOINT_PASSIVE)
+        if result is not None and wal_size >= self.max_wal_bytes:
+            wal_frames, checkpointed_frames = result
+            if wal_frames == checkpointed_frames:
+                self.checkpoint(CHECKPOINT_TRUNCATE)
+
+    def checkpoint(self, mode):
+        start = time.time()
+        result = self.storage.checkpoint(mode)
+        now = time.time()
+        self._last_checkpoint = now
+
+        if result is None:
+            with self._metrics_lock:
+                self._metrics['busy_checkpoints'] += 1
+        else:
+            latency = now - start
+            with self._metrics_lock:
+                self._metrics['checkpoints'] += 1
+                self._metrics['last_checkpoint_mode'] = 'PASSIVE' if mode == CHECKPOINT_PASSIVE else 'TRUNCATE'
+                self._metrics['last_checkpoint_latency'] = latency
+                self._metrics['max_checkpoint_latency'] = max(latency, self._metrics['max_checkpoint_latency'])
+                self._metrics['wal_size'] = self.storage.wal_size()
+        return result
+
+    def get_metrics(self):
+        with self._metrics_lock:
+            return dict(self._metrics)
+
+    def _update_metrics(self, **kwargs):
+        with self._metrics_lock:
+            self._metrics.update(kwargs)
+
+class Snapshotter(threading.Thread):
+    """ Snapshots APSWStorages to files in the background.
+
+    Every interval seconds, and once more when stopped, each storage is
+    snapshotted (see APSWStorage.snapshot) in the order they were given.
+
+    Usage ::
+
+        snapshotter = Snapshotter([ (storage, 'snapshot.db') ], interval=60)
+        snapshotter.start()
+        ...
+        snapshotter.stop()
+    """
+
+    def __init__(self, targets, interval=60):
+        """
+        targets     a list of (storage, snapshot path) tuples
+        interval    seconds between snapshots
+        """
+        super(Snapshotter, self).__init__(name='snapshotter')
+        self.daemon = True
+        self.targets = targets
+        self.interval = interval
+        self.logger = log.get_logger('Snapshotter')
+
+        self._stop_evt = threading.Event()
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            'snapshots': 0,
+            'failed_snapshots': 0,
+            'last_snapshot': None,
+            'last_snapshot_latency': None
+        }
+
+    def run(self):
+        while not self._stop_evt.wait(self.interval):
+            self.snapshot()
+
+    def stop(self):
+        """ Stop the thread and take a final snapshot.  Returns False if
+        the final snapshot failed (see snapshot). """
+        self._stop_evt.set()
+        if self.is_alive():
+            self.join()
+        return self.snapshot()
+
+    def snapshot(self):
+        """ Snapshot every storage.  Returns False if any of them failed;
+        the previous snapshot of a storage that failed is left in place. """
+        start = time.time()
+        ok = True
+        for storage, path in self.targets:
+            try:
+                storage.snapshot(path)
+            except (apsw.Error, OSError) as e:
+                self.logger.warning('Failed to snapshot %s to %s: %s', storage.path, path, e)
+                ok = False
+        now = time.time()
+
+        with self._metrics_lock:
+            if ok:
+                self._metrics['snapshots'] += 1
+                self._metrics['last_snapshot'] = now
+                self._metrics['last_snapshot_latency'] = now - start
+            else:
+                self._metrics['failed_snapshots'] += 1
+        return ok
+
+    def get_metrics(self):
+        with self._metrics_lock:
+            return dict(self._metrics)
@@ -1,16 +1,20 @@
-from memsql_loader.loader_db import jobs, tasks
-from memsql_loader.loader_db import storage
-from memsql_loader.util import apsw_helpers, log
+from collections import OrderedDict
 
-MODELS = { 'jobs': jobs.Jobs, 'tasks': tasks.Tasks }
+from memsql_loader.loader_db import jobs, manifests, shards, tasks, watches
+from memsql_loader.loader_db import storage, migrations
+from memsql_loader.util import log
+
+# Tasks sets up every shard listed in task_shards, so that comes first.
+MODELS = OrderedDict([
+    ('task_shards', shards.TaskShards), ('jobs', jobs.Jobs), ('tasks', tasks.Tasks), ('manifests', manifests.Manifests),
+    ('job_watches', watches.Watches) ])
 
 def check_bootstrapped():
     loader_storage = storage.LoaderStorage()
-    with loader_storage.cursor() as cursor:
-        rows = apsw_helpers.query(
-            cursor, 'SELECT name FROM sqlite_master WHERE type = "table"')
-    tables = [row.name for row in rows]
-    return all([model in tables for model in MODELS.keys()])
+    tables = loader_storage.table_names()
+    if not all([model in tables for model in MODELS.keys()]):
+        return False
+    return not migrations.needs_migration(loader_storage)
 
 def bootstrap(force=False):
     logger = log.get_logger('Bootstrap')  # noqa
@@ -26,9 +30,23 @@ def bootstrap(force=False):
         storage.LoaderStorage.drop_database()
     write_log('Database', storage.MEMSQL_LOADER_DB, 'Ready.')
 
+    loader_storage = storage.LoaderStorage()
+    new_database = not any(name in MODELS for name in loader_storage.table_names())
+
+    # Existing databases are migrated before any missing tables are
+    # created, so that migrations see the schema they were written for.
+    if not new_database and migrations.needs_migration(loader_storage):
+        write_log('Database', storage.MEMSQL_LOADER_DB, 'Migrating...')
+        migrations.migrate(loader_storage)
+        write_log('Database', storage.MEMSQL_LOADER_DB, 'Migrated.')
+
     for Model in MODELS.values():
         instance = Model()
         if not instance.ready():
             write_log('Table', Model.__name__, 'Bootstrapping...')
             instance.setup()
         write_log('Table', Model.__name__, 'Ready.')
+
+    if new_database:
+        # A brand new database already has the latest schema
+        migrations.mark_current(loader_storage)
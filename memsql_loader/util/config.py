@@ -3,6 +3,7 @@ from collections import OrderedDict
 import sys
 from memsql_loader import __version__
 from memsql_loader.util import log
+from memsql_loader.loader_db import storage
 
 from memsql_loader.cli import server, jobs, job, tasks, task, cancel_task, cancel_job, ps, load, status, stop_server, clear_loader_db
 from memsql_loader.cli import log as log_cmd
@@ -33,6 +34,7 @@ def make_parser():
         version='memsql-loader ' + __version__)
 
     log.configure(parser)
+    storage.configure(parser)
 
     subparsers = parser.add_subparsers(parser_class=argparse.ArgumentParser)
     [command.configure(parser, subparsers) for command in COMMANDS.values()]
@@ -42,7 +44,13 @@ def make_parser():
 def load_options(args=None):
     parser = make_parser()
     args = sys.argv[1:] if args is None else args
-    if len(set(args) & set(COMMANDS.keys())) > 0:
-        return parser.parse_args(args)
-    else:
+    if len(set(args) & set(COMMANDS.keys())) == 0:
         return parser.parse_args(args + [ '--help' ])
+
+    options = parser.parse_args(args)
+    try:
+        # A running server's mode overrides the default
+        options.loader_db_mode = storage.get_loader_db_mode()
+    except storage.LoaderDbModeMismatch as e:
+        parser.error(str(e))
+    return options
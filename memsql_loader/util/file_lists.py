@@ -0,0 +1,149 @@
+""" File lists, which name the files of a job directly (see the
+source.manifest job option) instead of matching them with patterns.
+
+A file list is a local file or an S3 key in one of these formats:
+
+- lines: one path per line.
+- jsonl: one JSON object per line, with a "path" and optionally a "size"
+  (in bytes) and an "etag".
+- csv: rows of path, size and etag; size and etag may be left out or
+  empty.  A first row that starts with "path" is a header, and names the
+  columns.
+
+Blank lines and lines starting with '#' are skipped in every format.  Paths
+are written like the paths of a job, e.g. s3://bucket/key, hdfs://path or
+/local/path, but are never treated as patterns.
+
+File lists are read as a stream, so they can name any number of files.
+"""
+
+import csv
+import os
+from collections import namedtuple
+
+from memsql_loader.util import super_json as json
+
+LINES = 'lines'
+JSONL = 'jsonl'
+CSV = 'csv'
+FORMATS = [ LINES, JSONL, CSV ]
+
+_EXTENSION_FORMATS = {
+    '.jsonl': JSONL,
+    '.json': JSONL,
+    '.ndjson': JSONL,
+    '.csv': CSV
+}
+
+# S3 file lists are read this many bytes at a time
+READ_SIZE = 1024 * 1024
+
+# One file named by a file list; size and etag are None if it doesn't say.
+FileListEntry = namedtuple('FileListEntry', ['scheme', 'bucket', 'name', 'size', 'etag'])
+
+class InvalidFileList(Exception):
+    pass
+
+def detect_format(path):
+    """ The format of the file list at path, by its extension. """
+    return _EXTENSION_FORMATS.get(os.path.splitext(path)[1].lower(), LINES)
+
+def parse_path(path):
+    """ Returns the (scheme, bucket, name) of path, a path in a file list,
+    the way schema.LoadPath splits the paths of a job. """
+    # Not urlparse, which would take a '#' or '?' in a key or file name for
+    # a fragment or a query; the names in a file list are never patterns,
+    # so they are used as they are written.
+    scheme, sep, rest = path.partition('://')
+    if not sep or not scheme.isalnum():
+        scheme, rest = 'file', path
+    scheme = scheme.lower()
+    if scheme == 's3':
+        bucket, _, name = rest.partition('/')
+        return 's3', bucket, name
+    elif scheme == 'hdfs':
+        return 'hdfs', None, rest.lstrip('/')
+    elif scheme == 'file':
+        return 'file', None, rest
+    raise InvalidFileList('Unknown file scheme %s in %s' % (scheme, path))
+
+def iter_lines(load_path, s3_conn=None):
+    """ Yields the lines of the file list at load_path (a schema.LoadPath),
+    without their line endings. """
+    if load_path.scheme == 's3':
+        key = s3_conn.get_bucket(load_path.bucket, validate=False).get_key(load_path.pattern)
+        if key is None:
+            raise InvalidFileList('Manifest %s does not exist' % load_path)
+        rest = ''
+        while True:
+            chunk = key.read(READ_SIZE)
+            if not chunk:
+                break
+            lines = (rest + chunk).split('\n')
+            rest = lines.pop()
+            for line in lines:
+                yield line.rstrip('\r')
+        key.close()
+        if rest:
+            yield rest.rstrip('\r')
+    elif load_path.scheme == 'file':
+        with open(load_path.pattern, 'rb') as f:
+            for line in f:
+                yield line.rstrip('\r\n')
+    else:
+        raise InvalidFileList('Manifests can not be read from %s' % load_path.scheme)
+
+def iter_entries(lines, file_list_format):
+    """ Yields a FileListEntry for each file that lines, the lines of a
+    file list in file_list_format, name. """
+    parse = {
+        LINES: _parse_lines,
+        JSONL: _parse_jsonl,
+        CSV: _parse_csv
+    }[file_list_format]
+
+    lines = ((number, line) for number, line in enumerate(lines, 1) if line.strip() and not line.startswith('#'))
+    for number, path, size, etag in parse(lines):
+        if not path:
+            raise InvalidFileList('Line %d of the manifest names no path' % number)
+        try:
+            size = int(size) if size not in (None, '') else None
+        except ValueError:
+            raise InvalidFileList('Line %d of the manifest has an invalid size: %s' % (number, size))
+        scheme, bucket, name = parse_path(path)
+        yield FileListEntry(scheme, bucket, name, size, etag or None)
+
+def _parse_lines(lines):
+    for number, line in lines:
+        yield number, line.strip().decode('utf-8'), None, None
+
+def _parse_jsonl(lines):
+    for number, line in lines:
+        try:
+            entry = json.loads(line)
+        except ValueError as e:
+            raise InvalidFileList('Line %d of the manifest is not valid JSON: %s' % (number, e))
+        if not isinstance(entry, dict):
+            raise InvalidFileList('Line %d of the manifest is not a JSON object' % number)
+        yield number, entry.get('path'), entry.get('size'), entry.get('etag')
+
+def _parse_csv(lines):
+    columns = [ 'path', 'size', 'etag' ]
+    first = True
+    # csv.reader only sees the lines, so it tracks none of their numbers
+    numbers = []
+    def numbered():
+        for number, line in lines:
+            numbers.append(number)
+            yield line
+
+    for row in csv.reader(numbered()):
+        number = numbers.pop()
+        del numbers[:]
+        if first:
+            first = False
+            if row and row[0].strip() == 'path':
+                columns = [ column.strip() for column in row ]
+                continue
+        values = dict(zip(columns, [ value.decode('utf-8') for value in row ]))
+        yield number, values.get('path'), values.get('size'), values.get('etag')
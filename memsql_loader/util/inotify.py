@@ -0,0 +1,116 @@
+""" A minimal binding to Linux's inotify(7) API, through ctypes.
+
+    Usage ::
+
+        inotify = Inotify()
+        inotify.add_watch('/data/incoming', IN_CLOSE_WRITE | IN_MOVED_TO)
+        for event in inotify.read_events(timeout=1):
+            print event.wd, event.name
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+from collections import namedtuple
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# struct inotify_event, without the name that follows it
+_EVENT_HEADER = struct.Struct('iIII')
+_READ_SIZE = 64 * 1024
+
+# One inotify event; name is empty for events on the watched directory
+# itself, and wd is -1 for IN_Q_OVERFLOW.
+Event = namedtuple('Event', ['wd', 'mask', 'cookie', 'name'])
+
+class InotifyError(OSError):
+    pass
+
+_libc = None
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    return _libc
+
+def is_supported():
+    if not sys.platform.startswith('linux'):
+        return False
+    try:
+        return hasattr(_get_libc(), 'inotify_init1')
+    except OSError:
+        return False
+
+def _check(result, what):
+    if result < 0:
+        err = ctypes.get_errno()
+        raise InotifyError(err, '%s failed: %s' % (what, os.strerror(err)))
+    return result
+
+class Inotify(object):
+    def __init__(self):
+        self._libc = _get_libc()
+        self.fd = _check(self._libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK), 'inotify_init1')
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path, mask):
+        """ Watches path for the events in mask.  Returns the watch
+        descriptor, which is the same for every watch on the same path. """
+        return _check(self._libc.inotify_add_watch(self.fd, ctypes.c_char_p(path), ctypes.c_uint32(mask)),
+            'inotify_add_watch(%s)' % path)
+
+    def rm_watch(self, wd):
+        # The watch is gone already if its directory was deleted
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self, timeout=None):
+        """ Returns the events that are queued, after waiting up to timeout
+        seconds for the first of them. """
+        try:
+            readable, _, _ = select.select([ self.fd ], [], [], timeout)
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                return []
+            raise
+        if not readable:
+            return []
+
+        try:
+            data = os.read(self.fd, _READ_SIZE)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return []
+            raise
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip('\0')
+            offset += length
+            events.append(Event(wd, mask, cookie, name))
+        return events
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
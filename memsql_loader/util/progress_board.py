@@ -0,0 +1,152 @@
+""" A fixed-size, mmap-backed table of live task progress.
+
+Every worker owns one slot in the board and overwrites it a couple of times
+per second with the progress of the task it is running.  Readers (ps, the
+API) map the same file and read the slots directly, so live progress never
+has to go through the loader database.
+
+Each slot is guarded by a sequence number (a seqlock): writers bump it to an
+odd value before writing and to the next even value afterwards, and readers
+retry until they see the same even value on both sides of their read.
+"""
+
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+from memsql_loader.util import paths
+from memsql_loader.util.attr_dict import AttrDict
+
+PROGRESS_BOARD_FILE = 'memsql_loader.progress'
+
+# Slots that haven't been written for this many seconds belong to workers
+# that have died, so readers ignore them.
+STALE_AFTER = 10
+
+_MAGIC = 'MLPB'
+_HEADER = struct.Struct('=4sI')
+_SEQ = struct.Struct('=Q')
+# task_id, bytes_downloaded, download_rate, checkpointed_bytes,
+# checkpointed_rate, time_left, updated, job_id
+_BODY = struct.Struct('=qqqqqdd32s')
+_SLOT_SIZE = _SEQ.size + _BODY.size
+_READ_RETRIES = 100
+
+def get_progress_board_path():
+    return os.path.join(paths.get_data_dir(), PROGRESS_BOARD_FILE)
+
+class ProgressBoardException(Exception):
+    pass
+
+class ProgressBoard(object):
+    def __init__(self, path, writable=False):
+        self.path = path
+        with open(path, 'r+b' if writable else 'rb') as f:
+            access = mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ
+            try:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=access)
+            except (ValueError, mmap.error) as e:
+                raise ProgressBoardException('Failed to map progress board %s: %s' % (path, e))
+
+        if len(self._mmap) < _HEADER.size:
+            raise ProgressBoardException('Progress board %s is truncated' % path)
+        magic, self.num_slots = _HEADER.unpack_from(self._mmap, 0)
+        if magic != _MAGIC or len(self._mmap) < _HEADER.size + self.num_slots * _SLOT_SIZE:
+            raise ProgressBoardException('Progress board %s is invalid' % path)
+
+    @classmethod
+    def create(cls, path, num_slots):
+        """ Create an empty board with num_slots slots, replacing any
+        existing one.  Workers from an earlier server keep writing to the
+        old file until they exit. """
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_HEADER.pack(_MAGIC, num_slots))
+                f.write('\0' * (num_slots * _SLOT_SIZE))
+            os.rename(tmp_path, path)
+        except:
+            os.remove(tmp_path)
+            raise
+        return cls(path, writable=True)
+
+    def update(self, slot, task_id, job_id, bytes_downloaded, download_rate,
+               time_left, checkpointed_bytes=0, checkpointed_rate=0):
+        """ Publish the live progress of a task.
+
+        checkpointed_bytes and checkpointed_rate are the values last saved
+        to the loader database for this task, which lets readers that
+        aggregate database values correct them with the live ones.
+        """
+        self._write(slot, _BODY.pack(
+            task_id, bytes_downloaded or 0, download_rate or 0,
+            checkpointed_bytes or 0, checkpointed_rate or 0,
+            time_left, time.time(), str(job_id or '')))
+
+    def clear(self, slot):
+        self._write(slot, '\0' * _BODY.size)
+
+    def read(self):
+        """ Returns a dict of task id -> live progress for every task that
+        is currently being worked on. """
+        now = time.time()
+        ret = {}
+        for slot in xrange(self.num_slots):
+            body = self._read(slot)
+            if body is None:
+                continue
+            task_id, bytes_downloaded, download_rate, checkpointed_bytes, checkpointed_rate, time_left, updated, job_id = body
+            if task_id == 0 or updated < now - STALE_AFTER:
+                continue
+            ret[task_id] = AttrDict({
+                'task_id': task_id,
+                'job_id': job_id.rstrip('\0'),
+                'bytes_downloaded': bytes_downloaded,
+                'download_rate': download_rate,
+                'time_left': time_left,
+                'checkpointed_bytes': checkpointed_bytes,
+                'checkpointed_rate': checkpointed_rate,
+                'updated': updated
+            })
+        return ret
+
+    def close(self):
+        self._mmap.close()
+
+    def _slot_offset(self, slot):
+        assert 0 <= slot < self.num_slots, 'Invalid progress board slot %d' % slot
+        return _HEADER.size + slot * _SLOT_SIZE
+
+    def _write(self, slot, body):
+        offset = self._slot_offset(slot)
+        seq = _SEQ.unpack_from(self._mmap, offset)[0]
+        # Each slot has a single writer, so the sequence number can't change
+        # under us.
+        _SEQ.pack_into(self._mmap, offset, seq + 1)
+        self._mmap[offset + _SEQ.size:offset + _SLOT_SIZE] = body
+        _SEQ.pack_into(self._mmap, offset, seq + 2)
+
+    def _read(self, slot):
+        offset = self._slot_offset(slot)
+        for _ in xrange(_READ_RETRIES):
+            seq = _SEQ.unpack_from(self._mmap, offset)[0]
+            if seq % 2 == 1:
+                continue
+            body = _BODY.unpack_from(self._mmap, offset + _SEQ.size)
+            if _SEQ.unpack_from(self._mmap, offset)[0] == seq:
+                return body
+        return None
+
+def read_live_progress():
+    """ Returns the live progress of all running tasks, or an empty dict if
+    no server has published a progress board. """
+    try:
+        board = ProgressBoard(get_progress_board_path())
+    except (IOError, OSError, ProgressBoardException):
+        return {}
+    try:
+        return board.read()
+    finally:
+        board.close()
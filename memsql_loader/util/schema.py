@@ -1,10 +1,11 @@
+import copy
 import os
 import shlex
 import urlparse
 import voluptuous as V
 
 from memsql_loader.util.attr_dict import AttrDict
-from memsql_loader.util import log
+from memsql_loader.util import file_lists, log
 from memsql_loader.vendor import glob2
 
 class InvalidKeyException(Exception):
@@ -50,7 +51,21 @@ class LoadPath(object):
 DEFAULT_AWS_ACCESS_KEY = None
 DEFAULT_AWS_SECRET_KEY = None
 
+_spec_validator = None
+_spec_validator_aws_defaults = None
+
 def get_spec_validator():
+    """ Returns the spec validator.  Building it is expensive, so it is
+    built once and only rebuilt if DEFAULT_AWS_ACCESS_KEY or
+    DEFAULT_AWS_SECRET_KEY have changed since. """
+    global _spec_validator, _spec_validator_aws_defaults
+    aws_defaults = (DEFAULT_AWS_ACCESS_KEY, DEFAULT_AWS_SECRET_KEY)
+    if _spec_validator is None or aws_defaults != _spec_validator_aws_defaults:
+        _spec_validator = _build_spec_validator()
+        _spec_validator_aws_defaults = aws_defaults
+    return _spec_validator
+
+def _build_spec_validator():
     _options_fields_schema = V.Schema({
         V.Required("terminated", default='\t'): basestring,
         V.Required("enclosed", default=""): basestring,
@@ -82,6 +97,8 @@ def get_spec_validator():
 
     # Each path in paths looks something like:
     #   [s3://|file://|hdfs://][bucket/]file/pattern
+    # and manifest names a file listing more files to load, see
+    # util/file_lists.py.
     SPEC_VALIDATOR = V.Schema({
         V.Required("source"): V.Schema({
             V.Required("aws_access_key", default=DEFAULT_AWS_ACCESS_KEY): V.Any(basestring, None),
@@ -89,7 +106,14 @@ def get_spec_validator():
             V.Required("hdfs_host", default=None): V.Any(basestring, None),
             V.Required("webhdfs_port", default=50070): V.Any(int, None),
             V.Required("hdfs_user", default=None): V.Any(basestring, None),
-            V.Required("paths"): [basestring],
+            V.Required("hdfs_checksums", default=True): bool,
+            V.Required("paths", default=[]): [basestring],
+            V.Required("manifest", default=None): V.Any(basestring, None),
+            V.Required("manifest_format", default=None): V.Any(None, *file_lists.FORMATS),
+            V.Required("incremental", default=None): V.Any(None, "changed", "sorted"),
+            V.Required("watch", default=False): bool,
+            V.Required("watch_interval", default=60): V.All(int, V.Range(min=1)),
+            V.Required("watch_max_interval", default=600): V.All(int, V.Range(min=1)),
         }),
         V.Required("connection", default=_db_schema({})): _db_schema,
         V.Required("target"): V.Schema({
@@ -101,6 +125,9 @@ def get_spec_validator():
 
     return SPEC_VALIDATOR
 
+# Build the validator once at import time rather than on first use
+get_spec_validator()
+
 def get_command_line_options(key_list):
     """ This is not the prettiest thing in the world. The idea is to
     match a schema path (like options.fields.terminated) into one of
@@ -186,7 +213,9 @@ def build_spec(base_spec, options):
     return build_spec_recursive(logger, options, base_spec, get_spec_validator(), [])
 
 def validate_spec(spec):
-    spec = AttrDict.from_dict(get_spec_validator()(spec))
+    # The validator is shared, and it fills in missing keys with the very
+    # same default objects every time, so copy them before handing them out.
+    spec = AttrDict.from_dict(copy.deepcopy(get_spec_validator()(spec)))
 
     # post validation steps go here
     assert 'file_id_column' in spec.options
@@ -203,4 +232,20 @@ def validate_spec(spec):
             shlex.split(spec.options.script)
         except ValueError as e:
             raise V.Invalid('options.script is invalid: %s' % str(e), path=[ 'options', 'script' ])
+    if not spec.source.paths and spec.source.manifest is None:
+        raise V.Invalid('source.paths must name at least one path unless source.manifest is given', path=[ 'source', 'paths' ])
+    if spec.source.manifest is not None:
+        try:
+            scheme = file_lists.parse_path(spec.source.manifest)[0]
+        except file_lists.InvalidFileList as e:
+            raise V.Invalid(str(e), path=[ 'source', 'manifest' ])
+        if scheme not in ('s3', 'file'):
+            raise V.Invalid('source.manifest must be a local file or an S3 key', path=[ 'source', 'manifest' ])
+    if spec.source.watch:
+        if spec.source.watch_max_interval < spec.source.watch_interval:
+            raise V.Invalid('source.watch_max_interval can not be less than source.watch_interval',
+                path=[ 'source', 'watch_max_interval' ])
+        # A watch only queues the files that its last scan hasn't seen
+        if spec.source.incremental is None:
+            spec.source.incremental = 'changed'
     return spec
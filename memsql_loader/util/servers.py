@@ -7,6 +7,9 @@ from memsql_loader.util import paths
 def get_pid_file_path():
     return os.path.join(paths.get_data_dir(), "memsql-loader.pid")
 
+def get_mode_file_path():
+    return os.path.join(paths.get_data_dir(), "memsql-loader.mode")
+
 def delete_pid_file():
     try:
         os.remove(get_pid_file_path())
@@ -19,6 +22,33 @@ def write_pid_file():
     with open(get_pid_file_path(), 'w') as f:
         f.write("%s\n" % os.getpid())
 
+def delete_mode_file():
+    try:
+        os.remove(get_mode_file_path())
+    except Exception:
+        pass
+
+def write_mode_file(loader_db_mode):
+    """ Records the loader database mode the server was started in, for
+    the other processes using the data directory to follow. """
+    atexit.register(delete_mode_file)
+
+    with open(get_mode_file_path(), 'w') as f:
+        f.write("%s\n" % loader_db_mode)
+
+def get_server_loader_db_mode():
+    """ The loader database mode of the running server, or None if no
+    server is running. """
+    if not is_server_running():
+        return None
+    try:
+        with open(get_mode_file_path(), 'r') as f:
+            return f.read().strip() or None
+    except IOError as e:
+        if e.errno == errno.ENOENT:
+            return None
+        raise
+
 def get_server_pid():
     try:
         with open(get_pid_file_path(), 'r') as f:
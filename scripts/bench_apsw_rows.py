@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+""" Benchmark for apsw_helpers result sets on a large tasks table.
+
+Builds a throwaway loader-style tasks table with --rows rows, then times
+reading it with iquery (streaming) and query (materialized), and times
+attribute access on the materialized rows.  Peak RSS is reported after each
+phase; iquery runs first because peak RSS never goes down.
+
+    python scripts/bench_apsw_rows.py --rows 1000000
+"""
+import argparse
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT_PATH = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.append(ROOT_PATH)
+
+import apsw
+
+from memsql_loader.util import apsw_helpers
+from memsql_loader.util.apsw_sql_step_queue.queue import primary_table_definition
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def populate(conn, rows):
+    cursor = conn.cursor()
+    primary_table_definition('tasks').create(cursor)
+    with conn:
+        cursor.executemany('''
+            INSERT INTO tasks (created, data, job_id, file_id, md5, bytes_total, bytes_downloaded, started, last_contact, finished, result, steps)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', ((
+            1400000000 + i, '{"key_name": "bucket/file-%d", "scheme": "s3"}' % i,
+            'a' * 32, str(i), '%032x' % i, 1024, 1024,
+            1400000000 + i, 1400000000 + i, 1400000000 + i, 'success', '[]'
+        ) for i in xrange(rows)))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000, help='Number of rows in the tasks table.')
+    options = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix='memsql-loader-bench-')
+    try:
+        conn = apsw.Connection(os.path.join(data_dir, 'bench.db'))
+
+        start = time.time()
+        populate(conn, options.rows)
+        print 'populate: %8d rows in %6.2f sec' % (options.rows, time.time() - start)
+        print 'peak RSS after populate: %8.1f MB' % peak_rss_mb()
+
+        start = time.time()
+        total = 0
+        for row in apsw_helpers.iquery(conn.cursor(), 'SELECT * FROM tasks'):
+            total += row.bytes_downloaded
+        print 'iquery:   %8d rows in %6.2f sec' % (options.rows, time.time() - start)
+        print 'peak RSS after iquery:   %8.1f MB' % peak_rss_mb()
+
+        start = time.time()
+        rows = apsw_helpers.query(conn.cursor(), 'SELECT * FROM tasks')
+        print 'query:    %8d rows in %6.2f sec' % (len(rows), time.time() - start)
+        print 'peak RSS after query:    %8.1f MB' % peak_rss_mb()
+
+        start = time.time()
+        for row in rows:
+            row.id, row.job_id, row.finished, row.bytes_downloaded, row.steps
+        print 'access:   %8d attribute lookups in %6.2f sec' % (len(rows) * 5, time.time() - start)
+
+        conn.close()
+    finally:
+        shutil.rmtree(data_dir)
+
+if __name__ == '__main__':
+    main()
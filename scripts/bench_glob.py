@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+""" Globbing benchmark for the glob2 Globber and S3Globber.
+
+Builds a tree of --dirs directories holding --files-per-dir files each,
+either on the local filesystem (in a throwaway directory, which is kept for
+reuse with --tree) or in a local S3 stand-in (see s3_standin.py), and times
+globbing it with a few patterns.  Matches are found with either iglob
+(the default) or iter_files, which doesn't hold on to listings; compare the
+peak memory reported for each, in separate runs.  --workers lists that many
+directories at a time, as Job.get_files does with --list-concurrency.
+
+The defaults build a tree of 1M files, which is what the local numbers
+should be measured on:
+
+    python scripts/bench_glob.py --dirs 1000 --files-per-dir 1000
+    python scripts/bench_glob.py --tree /tmp/globtree --api iter_files --workers 16
+    python scripts/bench_glob.py --s3 --latency 0.02
+    python scripts/bench_glob.py --s3 --latency 0 --dirs 10000 --api iter_files
+"""
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import time
+
+ROOT_PATH = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.append(ROOT_PATH)
+
+from s3_standin import S3StandIn
+
+PATTERNS = [
+    # Literal prefixes on both wildcard segments
+    'logs/dir-00*/data/part-0001*',
+    # A literal prefix on the last segment only
+    'logs/dir-*/data/part-0001*',
+    # Every file
+    'logs/dir-*/data/*.gz',
+    # Every file, recursively
+    'logs/**/*.gz',
+]
+
+def make_names(options):
+    for d in xrange(options.dirs):
+        for f in xrange(options.files_per_dir):
+            yield 'logs/dir-%04d/data/part-%06d.gz' % (d, f)
+
+def make_tree(options):
+    root = options.tree or tempfile.mkdtemp(prefix='memsql-loader-glob-bench-')
+    marker = os.path.join(root, '.complete-%d-%d' % (options.dirs, options.files_per_dir))
+    if not os.path.exists(marker):
+        print 'building %d files in %s' % (options.dirs * options.files_per_dir, root)
+        for name in make_names(options):
+            path = os.path.join(root, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            open(path, 'w').close()
+        open(marker, 'w').close()
+    return root
+
+def run(make_globber, patterns, api, requests=None):
+    for pattern in patterns:
+        globber = make_globber()
+        if requests is not None:
+            requests.clear()
+        start = time.time()
+        count = sum(1 for _ in getattr(globber, api)(pattern))
+        elapsed = time.time() - start
+        print '%-28s matches: %8d  time: %7.2fs%s' % (
+            pattern, count, elapsed, '  requests: %s' % dict(requests) if requests is not None else '')
+    # ru_maxrss is in kilobytes on Linux
+    print 'peak RSS: %.0f MB' % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dirs', type=int, default=1000, help='Number of directories.')
+    parser.add_argument('--files-per-dir', type=int, default=1000, help='Number of files in each directory.')
+    parser.add_argument('--tree', default=None, help='Directory to build the local tree in, or reuse it from.')
+    parser.add_argument('--s3', action='store_true', help='Glob a local S3 stand-in instead of the local filesystem.')
+    parser.add_argument('--latency', type=float, default=0.02, help='Simulated seconds per S3 request.')
+    parser.add_argument('--patterns', nargs='+', default=PATTERNS, help='Patterns to glob.')
+    parser.add_argument('--api', choices=[ 'iglob', 'iter_files' ], default='iglob', help='Globber method to find matches with.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of directories to list at a time.')
+    options = parser.parse_args()
+
+    from memsql_loader.vendor import glob2
+
+    if options.s3:
+        with S3StandIn(make_names(options), latency=options.latency) as s3:
+            print 'S3 stand-in: %d keys, latency: %.0fms' % (len(s3.keys), options.latency * 1000)
+            bucket = s3.connect().get_bucket(s3.bucket_name, validate=False)
+            run(lambda: glob2.S3Globber(bucket, max_workers=options.workers), options.patterns, options.api, s3.requests)
+    else:
+        root = make_tree(options)
+        os.chdir(root)
+        print 'local tree: %d files in %s' % (options.dirs * options.files_per_dir, root)
+        run(lambda: glob2.Globber(max_workers=options.workers), options.patterns, options.api)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+""" Write-throughput benchmark for the loader database.
+
+Runs against a throwaway data directory, so it never touches
+~/.memsql-loader.  Compare the default mode (background checkpointer) with
+--checkpoint-every-transaction, which mimics the old behaviour of
+checkpointing the WAL after every committed transaction.
+
+    python scripts/bench_loader_db.py --tasks 20000
+    python scripts/bench_loader_db.py --tasks 20000 --checkpoint-every-transaction
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT_PATH = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.append(ROOT_PATH)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tasks', type=int, default=10000, help='Number of tasks to enqueue.')
+    parser.add_argument('--pings', type=int, default=5, help='Number of heartbeats to send per claimed task.')
+    parser.add_argument('--checkpoint-every-transaction', action='store_true', default=False,
+        help='Checkpoint after every write, like the loader used to.')
+    options = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix='memsql-loader-bench-')
+    os.environ['MEMSQL_LOADER_DATA_DIRECTORY'] = data_dir
+
+    # memsql_loader.api imports the loader database models, which import
+    # memsql_loader.api back, so it has to be imported first.
+    import memsql_loader.api.shared  # noqa
+    from memsql_loader.loader_db.storage import LoaderStorage
+    from memsql_loader.loader_db.tasks import Tasks
+    from memsql_loader.util import bootstrap
+    from memsql_loader.util.apsw_storage import WALCheckpointer
+
+    try:
+        bootstrap.bootstrap()
+        storage = LoaderStorage()
+        tasks = Tasks()
+
+        checkpointer = None
+        if options.checkpoint_every_transaction:
+            after_write = storage.checkpoint
+        else:
+            after_write = lambda: None
+            checkpointer = WALCheckpointer(storage)
+            checkpointer.start()
+
+        start = time.time()
+        for i in xrange(options.tasks):
+            tasks.enqueue({ 'key_name': 'file-%d' % i }, job_id='bench', file_id=str(i))
+            after_write()
+        enqueue_time = time.time() - start
+
+        start = time.time()
+        writes = 0
+        while True:
+            task = tasks.start()
+            after_write()
+            if task is None:
+                break
+            for _ in xrange(options.pings):
+                task.ping()
+                after_write()
+            task.finish()
+            after_write()
+            writes += options.pings + 2
+        process_time = time.time() - start
+
+        print 'enqueue:   %8d tasks in %6.2f sec (%8.1f writes/sec)' % (options.tasks, enqueue_time, options.tasks / enqueue_time)
+        print 'heartbeat: %8d writes in %6.2f sec (%8.1f writes/sec)' % (writes, process_time, writes / process_time)
+        print 'WAL size at end: %d bytes' % storage.wal_size()
+
+        if checkpointer is not None:
+            checkpointer.stop()
+            metrics = checkpointer.get_metrics()
+            print 'checkpoints: %d (%d busy), max latency %.4f sec' % (
+                metrics['checkpoints'], metrics['busy_checkpoints'], metrics['max_checkpoint_latency'])
+    finally:
+        shutil.rmtree(data_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+""" Read latency benchmark for the loader database under write load.
+
+Runs against a throwaway data directory, so it never touches
+~/.memsql-loader.  --writers processes claim, ping and finish tasks as fast
+as they can while --readers threads in this process run the Jobs and Tasks
+API queries, and the latency of those reads and the writers' claim rate are
+reported.  Compare with --reads-under-write-lock, which runs the reads
+inside a write transaction like the API used to.
+
+The clock only starts once every writer has connected: a writer connecting
+takes LoaderStorage's instance lock and then the write lock, while a read
+under the write lock takes them the other way around, and both locks are
+shared with the forked writers.
+
+    python scripts/bench_read_latency.py --writers 50
+    python scripts/bench_read_latency.py --writers 50 --reads-under-write-lock
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+ROOT_PATH = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.append(ROOT_PATH)
+
+def write_loop(ready, stop_at, pings, claims):
+    from memsql_loader.loader_db.tasks import Tasks
+
+    tasks = Tasks()
+    with ready.get_lock():
+        ready.value += 1
+    while stop_at.value == 0:
+        time.sleep(0.01)
+    count = 0
+    while time.time() < stop_at.value:
+        task = tasks.start()
+        if task is None:
+            time.sleep(0.01)
+            continue
+        for _ in xrange(pings):
+            task.ping()
+        task.requeue()
+        count += 1
+    with claims.get_lock():
+        claims.value += count
+
+def read_loop(stop_at, under_write_lock, latencies):
+    from memsql_loader.api.jobs import Jobs as JobsApi
+    from memsql_loader.api.tasks import Tasks as TasksApi
+    from memsql_loader.loader_db.storage import LoaderStorage
+
+    storage = LoaderStorage()
+    jobs_api = JobsApi()
+    tasks_api = TasksApi()
+    while time.time() < stop_at:
+        start = time.time()
+        if under_write_lock:
+            with storage.transaction():
+                jobs_api.query({})
+                tasks_api.query({ 'job_id': 'bench', 'page_size': 100 })
+        else:
+            jobs_api.query({})
+            tasks_api.query({ 'job_id': 'bench', 'page_size': 100 })
+        latencies.append(time.time() - start)
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tasks', type=int, default=5000, help='Number of tasks to enqueue.')
+    parser.add_argument('--writers', type=int, default=50, help='Number of writer processes.')
+    parser.add_argument('--readers', type=int, default=4, help='Number of reader threads.')
+    parser.add_argument('--pings', type=int, default=5, help='Number of heartbeats to send per claimed task.')
+    parser.add_argument('--duration', type=float, default=20, help='Seconds to run for.')
+    parser.add_argument('--reads-under-write-lock', action='store_true', default=False,
+        help='Run the reads inside a write transaction, like the API used to.')
+    options = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix='memsql-loader-bench-')
+    os.environ['MEMSQL_LOADER_DATA_DIRECTORY'] = data_dir
+
+    # memsql_loader.api imports the loader database models, which import
+    # memsql_loader.api back, so it has to be imported first.
+    import memsql_loader.api.shared  # noqa
+    from memsql_loader.loader_db.jobs import Jobs, Job
+    from memsql_loader.loader_db.storage import LoaderStorage
+    from memsql_loader.loader_db.tasks import Tasks
+    from memsql_loader.util import bootstrap
+
+    try:
+        bootstrap.bootstrap()
+        job = Job({
+            'source': { 'paths': [ 'file:///tmp/bench/*' ] },
+            'connection': { 'host': '127.0.0.1', 'port': 3306, 'user': 'root', 'password': '' },
+            'target': { 'database': 'bench', 'table': 'bench' }
+        }, job_id='bench')
+        Jobs().save(job)
+        tasks = Tasks()
+        for i in xrange(options.tasks):
+            tasks.enqueue({ 'key_name': 'file-%d' % i }, job_id=job.id, file_id=str(i))
+
+        ready = multiprocessing.Value('l', 0)
+        stop_at = multiprocessing.Value('d', 0)
+        claims = multiprocessing.Value('l', 0)
+        with LoaderStorage.fork_wrapper():
+            writers = [
+                multiprocessing.Process(target=write_loop, args=(ready, stop_at, options.pings, claims))
+                for _ in xrange(options.writers) ]
+            for writer in writers:
+                writer.start()
+        while ready.value < options.writers and all(writer.is_alive() for writer in writers):
+            time.sleep(0.1)
+        stop_at.value = time.time() + options.duration
+
+        latencies = []
+        readers = [
+            threading.Thread(target=read_loop, args=(stop_at.value, options.reads_under_write_lock, latencies))
+            for _ in xrange(options.readers) ]
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            reader.join()
+        for writer in writers:
+            writer.join()
+
+        latencies.sort()
+        print 'reads: %d in %.1f sec with %d writers and %d readers' % (
+            len(latencies), options.duration, options.writers, options.readers)
+        if latencies:
+            print 'read latency: p50 %.4f sec, p99 %.4f sec, max %.4f sec' % (
+                percentile(latencies, 0.5), percentile(latencies, 0.99), latencies[-1])
+        print 'writer claims: %.1f/sec' % (claims.value / options.duration)
+    finally:
+        shutil.rmtree(data_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+""" S3 listing benchmark for the glob2 S3Globber.
+
+Serves a bucket laid out as logs/<host>/<date>/part-<n> from a local S3
+stand-in (see s3_standin.py) with a simulated round trip, and globs it
+with increasing numbers of listing threads, reporting the time taken and
+the requests made.
+
+    python scripts/bench_s3_glob.py
+    python scripts/bench_s3_glob.py --hosts 100 --latency 0.05 --workers 1 16 64
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT_PATH = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.append(ROOT_PATH)
+
+from s3_standin import S3StandIn
+
+def make_keys(options):
+    for host in xrange(options.hosts):
+        for day in xrange(options.days):
+            for part in xrange(options.parts):
+                yield 'logs/host-%03d/2014-%02d-%02d/part-%04d' % (host, day / 28 + 1, day % 28 + 1, part)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hosts', type=int, default=20, help='Number of host prefixes.')
+    parser.add_argument('--days', type=int, default=30, help='Number of date prefixes per host.')
+    parser.add_argument('--parts', type=int, default=5, help='Number of keys per date prefix.')
+    parser.add_argument('--latency', type=float, default=0.02, help='Simulated seconds per S3 request.')
+    parser.add_argument('--pattern', default='logs/*/2014-*/part-*', help='Pattern to glob.')
+    parser.add_argument('--workers', type=int, nargs='+', default=[ 1, 4, 16, 32 ], help='Numbers of listing threads to glob with.')
+    parser.add_argument('--ordered', action='store_true', help='Yield matches in listing order.')
+    options = parser.parse_args()
+
+    from memsql_loader.vendor import glob2
+
+    keys = list(make_keys(options))
+    with S3StandIn(keys, latency=options.latency) as s3:
+        print 'keys: %d, pattern: %s, latency: %.0fms' % (len(keys), options.pattern, options.latency * 1000)
+        for max_workers in options.workers:
+            bucket = s3.connect().get_bucket(s3.bucket_name, validate=False)
+            globber = glob2.S3Globber(bucket, max_workers=max_workers)
+            s3.reset_counts()
+
+            start = time.time()
+            first = None
+            count = 0
+            for _ in globber.iglob(options.pattern, ordered=options.ordered):
+                if first is None:
+                    first = time.time() - start
+                count += 1
+            elapsed = time.time() - start
+
+            print 'workers: %3d  matches: %7d  time: %7.2fs  first match: %6.2fs  requests: %s' % (
+                max_workers, count, elapsed, first or 0, dict(s3.requests))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+""" Task throughput benchmark for sharded loader databases.
+
+Runs against a throwaway data directory, so it never touches
+~/.memsql-loader.  For each worker count, that many worker processes claim,
+ping and requeue tasks as fast as they can for --duration seconds, each with
+its own home shard like real workers, and the claim and write rates are
+reported.  The tasks are spread over --jobs jobs, which are spread over the
+shards.
+
+    python scripts/bench_task_shards.py --shards 1
+    python scripts/bench_task_shards.py --shards 4 --workers 32 64 128
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT_PATH = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.append(ROOT_PATH)
+
+def work_loop(slot, start_at, stop_at, pings, claims):
+    from memsql_loader.loader_db.tasks import Tasks
+
+    tasks = Tasks(home_shard=slot)
+    count = 0
+    time.sleep(max(0, start_at - time.time()))
+    while time.time() < stop_at:
+        task = tasks.start()
+        if task is None:
+            time.sleep(0.01)
+            continue
+        for _ in xrange(pings):
+            task.ping()
+        task.requeue()
+        count += 1
+    with claims.get_lock():
+        claims.value += count
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--shards', type=int, default=1, help='Number of task shards in the loader database.')
+    parser.add_argument('--workers', type=int, nargs='+', default=[ 32, 64, 128 ], help='Numbers of worker processes to run with.')
+    parser.add_argument('--jobs', type=int, default=16, help='Number of jobs to spread the tasks over.')
+    parser.add_argument('--tasks', type=int, default=10000, help='Number of tasks to enqueue.')
+    parser.add_argument('--pings', type=int, default=5, help='Number of heartbeats to send per claimed task.')
+    parser.add_argument('--duration', type=float, default=20, help='Seconds to run each worker count for.')
+    options = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix='memsql-loader-bench-')
+    os.environ['MEMSQL_LOADER_DATA_DIRECTORY'] = data_dir
+    os.environ['MEMSQL_LOADER_DB_SHARDS'] = str(options.shards)
+
+    # memsql_loader.api imports the loader database models, which import
+    # memsql_loader.api back, so it has to be imported first.
+    import memsql_loader.api.shared  # noqa
+    from memsql_loader.loader_db import shards
+    from memsql_loader.loader_db.storage import LoaderStorage
+    from memsql_loader.loader_db.tasks import Tasks
+    from memsql_loader.util import bootstrap
+    from memsql_loader.util.apsw_storage import WALCheckpointer
+
+    try:
+        bootstrap.bootstrap()
+        num_shards = shards.num_shards()
+        tasks = Tasks()
+        for i in xrange(options.tasks):
+            tasks.enqueue({ 'key_name': 'file-%d' % i }, job_id='bench-%d' % (i % options.jobs), file_id=str(i))
+
+        checkpointers = [ WALCheckpointer(LoaderStorage.shard(shard)) for shard in xrange(num_shards) ]
+        for checkpointer in checkpointers:
+            checkpointer.start()
+
+        print 'shards: %d, tasks: %d in %d jobs' % (num_shards, options.tasks, options.jobs)
+        for num_workers in options.workers:
+            claims = multiprocessing.Value('l', 0)
+            # Give every process time to start before the clock starts.
+            start_at = time.time() + 2 + num_workers * 0.02
+            stop_at = start_at + options.duration
+            with LoaderStorage.fork_wrapper():
+                workers = [
+                    multiprocessing.Process(target=work_loop, args=(slot, start_at, stop_at, options.pings, claims))
+                    for slot in xrange(num_workers) ]
+                for worker in workers:
+                    worker.start()
+            for worker in workers:
+                worker.join()
+
+            writes = claims.value * (options.pings + 2)
+            print 'workers: %4d  claims: %8.1f/sec  writes: %8.1f/sec' % (
+                num_workers, claims.value / options.duration, writes / options.duration)
+
+        for checkpointer in checkpointers:
+            checkpointer.stop()
+    finally:
+        shutil.rmtree(data_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+""" A local stand-in for S3, for benchmarking how the loader lists buckets.
+
+It serves just enough of the S3 REST API for boto to list keys (with prefix,
+delimiter, marker and max-keys) and to HEAD them, out of a sorted in-memory
+list of key names, and sleeps for a simulated round trip before every
+response.  It counts the requests it serves by type.
+
+    with S3StandIn(keys, latency=0.02) as s3:
+        bucket = s3.connect().get_bucket(s3.bucket_name, validate=False)
+"""
+import BaseHTTPServer
+import SocketServer
+import bisect
+import hashlib
+import threading
+import time
+import urllib
+import urlparse
+from collections import defaultdict
+from xml.sax.saxutils import escape
+
+from boto.s3.connection import S3Connection, OrdinaryCallingFormat
+
+LAST_MODIFIED = '2014-06-01T00:00:00.000Z'
+
+def key_etag(name):
+    return '"%s"' % hashlib.md5(name).hexdigest()
+
+def key_size(name):
+    return 1024 + len(name)
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send each response in one write, so that Nagle's algorithm doesn't
+    # add to the simulated latency.
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _split_path(self):
+        parsed = urlparse.urlparse(self.path)
+        parts = parsed.path.lstrip('/').split('/', 1)
+        key_name = urllib.unquote(parts[1]) if len(parts) > 1 else ''
+        return parts[0], key_name, urlparse.parse_qs(parsed.query, keep_blank_values=True)
+
+    def _respond(self, status, body='', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        standin = self.server.standin
+        _, key_name, _ = self._split_path()
+        standin._count('HEAD')
+        if not key_name:
+            return self._respond(200)
+        if not standin.has_key(key_name):
+            return self._respond(404)
+        self.send_response(200)
+        self.send_header('Content-Length', str(key_size(key_name)))
+        self.send_header('ETag', key_etag(key_name))
+        self.send_header('Last-Modified', 'Sun, 01 Jun 2014 00:00:00 GMT')
+        self.end_headers()
+
+    def do_GET(self):
+        standin = self.server.standin
+        _, key_name, query = self._split_path()
+        if key_name:
+            return self._respond(501)
+        standin._count('LIST')
+
+        arg = lambda name, default='': query.get(name, [default])[0]
+        body = standin.list_xml(
+            prefix=arg('prefix'), delimiter=arg('delimiter'), marker=arg('marker'),
+            max_keys=int(arg('max-keys', '1000')))
+        self._respond(200, body, { 'Content-Type': 'application/xml' })
+
+class S3StandIn(object):
+    bucket_name = 'bench'
+
+    def __init__(self, keys, latency=0.02):
+        self.keys = sorted(keys)
+        self._key_set = set(self.keys)
+        self.latency = latency
+        self.requests = defaultdict(int)
+        self._lock = threading.Lock()
+        self._server = None
+
+    def __enter__(self):
+        self._server = _Server(('127.0.0.1', 0), _Handler)
+        self._server.standin = self
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def connect(self):
+        return S3Connection(
+            anon=True, is_secure=False, host='127.0.0.1', port=self.port,
+            calling_format=OrdinaryCallingFormat())
+
+    def reset_counts(self):
+        with self._lock:
+            self.requests.clear()
+
+    def has_key(self, name):
+        return name in self._key_set
+
+    def _count(self, kind):
+        time.sleep(self.latency)
+        with self._lock:
+            self.requests[kind] += 1
+
+    def list_xml(self, prefix, delimiter, marker, max_keys):
+        contents = []
+        prefixes = []
+        i = bisect.bisect_left(self.keys, prefix)
+        if marker and delimiter and marker.endswith(delimiter):
+            # The marker is a common prefix, so everything under it has
+            # been listed already.
+            i = max(i, bisect.bisect_left(self.keys, marker + '\xff'))
+        elif marker:
+            i = max(i, bisect.bisect_right(self.keys, marker))
+        truncated = False
+        next_marker = None
+        while i < len(self.keys) and self.keys[i].startswith(prefix):
+            if len(contents) + len(prefixes) >= max_keys:
+                truncated = True
+                break
+            name = self.keys[i]
+            cut = name.find(delimiter, len(prefix)) if delimiter else -1
+            if cut >= 0:
+                common = name[:cut + len(delimiter)]
+                prefixes.append(common)
+                next_marker = common
+                # Skip the rest of the keys under this common prefix
+                i = bisect.bisect_left(self.keys, common + '\xff')
+            else:
+                contents.append(name)
+                next_marker = name
+                i += 1
+
+        parts = [ '<?xml version="1.0" encoding="UTF-8"?>',
+            '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">',
+            '<Name>%s</Name><Prefix>%s</Prefix><Marker>%s</Marker><MaxKeys>%d</MaxKeys>' % (
+                self.bucket_name, escape(prefix), escape(marker), max_keys),
+            '<IsTruncated>%s</IsTruncated>' % ('true' if truncated else 'false') ]
+        if truncated and delimiter:
+            parts.append('<NextMarker>%s</NextMarker>' % escape(next_marker))
+        for name in contents:
+            parts.append(
+                '<Contents><Key>%s</Key><LastModified>%s</LastModified><ETag>%s</ETag>'
+                '<Size>%d</Size><StorageClass>STANDARD</StorageClass></Contents>' % (
+                    escape(name), LAST_MODIFIED, escape(key_etag(name)), key_size(name)))
+        for common in prefixes:
+            parts.append('<CommonPrefixes><Prefix>%s</Prefix></CommonPrefixes>' % escape(common))
+        parts.append('</ListBucketResult>')
+        return ''.join(parts)
@@ -47,6 +47,7 @@ setup(
         'prettytable==0.7.2',
         'pywebhdfs==0.3.2',
         'requests==2.5.1',
+        'scandir==1.10.0',
     ],
     tests_require=[
         'docker-py==0.3.1',
@@ -0,0 +1,93 @@
+import os
+import sys
+
+import pytest
+
+# memsql_loader.api imports the loader database models, which import
+# memsql_loader.api back, so it has to be imported first.
+import memsql_loader.api.shared  # noqa
+
+from memsql_loader.loader_db import shards, storage
+from memsql_loader.util import apsw_helpers, bootstrap, mysql_storage, paths
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'scripts'))
+from s3_standin import S3StandIn  # noqa
+from mysql_standin import StandInConnection  # noqa
+
+# A MySQL/MemSQL database for the MySQL loader database tests, e.g.
+# mysql://root@127.0.0.1:3306/memsql_loader_test.  Its tables are dropped by
+# every test.  If it isn't set, the tests run on a stand-in (see
+# tests/mysql_standin.py).
+MEMSQL_LOADER_TEST_DB_URL_ENV = 'MEMSQL_LOADER_TEST_DB_URL'
+
+BASE_SPEC = {
+    'connection': { 'host': '127.0.0.1', 'port': 3306, 'user': 'root', 'password': '' },
+    'target': { 'database': 'db', 'table': 'tbl' }
+}
+
+def make_spec(**source):
+    """ A job spec that loads source into db.tbl. """
+    spec = dict(BASE_SPEC)
+    spec['source'] = source
+    return spec
+
+def reset_storage():
+    """ Closes the loader database, so that it is opened again from
+    scratch. """
+    for instance in [ storage.LoaderStorage._instance ] + storage.LoaderStorage._shards.values():
+        if instance is not None and instance.connected():
+            instance.close_connections()
+    storage.LoaderStorage._instance = None
+    storage.LoaderStorage._shards = {}
+
+@pytest.fixture
+def data_dir(tmpdir, monkeypatch):
+    """ A fresh, empty data directory. """
+    monkeypatch.setenv(paths.MEMSQL_LOADER_PATH_ENV, str(tmpdir.join('data')))
+    monkeypatch.delenv(storage.MEMSQL_LOADER_DB_URL_ENV, raising=False)
+    monkeypatch.delenv(storage.MEMSQL_LOADER_DB_MODE_ENV, raising=False)
+    monkeypatch.delenv(storage.MEMSQL_LOADER_DB_SHARDS_ENV, raising=False)
+    reset_storage()
+    yield tmpdir.join('data')
+    reset_storage()
+
+@pytest.fixture(params=[ 1, 4 ])
+def loader_db(request, data_dir, monkeypatch):
+    """ A bootstrapped loader database in a fresh data directory, with one
+    task shard and with several. """
+    monkeypatch.setenv(storage.MEMSQL_LOADER_DB_SHARDS_ENV, str(request.param))
+    bootstrap.bootstrap()
+    return storage.LoaderStorage()
+
+@pytest.fixture
+def mysql_loader_db(data_dir, tmpdir, monkeypatch):
+    """ A bootstrapped MySQL loader database, on the server at
+    $MEMSQL_LOADER_TEST_DB_URL or on a stand-in.  Returns its URL. """
+    url = os.getenv(MEMSQL_LOADER_TEST_DB_URL_ENV, None)
+    if url is None:
+        url = 'mysql://root@127.0.0.1:3306/memsql_loader_test'
+        monkeypatch.setattr(mysql_storage.database, 'Connection', StandInConnection.factory(str(tmpdir)))
+    monkeypatch.setenv(storage.MEMSQL_LOADER_DB_URL_ENV, url)
+    bootstrap.bootstrap(force=True)
+    return url
+
+@pytest.fixture
+def local_files(tmpdir):
+    """ A directory of five small files, f0 to f4. """
+    for i in range(5):
+        tmpdir.join('files', 'f%d' % i).write('x' * (i + 1), ensure=True)
+    return str(tmpdir.join('files'))
+
+def count_job_rows(job):
+    """ The number of rows job has in the task tables of its shard. """
+    shard_storage = storage.LoaderStorage.shard(shards.shard_for_job(job.id, shards.num_shards()))
+    with shard_storage.cursor() as cursor:
+        return dict(
+            (table, apsw_helpers.get(cursor, 'SELECT COUNT(*) AS count FROM %s WHERE job_id = ?' % table, job.id).count)
+            for table in ('tasks', 'tasks_history', 'job_stats'))
+
+@pytest.fixture
+def s3():
+    """ An S3 stand-in (see scripts/s3_standin.py) holding a few keys. """
+    with S3StandIn([ 'logs/a/1', 'logs/a/2', 'logs/b/1', 'other' ], latency=0) as s3:
+        yield s3
@@ -0,0 +1,82 @@
+""" A stand-in for a MySQL server, for testing MySQLStorage and the loader
+database on it where no MySQL server is available.
+
+StandInConnection has the part of memsql.common.database.Connection's
+interface that MySQLStorage uses, and runs the queries on a SQLite file per
+database, rewriting the MySQL-only syntax the loader sends.  Like a MySQL
+connection opened with the FOUND_ROWS client flag, it reports the rows an
+UPDATE matched.  SQLite locks the whole database rather than rows, so the
+stand-in can't tell whether row locks are taken; FOR UPDATE is dropped.
+
+    monkeypatch.setattr(mysql_storage.database, 'Connection', StandInConnection.factory(directory))
+"""
+import os
+import re
+import sqlite3
+
+from memsql.common import database
+
+_PARAM_RE = re.compile(r'%\((\w+)\)s|%s|%%')
+
+# (pattern, replacement) pairs applied to every query
+_REWRITES = [
+    (re.compile(r'\bFOR\s+UPDATE\b', re.IGNORECASE), ''),
+    (re.compile(r'\bINSERT\s+IGNORE\b', re.IGNORECASE), 'INSERT OR IGNORE'),
+    (re.compile(r'\bLAST_INSERT_ID\(\)', re.IGNORECASE), 'last_insert_rowid()'),
+    (re.compile(r'\bBIGINT\s+PRIMARY\s+KEY\s+AUTO_INCREMENT\b', re.IGNORECASE), 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+    (re.compile(r'\bCREATE\s+OR\s+REPLACE\s+VIEW\b', re.IGNORECASE), 'CREATE VIEW'),
+    (re.compile(r'information_schema\.statistics\s+WHERE\s+table_schema\s*=\s*DATABASE\(\)\s+AND\s+table_name\b', re.IGNORECASE),
+        "sqlite_master WHERE type = 'index' AND tbl_name"),
+    (re.compile(r'\bindex_name\b', re.IGNORECASE), 'name'),
+    (re.compile(r'SELECT\s+table_name\s+AS\s+name\s+FROM\s+information_schema\.tables\s+WHERE\s+table_schema\s*=\s*DATABASE\(\)', re.IGNORECASE),
+        "SELECT name FROM sqlite_master WHERE type IN ('table', 'view')"),
+    (re.compile(r'SELECT\s+table_name\s+AS\s+name\s+FROM\s+information_schema\.views\s+WHERE\s+table_schema\s*=\s*DATABASE\(\)', re.IGNORECASE),
+        "SELECT name FROM sqlite_master WHERE type = 'view'"),
+]
+
+_REPLACE_VIEW_RE = re.compile(r'^\s*CREATE\s+OR\s+REPLACE\s+VIEW\s+(\w+)', re.IGNORECASE)
+
+class StandInConnection(object):
+    def __init__(self, path, host=None, port=None, database=None, user=None, password=None, options=None):
+        self.host = host
+        self.port = port
+        self.database = database
+        self.options = options or {}
+        self._db = sqlite3.connect(path, isolation_level=None, timeout=10)
+        self._db.execute('PRAGMA journal_mode = WAL')
+
+    @classmethod
+    def factory(cls, directory, connections=None):
+        """ Returns a replacement for database.Connection that opens stand-in
+        connections to databases in directory, and appends them to
+        connections if it is given. """
+        def connect(host, port=3306, database='information_schema', user=None, password=None, options=None):
+            conn = cls(
+                os.path.join(directory, database + '.db'), host=host, port=port,
+                database=database, user=user, password=password, options=options)
+            if connections is not None:
+                connections.append(conn)
+            return conn
+        return connect
+
+    def query(self, query, *parameters, **kwparameters):
+        if query.strip().upper().startswith('SET '):
+            return 0
+        match = _REPLACE_VIEW_RE.match(query)
+        if match is not None:
+            self._db.execute('DROP VIEW IF EXISTS %s' % match.group(1))
+
+        for pattern, replacement in _REWRITES:
+            query = pattern.sub(replacement, query)
+        params = kwparameters or parameters
+        if params:
+            # Only queries with parameters go through % formatting
+            query = _PARAM_RE.sub(lambda m: ':' + m.group(1) if m.group(1) else ('?' if m.group(0) == '%s' else '%'), query)
+
+        cursor = self._db.execute(query, params)
+        if cursor.description is None:
+            return max(cursor.rowcount, 0)
+        return database.SelectResult([ column[0] for column in cursor.description ], cursor.fetchall())
+
+    def close(self):
+        self._db.close()
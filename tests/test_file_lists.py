@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from memsql_loader.util import file_lists
+
+@pytest.mark.parametrize('path, expected', [
+    ('s3://bucket/dir/key.csv', ('s3', 'bucket', 'dir/key.csv')),
+    ('s3://bucket/dir/a#1.csv', ('s3', 'bucket', 'dir/a#1.csv')),
+    ('s3://bucket/dir/a?b=1.csv', ('s3', 'bucket', 'dir/a?b=1.csv')),
+    ('s3://bucket/dir/a b.csv', ('s3', 'bucket', 'dir/a b.csv')),
+    ('s3://bucket/a?b#c d', ('s3', 'bucket', 'a?b#c d')),
+    ('hdfs://namenode/data/a#1?x', ('hdfs', None, 'namenode/data/a#1?x')),
+    ('hdfs:///data/a b', ('hdfs', None, 'data/a b')),
+    ('/data/a#1.tsv', ('file', None, '/data/a#1.tsv')),
+    ('/data/a?.tsv', ('file', None, '/data/a?.tsv')),
+    ('/data/a b.tsv', ('file', None, '/data/a b.tsv')),
+    ('/data/a://b', ('file', None, '/data/a://b')),
+    ('file:///data/a#b?c', ('file', None, '/data/a#b?c')),
+    ('S3://bucket/key', ('s3', 'bucket', 'key')),
+])
+def test_parse_path(path, expected):
+    assert file_lists.parse_path(path) == expected
+
+def test_parse_path_unknown_scheme():
+    with pytest.raises(file_lists.InvalidFileList):
+        file_lists.parse_path('ftp://host/file')
+
+def test_iter_entries_keeps_special_characters():
+    lines = [
+        '# a comment',
+        '',
+        's3://bucket/a#1.csv',
+        's3://bucket/b?x=1.csv',
+        '  s3://bucket/c d.csv  ',
+        u's3://bucket/é.csv'.encode('utf-8'),
+    ]
+    entries = list(file_lists.iter_entries(lines, file_lists.LINES))
+    assert [ entry.name for entry in entries ] == [ 'a#1.csv', 'b?x=1.csv', 'c d.csv', u'é.csv' ]
+    assert all(entry.bucket == 'bucket' and entry.size is None for entry in entries)
+
+def test_iter_entries_csv():
+    lines = [
+        'path,size,etag',
+        's3://bucket/a#1.csv,10,abc',
+        '"s3://bucket/b, c?.csv",,',
+    ]
+    entries = list(file_lists.iter_entries(lines, file_lists.CSV))
+    assert entries == [
+        file_lists.FileListEntry('s3', 'bucket', 'a#1.csv', 10, 'abc'),
+        file_lists.FileListEntry('s3', 'bucket', 'b, c?.csv', None, None),
+    ]
+
+def test_iter_entries_jsonl():
+    lines = [ '{"path": "/data/a #1?.tsv", "size": 3}' ]
+    entries = list(file_lists.iter_entries(lines, file_lists.JSONL))
+    assert entries == [ file_lists.FileListEntry('file', None, '/data/a #1?.tsv', 3, None) ]
+
+def test_iter_entries_invalid_size():
+    with pytest.raises(file_lists.InvalidFileList):
+        list(file_lists.iter_entries([ '/data/a,big' ], file_lists.CSV))
@@ -0,0 +1,46 @@
+import os
+
+import pytest
+
+from memsql_loader.vendor import glob2
+
+@pytest.fixture
+def tree(tmpdir):
+    """ root/dir/{1.csv, sub/2.csv}, and root/dir/lnk, a link to
+    root/target/{3.csv, deep/4.csv}. """
+    for name in [ 'dir/1.csv', 'dir/sub/2.csv', 'target/3.csv', 'target/deep/4.csv' ]:
+        tmpdir.join(name).write('x', ensure=True)
+    os.symlink(str(tmpdir.join('target')), str(tmpdir.join('dir/lnk')))
+    return str(tmpdir)
+
+def _files(root, pattern, max_workers=1):
+    globber = glob2.Globber(max_workers=max_workers)
+    return sorted(entry.name[len(root) + 1:] for entry in globber.iter_files(os.path.join(root, pattern)))
+
+@pytest.mark.parametrize('max_workers', [ 1, 4 ])
+def test_segment_after_globstar_finds_symlinked_dir(tree, max_workers):
+    assert _files(tree, 'dir/**/lnk/*', max_workers) == [ 'dir/lnk/3.csv' ]
+    assert _files(tree, '**/lnk/*', max_workers) == [ 'dir/lnk/3.csv' ]
+
+@pytest.mark.parametrize('max_workers', [ 1, 4 ])
+def test_globstar_descends_into_symlinked_dir(tree, max_workers):
+    assert _files(tree, 'dir/**/*.csv', max_workers) == [
+        'dir/1.csv', 'dir/lnk/3.csv', 'dir/lnk/deep/4.csv', 'dir/sub/2.csv' ]
+
+@pytest.mark.parametrize('max_workers', [ 1, 4 ])
+def test_globstar_stops_at_link_cycles(tree, max_workers):
+    # A link to an ancestor, and two links into each other's directories
+    os.symlink(os.path.join(tree, 'dir'), os.path.join(tree, 'dir/sub/up'))
+    os.symlink(os.path.join(tree, 'dir/sub'), os.path.join(tree, 'target/deep/across'))
+    assert _files(tree, 'dir/**', max_workers) == [
+        'dir/1.csv',
+        'dir/lnk/3.csv',
+        'dir/lnk/deep/4.csv',
+        'dir/lnk/deep/across/2.csv',
+        'dir/sub/2.csv' ]
+
+def test_globstar_matches_iglob(tree):
+    pattern = os.path.join(tree, 'dir/**/lnk/*.csv')
+    globber = glob2.Globber()
+    expected = sorted(path for path in globber.iglob(pattern) if not os.path.isdir(path))
+    assert sorted(entry.name for entry in globber.iter_files(pattern)) == expected
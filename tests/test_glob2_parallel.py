@@ -0,0 +1,58 @@
+import threading
+import time
+
+import pytest
+
+from memsql_loader.vendor.glob2.parallel import ThreadPool
+
+def test_imap_ordered():
+    with ThreadPool(4) as pool:
+        assert list(pool.imap(lambda x: x * 2, range(100), True)) == [ x * 2 for x in range(100) ]
+
+def test_imap_unordered():
+    with ThreadPool(4) as pool:
+        assert sorted(pool.imap(lambda x: x * 2, range(100))) == [ x * 2 for x in range(100) ]
+
+def test_imap_reraises():
+    def fail(x):
+        if x == 3:
+            raise ValueError(x)
+        return x
+
+    with ThreadPool(2) as pool:
+        with pytest.raises(ValueError):
+            list(pool.imap(fail, range(10), True))
+
+def test_workers_start_on_first_use():
+    before = threading.active_count()
+    with ThreadPool(4) as pool:
+        assert threading.active_count() == before
+        list(pool.imap(abs, range(10)))
+        assert threading.active_count() == before + 4
+
+def test_close_joins_workers():
+    pool = ThreadPool(4)
+    list(pool.imap(time.sleep, [ 0.01 ] * 8))
+    threads = list(pool._threads)
+    pool.close()
+    assert not any(thread.is_alive() for thread in threads)
+
+def test_close_gives_up_after_timeout():
+    event = threading.Event()
+    pool = ThreadPool(1)
+    consumer = threading.Thread(target=list, args=(pool.imap(lambda x: event.wait(), [ 1 ]),))
+    consumer.daemon = True
+    consumer.start()
+    while not pool._threads or not pool._tasks.empty():
+        time.sleep(0.01)
+    threads = list(pool._threads)
+
+    start = time.time()
+    pool.close(timeout=0.1)
+    assert time.time() - start < 1
+    assert threads[0].is_alive()
+
+    event.set()
+    consumer.join()
+    threads[0].join(1)
+    assert not threads[0].is_alive()
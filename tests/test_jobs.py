@@ -0,0 +1,64 @@
+import time
+
+from memsql_loader.loader_db.jobs import Job, Jobs, DEFAULT_LIST_CONCURRENCY
+from memsql_loader.loader_db.tasks import Tasks
+from memsql_loader.vendor import glob2
+
+from conftest import count_job_rows, make_spec
+
+def _record_max_workers(monkeypatch, name):
+    max_workers = []
+    Globber = getattr(glob2, name)
+
+    class RecordingGlobber(Globber):
+        def __init__(self, *args, **kwargs):
+            super(RecordingGlobber, self).__init__(*args, **kwargs)
+            max_workers.append(self.max_workers)
+
+    monkeypatch.setattr(glob2, name, RecordingGlobber)
+    return max_workers
+
+def _make_files(tmpdir):
+    for name in [ 'a/1', 'a/2', 'b/1' ]:
+        tmpdir.join(name).write('x', ensure=True)
+
+def test_local_files_listed_on_one_thread_by_default(tmpdir, monkeypatch):
+    _make_files(tmpdir)
+    max_workers = _record_max_workers(monkeypatch, 'Globber')
+    job = Job(make_spec(paths=[ str(tmpdir) + '/*/*' ]))
+    names = sorted(key.name[len(str(tmpdir)):] for key in job.get_files())
+    assert names == [ '/a/1', '/a/2', '/b/1' ]
+    assert max_workers == [ 1 ]
+
+def test_local_files_listed_concurrently_if_asked(tmpdir, monkeypatch):
+    _make_files(tmpdir)
+    max_workers = _record_max_workers(monkeypatch, 'Globber')
+    job = Job(make_spec(paths=[ str(tmpdir) + '/**' ]))
+    assert len(list(job.get_files(list_concurrency=4, ordered=True))) == 3
+    assert max_workers == [ 4 ]
+
+def test_s3_listed_concurrently_by_default(s3, monkeypatch):
+    max_workers = _record_max_workers(monkeypatch, 'S3Globber')
+    job = Job(make_spec(paths=[ 's3://%s/logs/*/*' % s3.bucket_name ]))
+    names = sorted(key.name for key in job.get_files(s3_conn=s3.connect()))
+    assert names == [ 'logs/a/1', 'logs/a/2', 'logs/b/1' ]
+    assert max_workers == [ DEFAULT_LIST_CONCURRENCY ]
+
+def test_delete_removes_tasks(loader_db, local_files):
+    job = Job(make_spec(paths=[ local_files + '/*' ]))
+    jobs = Jobs()
+    jobs.save(job)
+    tasks = Tasks()
+    # Finished and archived tasks, and queued ones
+    for key in job.get_files():
+        job.enqueue_file(tasks, key)
+    tasks.bulk_finish()
+    while tasks.archive(finished_before=time.time() + 1):
+        pass
+    for key in job.get_files():
+        job.enqueue_file(tasks, key)
+    assert count_job_rows(job) == { 'tasks': 5, 'tasks_history': 5, 'job_stats': 1 }
+
+    jobs.delete(job)
+    assert jobs.get(job.id) is None
+    assert count_job_rows(job) == { 'tasks': 0, 'tasks_history': 0, 'job_stats': 0 }
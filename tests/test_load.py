@@ -0,0 +1,135 @@
+import pytest
+
+from memsql_loader.api import shared
+from memsql_loader.cli import load
+from memsql_loader.loader_db import manifests
+from memsql_loader.loader_db.jobs import Job, Jobs
+from memsql_loader.loader_db.storage import LoaderStorage
+from memsql_loader.loader_db.tasks import Tasks
+from memsql_loader.util import apsw_helpers, log
+from memsql_loader.util.attr_dict import AttrDict
+
+from conftest import count_job_rows, make_spec
+
+class ListingFailed(Exception):
+    pass
+
+def _run_load(job, **options):
+    """ A RunLoad for job, ready to queue it. """
+    run_load = load.RunLoad.__new__(load.RunLoad)
+    run_load.options = AttrDict({ 'list_concurrency': None, 'dry_run': False, 'force': False, 'sync': False })
+    run_load.options.update(options)
+    run_load.logger = log.get_logger('Load')
+    run_load.s3_conn = None
+    run_load.job = job
+    return run_load
+
+def _fail_after(job, count, before_failing=None):
+    """ Makes job.get_files raise once it has yielded count files, calling
+    before_failing first if it is given. """
+    get_files = job.get_files
+
+    def failing_get_files(**kwargs):
+        for i, key in enumerate(get_files(**kwargs)):
+            if i == count:
+                if before_failing is not None:
+                    before_failing()
+                raise ListingFailed()
+            yield key
+    job.get_files = failing_get_files
+
+def test_failed_listing_rolls_back_queued_tasks(loader_db, local_files, monkeypatch):
+    monkeypatch.setattr(load, 'SUBMIT_BATCH_SIZE', 2)
+    job = Job(make_spec(paths=[ local_files + '/*' ]))
+    _fail_after(job, 3)
+
+    with pytest.raises(ListingFailed):
+        _run_load(job).queue_job()
+
+    assert Jobs().get(job.id) is None
+    assert count_job_rows(job) == { 'tasks': 0, 'tasks_history': 0, 'job_stats': 0 }
+
+def test_failed_listing_keeps_started_tasks(loader_db, local_files, monkeypatch):
+    monkeypatch.setattr(load, 'SUBMIT_BATCH_SIZE', 2)
+    monkeypatch.setattr(manifests, 'FILTER_BATCH_SIZE', 2)
+    spec = make_spec(paths=[ local_files + '/*' ], incremental='changed')
+    job = Job(spec)
+    # A worker claims one of the first batch's tasks while the rest is listed
+    started = []
+    _fail_after(job, 3, lambda: started.append(Tasks().start()))
+
+    with pytest.raises(ListingFailed):
+        _run_load(job).queue_job()
+
+    assert Jobs().get(job.id) is not None
+    stats = Tasks().get_job_stats(job.id)
+    assert (stats.tasks_total, stats.tasks_claimed, stats.tasks_cancelled) == (2, 1, 1)
+    started[0].finish()
+
+    # The next load queues the cancelled file and the ones never queued
+    monkeypatch.setattr(load.servers, 'is_server_running', lambda: True)
+    job = Job(spec)
+    _run_load(job).queue_job()
+    assert count_job_rows(job)['tasks'] == 4
+
+def _count(table):
+    with LoaderStorage().cursor() as cursor:
+        return apsw_helpers.get(cursor, 'SELECT COUNT(*) AS n FROM %s' % table).n
+
+def test_failed_incremental_load_records_no_files(loader_db, local_files, monkeypatch):
+    monkeypatch.setattr(load, 'SUBMIT_BATCH_SIZE', 2)
+    monkeypatch.setattr(manifests, 'FILTER_BATCH_SIZE', 2)
+    monkeypatch.setattr(load.servers, 'is_server_running', lambda: True)
+    spec = make_spec(paths=[ local_files + '/*' ], incremental='changed')
+    job = Job(spec)
+    _fail_after(job, 3)
+
+    with pytest.raises(ListingFailed):
+        _run_load(job).queue_job()
+
+    assert _count('manifest_files') == 0
+    assert _count('manifest_staged_files') == 0
+
+    # The next load queues every file, and records them all
+    job = Job(spec)
+    _run_load(job).queue_job()
+
+    assert count_job_rows(job)['tasks'] == 5
+    assert _count('manifest_files') == 5
+    assert _count('manifest_staged_files') == 0
+
+def test_incremental_load_queues_failed_files_again(loader_db, local_files, monkeypatch):
+    monkeypatch.setattr(load.servers, 'is_server_running', lambda: True)
+    spec = make_spec(paths=[ local_files + '/*' ], incremental='changed')
+    job = Job(spec)
+    _run_load(job).queue_job()
+
+    tasks = Tasks()
+    tasks.start().error('failed')
+    tasks.start().finish()
+    # Still being loaded
+    tasks.start()
+    tasks.bulk_finish(extra_predicate=('job_id = :job_id AND execution_id IS NULL', { 'job_id': job.id }))
+
+    job = Job(spec)
+    _run_load(job).queue_job()
+
+    # The errored file, and the two that were cancelled before they started
+    assert count_job_rows(job)['tasks'] == 3
+
+def test_incremental_load_skips_files_loaded_by_other_jobs(loader_db, s3, monkeypatch):
+    monkeypatch.setattr(load.servers, 'is_server_running', lambda: True)
+    job = Job(make_spec(paths=[ 's3://%s/logs/a/*' % s3.bucket_name ]))
+    run_load = _run_load(job)
+    run_load.s3_conn = s3.connect()
+    run_load.queue_job()
+
+    # Not in the manifest of this path, but identical to the files above
+    job = Job(make_spec(paths=[ 's3://%s/logs/*/*' % s3.bucket_name ], incremental='changed'))
+    run_load = _run_load(job)
+    run_load.s3_conn = s3.connect()
+    run_load.queue_job()
+
+    names = [ task.data['key_name'] for task in Tasks().get_tasks_in_state(
+        [ shared.TaskState.QUEUED ], extra_predicate=('job_id = :job_id', { 'job_id': job.id })) ]
+    assert names == [ 'logs/b/1' ]
@@ -0,0 +1,50 @@
+import os
+
+import pytest
+
+from memsql_loader.loader_db import local_watcher
+from memsql_loader.loader_db.jobs import Job
+from memsql_loader.util import inotify
+
+from conftest import make_spec
+
+pytestmark = pytest.mark.skipif(not inotify.is_supported(), reason='inotify is not supported')
+
+@pytest.fixture
+def watcher():
+    watcher = local_watcher.LocalWatcher()
+    yield watcher
+    watcher.close()
+
+def _read_names(watcher, job):
+    """ The names of the files job's paths got from one read. """
+    overflowed, keys = watcher.read(1)
+    assert not overflowed
+    return sorted(key.name for key in keys[job.id])
+
+def test_links_to_directories_are_followed(watcher, tmpdir):
+    data = tmpdir.join('data')
+    data.ensure('a', dir=True)
+    tmpdir.ensure('elsewhere', dir=True)
+    # A link to a directory outside the path, and links back to it
+    os.symlink(str(tmpdir.join('elsewhere')), str(data.join('linked')))
+    os.symlink(str(data), str(data.join('a', 'loop')))
+    os.symlink('.', str(data.join('self')))
+
+    job = Job(make_spec(paths=[ str(data) + '/**/*.csv' ]), 'job')
+    assert watcher.add(job)
+    tmpdir.join('elsewhere', 'f.csv').write('x')
+    data.join('a', 'f.csv').write('x')
+
+    assert _read_names(watcher, job) == [ str(data.join('a', 'f.csv')), str(data.join('linked', 'f.csv')) ]
+
+def test_directories_reached_through_several_paths(watcher, tmpdir):
+    data = tmpdir.join('data')
+    data.ensure('a', dir=True)
+    os.symlink(str(data.join('a')), str(data.join('b')))
+
+    job = Job(make_spec(paths=[ str(data) + '/*/*.csv' ]), 'job')
+    assert watcher.add(job)
+    data.join('a', 'f.csv').write('x')
+
+    assert _read_names(watcher, job) == [ str(data.join('a', 'f.csv')), str(data.join('b', 'f.csv')) ]
@@ -0,0 +1,143 @@
+import pytest
+
+from memsql_loader.loader_db import migrations, storage
+from memsql_loader.loader_db.jobs import Job, Jobs
+from memsql_loader.loader_db.storage import LoaderStorage
+from memsql_loader.loader_db.tasks import Tasks
+from memsql_loader.util import apsw_helpers, mysql_storage
+
+from conftest import count_job_rows, make_spec
+
+def test_translate_query():
+    query = "SELECT ':x', ?, :name, 100 % 7 FROM t WHERE a = '%s'"
+    assert mysql_storage.translate_query(query) == "SELECT ':x', %s, %(name)s, 100 %% 7 FROM t WHERE a = '%%s'"
+    assert mysql_storage.translate_query(query, escape=False) == "SELECT ':x', %s, %(name)s, 100 % 7 FROM t WHERE a = '%s'"
+
+def test_connections_report_matched_rows(mysql_loader_db, monkeypatch):
+    # The stand-in always reports matched rows, so check the flag as well
+    options = []
+    connect = mysql_storage.database.Connection
+    def recording_connect(**kwargs):
+        options.append(kwargs['options'])
+        return connect(**kwargs)
+    monkeypatch.setattr(mysql_storage.database, 'Connection', recording_connect)
+
+    loader_storage = mysql_storage.MySQLStorage.from_url(mysql_loader_db)
+    try:
+        assert all(option['client_flag'] & mysql_storage.CLIENT.FOUND_ROWS for option in options)
+        with loader_storage.transaction() as cursor:
+            cursor.execute('CREATE TABLE IF NOT EXISTS found_rows (id INT PRIMARY KEY, value INT)')
+            cursor.execute('INSERT INTO found_rows (id, value) VALUES (1, 1)')
+            # Changes nothing, but matches the row
+            cursor.execute('UPDATE found_rows SET value = 1 WHERE id = 1')
+            assert loader_storage.transaction_changes() == 1
+    finally:
+        loader_storage.close_connections()
+
+def test_create_index_if_not_exists(mysql_loader_db):
+    loader_storage = LoaderStorage()
+    with loader_storage.transaction() as cursor:
+        cursor.execute('CREATE TABLE IF NOT EXISTS indexed (id INT PRIMARY KEY, value INT)')
+        for _ in range(2):
+            cursor.execute('CREATE INDEX IF NOT EXISTS indexed_value_idx ON indexed (value)')
+    # Every table's indexes are created again
+    Tasks().setup()
+    Jobs().setup()
+
+def test_nested_transactions_roll_back_together(mysql_loader_db):
+    loader_storage = LoaderStorage()
+    with pytest.raises(ValueError):
+        with loader_storage.transaction() as cursor:
+            cursor.execute('INSERT INTO loader_schema_version (version) VALUES (?)', (1000,))
+            with loader_storage.transaction() as cursor:
+                raise ValueError()
+    with loader_storage.cursor() as cursor:
+        assert apsw_helpers.get(cursor, 'SELECT MAX(version) AS version FROM loader_schema_version').version < 1000
+
+def _queue_job(tasks, count):
+    job = Job(make_spec(paths=[ '/tmp/*' ]))
+    Jobs().save(job)
+    for i in range(count):
+        tasks.enqueue({ 'key_name': str(i) }, job_id=job.id, file_id=str(i), md5=str(i), bytes_total=10)
+    return job
+
+def test_job_stats_are_kept_up_to_date(mysql_loader_db):
+    tasks = Tasks()
+    job = _queue_job(tasks, 4)
+    stats = tasks.get_job_stats(job.id)
+    assert (stats.tasks_total, stats.tasks_claimed, stats.bytes_total) == (4, 0, 40)
+    assert stats.bytes_downloaded is None and stats.first_task_start is None
+
+    succeeded = tasks.start()
+    errored = tasks.start()
+    stats = tasks.get_job_stats(job.id)
+    assert stats.tasks_claimed == 2
+    assert stats.first_task_start == min(succeeded.started, errored.started)
+
+    succeeded.bytes_downloaded = 10
+    succeeded.data['row_count'] = 7
+    with succeeded.step('download'):
+        pass
+    succeeded.finish()
+    errored.error('failed')
+    requeued = tasks.start()
+    requeued.requeue()
+    assert tasks.bulk_finish(extra_predicate=('job_id = :job_id', { 'job_id': job.id })) == 2
+
+    stats = tasks.get_job_stats(job.id)
+    assert (stats.tasks_total, stats.tasks_finished, stats.tasks_claimed) == (4, 4, 0)
+    assert (stats.tasks_succeeded, stats.tasks_errored, stats.tasks_cancelled) == (1, 1, 2)
+    assert (stats.bytes_total, stats.bytes_downloaded, stats.rows_loaded) == (40, 10, 7)
+    assert stats.download_start == succeeded._get_step('download')['start']
+    assert stats.download_stop == succeeded._get_step('download')['stop']
+
+    Jobs().delete(job)
+    assert count_job_rows(job) == { 'tasks': 0, 'tasks_history': 0, 'job_stats': 0 }
+
+def test_claims_are_exclusive_across_hosts(mysql_loader_db, monkeypatch):
+    host_a = Tasks()
+    # Another host has a storage of its own
+    storage.LoaderStorage._instance = None
+    host_b = Tasks()
+    host_a_storage = host_a.shards[0].storage
+    assert host_a_storage is not host_b.shards[0].storage
+
+    try:
+        _queue_job(host_a, 1)
+        shard_b = host_b.shards[0]
+        query_queued = shard_b._query_queued
+        with shard_b.storage.cursor() as cursor:
+            candidates = query_queued(cursor, 'id, created, data', limit=5)
+
+        # Host b read the task as queued just before host a claimed it
+        claimed = host_a.start()
+        assert claimed is not None
+        reads = []
+        def stale_query_queued(cursor, projection, **kwargs):
+            reads.append(projection)
+            return candidates if len(reads) == 1 else query_queued(cursor, projection, **kwargs)
+        monkeypatch.setattr(shard_b, '_query_queued', stale_query_queued)
+
+        assert shard_b._dequeue_task() is None
+        assert len(reads) == 2
+        assert host_b.get_job_stats(claimed.job_id).tasks_claimed == 1
+    finally:
+        host_a_storage.close_connections()
+
+def test_job_stats_view_is_migrated_to_a_table(mysql_loader_db):
+    tasks = Tasks()
+    job = _queue_job(tasks, 3)
+    tasks.start().finish()
+
+    loader_storage = LoaderStorage()
+    with loader_storage.transaction() as cursor:
+        cursor.execute('DROP TABLE job_stats')
+        cursor.execute('CREATE OR REPLACE VIEW job_stats AS SELECT job_id FROM all_tasks GROUP BY job_id')
+        loader_storage.set_schema_version(cursor, 10)
+    migrations.migrate(loader_storage)
+
+    stats = tasks.get_job_stats(job.id)
+    assert (stats.tasks_total, stats.tasks_finished, stats.tasks_succeeded, stats.bytes_total) == (3, 1, 1, 30)
+    # The table is kept up to date from here on
+    tasks.start().finish()
+    assert tasks.get_job_stats(job.id).tasks_finished == 2
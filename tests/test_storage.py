@@ -0,0 +1,110 @@
+import os
+import shutil
+
+import apsw
+import pytest
+
+from memsql_loader.loader_db import storage
+from memsql_loader.loader_db.jobs import Job, Jobs
+from memsql_loader.util import bootstrap, servers
+from memsql_loader.util.apsw_storage import Snapshotter
+
+from conftest import make_spec, reset_storage
+
+@pytest.fixture
+def running_server(data_dir):
+    """ Makes this process look like a running server in data_dir. """
+    data_dir.ensure(dir=True)
+    data_dir.join('memsql-loader.pid').write('%d\n' % os.getpid())
+    yield
+    servers.delete_mode_file()
+    servers.delete_pid_file()
+
+def test_mode_defaults_to_disk(data_dir):
+    assert storage.get_loader_db_mode() == storage.DISK_MODE
+
+def test_clients_follow_the_servers_mode(running_server):
+    servers.write_mode_file(storage.MEMORY_MODE)
+    assert storage.get_loader_db_mode() == storage.MEMORY_MODE
+    assert storage.get_shard_db_path(0).startswith(storage.get_memory_dir())
+
+def test_clients_refuse_a_different_mode(running_server, monkeypatch):
+    servers.write_mode_file(storage.MEMORY_MODE)
+    monkeypatch.setenv(storage.MEMSQL_LOADER_DB_MODE_ENV, storage.DISK_MODE)
+    with pytest.raises(storage.LoaderDbModeMismatch):
+        storage.get_loader_db_mode()
+
+def test_mode_file_of_a_stopped_server_is_ignored(data_dir):
+    data_dir.ensure(dir=True)
+    servers.write_mode_file(storage.MEMORY_MODE)
+    try:
+        assert storage.get_loader_db_mode() == storage.DISK_MODE
+    finally:
+        servers.delete_mode_file()
+
+class _FailingStorage(object):
+    path = 'loader.db'
+
+    def snapshot(self, path):
+        raise apsw.IOError('disk full')
+
+class _RecordingLogger(object):
+    def __init__(self):
+        self.warnings = []
+
+    def warning(self, msg, *args):
+        self.warnings.append(msg % args)
+
+def test_failed_snapshots_are_logged():
+    snapshotter = Snapshotter([ (_FailingStorage(), 'snapshot.db') ])
+    snapshotter.logger = _RecordingLogger()
+
+    assert not snapshotter.snapshot()
+    assert snapshotter.get_metrics()['failed_snapshots'] == 1
+    assert len(snapshotter.logger.warnings) == 1
+    assert 'disk full' in snapshotter.logger.warnings[0]
+
+@pytest.fixture
+def switch_mode(data_dir, monkeypatch):
+    """ Switches the loader database to a mode, as if a new process had
+    been started in it. """
+    def switch(mode):
+        reset_storage()
+        monkeypatch.setenv(storage.MEMSQL_LOADER_DB_MODE_ENV, mode)
+        bootstrap.bootstrap()
+    yield switch
+    shutil.rmtree(storage.get_memory_dir(), ignore_errors=True)
+
+def _stop_memory_mode():
+    """ What a stopping memory mode server does to the loader database. """
+    assert Snapshotter([
+        (storage.LoaderStorage.shard(0), storage.get_shard_snapshot_path(0)) ]).stop()
+    reset_storage()
+    storage.discard_memory_copy()
+
+def test_mode_round_trip_keeps_disk_mode_changes(switch_mode):
+    switch_mode(storage.MEMORY_MODE)
+    memory_job = Job(make_spec(paths=[ '/tmp/*' ]))
+    Jobs().save(memory_job)
+    _stop_memory_mode()
+
+    switch_mode(storage.DISK_MODE)
+    assert Jobs().get(memory_job.id) is not None
+    disk_job = Job(make_spec(paths=[ '/tmp/*' ]))
+    Jobs().save(disk_job)
+
+    switch_mode(storage.MEMORY_MODE)
+    assert Jobs().get(memory_job.id) is not None
+    assert Jobs().get(disk_job.id) is not None
+
+def test_drop_removes_the_memory_copy(switch_mode):
+    switch_mode(storage.MEMORY_MODE)
+    job = Job(make_spec(paths=[ '/tmp/*' ]))
+    Jobs().save(job)
+
+    # Dropped in disk mode, without a final snapshot
+    switch_mode(storage.DISK_MODE)
+    bootstrap.bootstrap(force=True)
+
+    switch_mode(storage.MEMORY_MODE)
+    assert Jobs().get(job.id) is None
@@ -0,0 +1,27 @@
+from memsql_loader.loader_db.jobs import Job, Jobs
+from memsql_loader.loader_db.storage import LoaderStorage
+from memsql_loader.loader_db.watcher import JobWatcher
+from memsql_loader.loader_db.watches import Watches
+
+from conftest import count_job_rows, make_spec
+
+def _due_watch(local_files):
+    job = Job(make_spec(paths=[ local_files + '/*' ], watch=True, incremental='changed'))
+    Jobs().save(job)
+    Watches().start(job)
+    with LoaderStorage().transaction() as cursor:
+        cursor.execute('UPDATE job_watches SET next_scan = next_scan - 3600 WHERE job_id = ?', (job.id,))
+    return job
+
+def test_due_watches_are_scanned_once(loader_db, local_files):
+    job = _due_watch(local_files)
+    # Both servers read the watch as due before either scans it
+    server_a, server_b = JobWatcher(), JobWatcher()
+    due_a, due_b = Watches().get_due(), Watches().get_due()
+
+    assert [ server_a.scan(watch) for watch in due_a ] == [ 5 ]
+    # Server b doesn't even look the job up
+    server_b._jobs = None
+    assert [ server_b.scan(watch) for watch in due_b ] == [ 0 ]
+    assert count_job_rows(job)['tasks'] == 5
+    assert Watches().get_due() == []